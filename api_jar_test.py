@@ -0,0 +1,479 @@
+"""API HTTP/JSON locale de Jar Test : enregistrement et consultation des essais sans navigateur.
+
+Sert, au-dessus du DatabaseManager et du ConfigManager de l'application Streamlit (même
+stockage, choisi par JAR_TEST_BASE, et mêmes catalogues de réactifs), les routes :
+
+    GET  /api/sante                            état du service et nombre de mesures
+    POST /api/sessions                         création d'une session et envoi groupé de ses essais
+    GET  /api/sessions                         sessions par pages (mêmes filtres que /api/mesures)
+    GET  /api/sessions/{id}                    conditions et essais d'une session
+    POST /api/sessions/{id}/essais             ajout ou mise à jour groupée d'essais d'une session
+    GET  /api/sessions/{id}/rapport            rapport HTML de la session
+    GET  /api/mesures                          recherche par pages : texte, période, plages, facettes
+    GET  /api/mesures/flux                     toutes les mesures trouvées, en flux NDJSON ou CSV
+    GET  /api/facettes                         nombre de mesures par valeur de chaque facette
+    GET  /api/eau-brute/{site}/statistiques    moyenne et écart-type glissants de l'eau brute
+    GET  /api/eau-brute/{site}/{parametre}     série agrégée d'un paramètre de l'eau brute
+    GET  /api/historique/{site}/{colonne}      historique réduit d'une colonne des essais
+    GET  /api/comparaison                      agrégats mensuels de comparaison entre sites
+
+Le serveur est asynchrone ; les accès à la base, bloquants, sont exécutés dans un pool de
+threads pour que la boucle reste disponible aux autres clients. Une session est identifiée
+par sa clé (date, opérateur, site), encodée dans son identifiant. Si JAR_TEST_API_JETON
+est défini, chaque requête doit porter l'en-tête « Authorization: Bearer <jeton> ».
+
+Exemple :
+    python api_jar_test.py --port 8502
+    JAR_TEST_BASE=postgresql://jar_test@serveur/jar_test python api_jar_test.py --hote 0.0.0.0 --processus 4
+"""
+import argparse
+import base64
+import binascii
+import hmac
+import json
+import logging
+import math
+import os
+import sys
+from contextlib import asynccontextmanager
+from datetime import date
+
+import pandas as pd
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.responses import HTMLResponse, JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# L'application Streamlit est importée sans navigateur (mode « bare ») : seules ses classes et fonctions servent
+logging.disable(logging.WARNING)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from jar_test4 import (ConfigManager, DatabaseManager, calculer_volume_ppm, calculer_volume_solution_commerciale,
+                       extraire_reactifs_combinaison, generer_rapport_html, ouvrir_base, scorer_essais,
+                       tableau_essais_depuis_mesures)
+
+CLE_SESSION = ('date_test', 'operateur', 'site_prelevement')
+# Conditions communes aux essais d'une session, avec les valeurs par défaut de la saisie
+CONDITIONS_SESSION = {'type_eau': "Autre", 'volume_echantillon': 1.0, 'temps_coagulation': 2, 'vitesse_coagulation': 200,
+                      'temps_floculation': 20, 'vitesse_floculation': 30}
+CONDITIONS_ENTIERES = ('temps_coagulation', 'vitesse_coagulation', 'temps_floculation', 'vitesse_floculation')
+# Mesures propres à chaque essai ; 0 est la valeur d'une mesure non renseignée, comme dans la grille de saisie
+MESURES_ESSAI = ['coagulant_ml', 'floculant_ml', 'dco_sortie', 'ph_sortie', 'v_boue', 'abattement', 'turbidite_sortie',
+                 'couleur_sortie', 'mes_sortie', 'uv254_sortie', 'aluminium_residuel', 'fer_residuel', 'conductivite_sortie']
+CHAMPS_ESSAI = {'combinaison', 'essai', 'turbidite', 'coagulant_ppm', 'floculant_ppm',
+                *MESURES_ESSAI, *DatabaseManager.PARAMETRES_EAU_BRUTE}
+TAILLE_PAGE_MAX = 1000
+ESSAIS_PAR_REQUETE_MAX = 5000
+
+
+class ErreurRequete(Exception):
+    """Requête refusée : renvoyée au client avec son code HTTP et un message"""
+
+    def __init__(self, message, statut=422):
+        super().__init__(message)
+        self.statut = statut
+
+
+def identifiant_session(date_test, operateur, site_prelevement):
+    """Identifiant d'URL d'une session : sa clé (date, opérateur, site) encodée en base64 URL"""
+    cle = json.dumps([str(date_test), operateur, site_prelevement], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(cle).decode().rstrip("=")
+
+
+def cle_session(identifiant):
+    try:
+        cle = json.loads(base64.urlsafe_b64decode(identifiant + "=" * (-len(identifiant) % 4)))
+    except (binascii.Error, ValueError):
+        raise ErreurRequete("Identifiant de session invalide", 404)
+    if not (isinstance(cle, list) and len(cle) == 3 and all(isinstance(v, str) for v in cle)):
+        raise ErreurRequete("Identifiant de session invalide", 404)
+    return cle
+
+
+def convertir_nombre(valeur, champ, entier=False):
+    if isinstance(valeur, bool) or valeur is None:
+        raise ErreurRequete(f"{champ} : nombre attendu")
+    try:
+        nombre = float(valeur)
+    except (TypeError, ValueError):
+        raise ErreurRequete(f"{champ} : nombre attendu")
+    if not math.isfinite(nombre) or (entier and not nombre.is_integer()):
+        raise ErreurRequete(f"{champ} : {'entier' if entier else 'nombre'} attendu")
+    return int(nombre) if entier else nombre
+
+
+def convertir_date(valeur, champ):
+    try:
+        return date.fromisoformat(str(valeur)).isoformat()
+    except ValueError:
+        raise ErreurRequete(f"{champ} : date AAAA-MM-JJ attendue")
+
+
+def lire_session(corps):
+    """Clé, conditions et eau brute d'une session envoyée par le client"""
+    if not isinstance(corps, dict):
+        raise ErreurRequete("session : objet attendu")
+    session = {'date_test': convertir_date(corps.get('date_test'), 'date_test')}
+    for champ in ('operateur', 'site_prelevement'):
+        if not isinstance(corps.get(champ), str) or not corps[champ].strip():
+            raise ErreurRequete(f"{champ} : texte non vide attendu")
+        session[champ] = corps[champ].strip()
+    session['type_eau'] = str(corps.get('type_eau', CONDITIONS_SESSION['type_eau']))
+    for champ, defaut in CONDITIONS_SESSION.items():
+        if champ != 'type_eau':
+            session[champ] = convertir_nombre(corps.get(champ, defaut), champ, champ in CONDITIONS_ENTIERES)
+    if session['volume_echantillon'] <= 0:
+        raise ErreurRequete("volume_echantillon : valeur positive attendue")
+    eau_brute = corps.get('eau_brute', {})
+    if not isinstance(eau_brute, dict):
+        raise ErreurRequete("eau_brute : objet attendu")
+    inconnus = set(eau_brute) - set(DatabaseManager.PARAMETRES_EAU_BRUTE)
+    if inconnus:
+        raise ErreurRequete(f"eau_brute : paramètres inconnus {sorted(inconnus)}")
+    for parametre in DatabaseManager.PARAMETRES_EAU_BRUTE:
+        session[parametre] = convertir_nombre(eau_brute.get(parametre, 0.0), parametre)
+    return session
+
+
+def preparer_essais(session, essais, coagulants_config, floculants_config):
+    """Lignes de mesures_jar_test des essais envoyés, comme les enregistre la grille de saisie"""
+    if not isinstance(essais, list) or not essais:
+        raise ErreurRequete("essais : liste non vide attendue")
+    if len(essais) > ESSAIS_PAR_REQUETE_MAX:
+        raise ErreurRequete(f"essais : au plus {ESSAIS_PAR_REQUETE_MAX} par requête", 413)
+    lignes = {}
+    for numero, essai in enumerate(essais):
+        if not isinstance(essai, dict):
+            raise ErreurRequete(f"essais[{numero}] : objet attendu")
+        inconnus = set(essai) - CHAMPS_ESSAI
+        if inconnus:
+            raise ErreurRequete(f"essais[{numero}] : champs inconnus {sorted(inconnus)}")
+        if not isinstance(essai.get('combinaison'), str) or not essai['combinaison'].strip():
+            raise ErreurRequete(f"essais[{numero}].combinaison : texte non vide attendu")
+        ligne = dict(session, combinaison=essai['combinaison'].strip(), turbidite=str(essai.get('turbidite', '')))
+        ligne['essai'] = convertir_nombre(essai.get('essai'), f"essais[{numero}].essai", entier=True)
+        if ligne['essai'] < 1:
+            raise ErreurRequete(f"essais[{numero}].essai : numéro à partir de 1 attendu")
+        for champ in MESURES_ESSAI + DatabaseManager.PARAMETRES_EAU_BRUTE:
+            ligne[champ] = convertir_nombre(essai.get(champ, ligne.get(champ, 0.0)), f"essais[{numero}].{champ}")
+
+        # Doses commerciales (ppm) converties en mL de solution, comme à la saisie
+        noms = extraire_reactifs_combinaison(ligne['combinaison'])
+        for nom, catalogue, champ_ppm, champ_ml in ((noms[0], coagulants_config, 'coagulant_ppm', 'coagulant_ml'),
+                                                    (noms[1], floculants_config, 'floculant_ppm', 'floculant_ml')):
+            if champ_ppm in essai:
+                reactif = next((r for r in catalogue if r["nom"] == nom), None)
+                if reactif is None:
+                    raise ErreurRequete(f"essais[{numero}].{champ_ppm} : réactif « {nom} » absent du catalogue")
+                volume_ppm = calculer_volume_ppm(reactif['dilution'], reactif['densite'], reactif['matiere_active']) if nom != "Aucun" else 0
+                ligne[champ_ml] = calculer_volume_solution_commerciale(
+                    convertir_nombre(essai[champ_ppm], f"essais[{numero}].{champ_ppm}"), volume_ppm, ligne['volume_echantillon']
+                )
+        if 'abattement' not in essai and ligne['dco_entree'] > 0 and ligne['dco_sortie'] > 0:
+            ligne['abattement'] = (ligne['dco_entree'] - ligne['dco_sortie']) / ligne['dco_entree'] * 100
+
+        cle = (ligne['combinaison'], ligne['essai'])
+        if cle in lignes:
+            raise ErreurRequete(f"essais[{numero}] : essai {cle[1]} de {cle[0]} envoyé deux fois")
+        lignes[cle] = ligne
+    return list(lignes.values())
+
+
+def eau_brute_enregistree(ligne):
+    """Paramètres de l'eau brute d'une ligne enregistrée (valeur absente : 0, non renseignée)"""
+    return {p: float(ligne[p]) if pd.notna(ligne[p]) else 0.0 for p in DatabaseManager.PARAMETRES_EAU_BRUTE}
+
+
+def enregistrements(table):
+    """Lignes d'un DataFrame en objets JSON (NaN en null, types numpy convertis)"""
+    return json.loads(table.to_json(orient="records", force_ascii=False))
+
+
+def criteres_depuis(parametres):
+    """Critères de recherche de DatabaseManager à partir des paramètres d'URL"""
+    criteres = {'texte': parametres.get('texte', ''), 'plages': {}, 'facettes': {}}
+    for borne in ('date_debut', 'date_fin'):
+        if parametres.get(borne):
+            criteres[borne] = convertir_date(parametres[borne], borne)
+    for colonne in DatabaseManager.COLONNES_NUMERIQUES:
+        minimum, maximum = parametres.get(f"{colonne}_min"), parametres.get(f"{colonne}_max")
+        if minimum is not None or maximum is not None:
+            criteres['plages'][colonne] = (
+                convertir_nombre(minimum, f"{colonne}_min") if minimum is not None else -math.inf,
+                convertir_nombre(maximum, f"{colonne}_max") if maximum is not None else math.inf
+            )
+    for facette in DatabaseManager.FACETTES_RECHERCHE:
+        valeurs = parametres.getlist(facette)
+        if valeurs:
+            criteres['facettes'][facette] = valeurs
+    return criteres
+
+
+def pagination(parametres, taille_defaut=100):
+    page = convertir_nombre(parametres.get('page', 1), 'page', entier=True)
+    taille = convertir_nombre(parametres.get('taille', taille_defaut), 'taille', entier=True)
+    if page < 1 or not 1 <= taille <= TAILLE_PAGE_MAX:
+        raise ErreurRequete(f"page à partir de 1 et taille entre 1 et {TAILLE_PAGE_MAX} attendues")
+    return page, taille
+
+
+def reponse_page(donnees, total, page, taille):
+    return {'total': total, 'page': page, 'taille': taille, 'pages': max(math.ceil(total / taille), 1), **donnees}
+
+
+def mettre_a_jour_agregats(db_manager):
+    """Recalcule les tables dérivées si des essais ont été écrits sans elles (jar_test1.py à jar_test3.py)"""
+    # Lecture d'une ligne de compteurs : le verrou d'écriture n'est pris que s'il y a du retard
+    if db_manager.agregats_en_retard():
+        db_manager.rattraper_agregats()
+
+
+async def sante(request):
+    db_manager = request.app.state.db_manager
+    nombre = await run_in_threadpool(db_manager.compter_mesures)
+    return JSONResponse({'statut': "ok", 'stockage': "sqlite" if db_manager.SAUVEGARDE_LOCALE else "postgresql", 'mesures': nombre})
+
+
+async def creer_session(request):
+    corps = await lire_json(request)
+    session = lire_session(corps.get('session'))
+    config_manager = request.app.state.config_manager
+    catalogues = await run_in_threadpool(lambda: (config_manager.load_coagulants(), config_manager.load_floculants()))
+    lignes = preparer_essais(session, corps.get('essais'), *catalogues)
+    await run_in_threadpool(request.app.state.db_manager.save_mesures, lignes)
+    identifiant = identifiant_session(*(session[c] for c in CLE_SESSION))
+    return JSONResponse({'id': identifiant, 'essais': len(lignes)}, status_code=201,
+                        headers={'Location': f"/api/sessions/{identifiant}"})
+
+
+async def lire_session_enregistree(request):
+    """Clé et essais enregistrés de la session de l'URL (404 si elle n'a aucun essai)"""
+    cle = cle_session(request.path_params['identifiant'])
+    mesures = await run_in_threadpool(request.app.state.db_manager.get_mesures_session, *cle)
+    if mesures.empty:
+        raise ErreurRequete("Session inconnue", 404)
+    return cle, mesures
+
+
+async def ajouter_essais(request):
+    cle, mesures = await lire_session_enregistree(request)
+    corps = await lire_json(request)
+    # Les nouveaux essais reprennent les conditions et l'eau brute de la session enregistrée
+    premiere = mesures.iloc[0]
+    session = dict(zip(CLE_SESSION, cle))
+    # Valeurs Python et non scalaires numpy, que sqlite3 enregistrerait comme des BLOB
+    session.update(enregistrements(mesures.head(1)[list(CONDITIONS_SESSION)])[0])
+    session.update(eau_brute_enregistree(premiere))
+    config_manager = request.app.state.config_manager
+    catalogues = await run_in_threadpool(lambda: (config_manager.load_coagulants(), config_manager.load_floculants()))
+    lignes = preparer_essais(session, corps.get('essais'), *catalogues)
+    await run_in_threadpool(request.app.state.db_manager.save_mesures, lignes)
+    return JSONResponse({'id': request.path_params['identifiant'], 'essais': len(lignes)})
+
+
+async def detail_session(request):
+    cle, mesures = await lire_session_enregistree(request)
+    return JSONResponse({
+        'id': request.path_params['identifiant'],
+        'session': {**dict(zip(CLE_SESSION, cle)), **enregistrements(mesures.head(1)[list(CONDITIONS_SESSION)])[0]},
+        'essais': enregistrements(mesures.drop(columns=list(CLE_SESSION) + list(CONDITIONS_SESSION)))
+    })
+
+
+async def liste_sessions(request):
+    criteres = criteres_depuis(request.query_params)
+    page, taille = pagination(request.query_params)
+    sessions, total = await run_in_threadpool(request.app.state.db_manager.lister_sessions, criteres, taille, (page - 1) * taille)
+    sessions.insert(0, 'id', [identifiant_session(*cle) for cle in sessions[list(CLE_SESSION)].itertuples(index=False)])
+    return JSONResponse(reponse_page({'sessions': enregistrements(sessions)}, total, page, taille))
+
+
+async def rapport_session(request):
+    parametres = request.query_params
+    debit_eau = convertir_nombre(parametres.get('debit_eau', 10.0), 'debit_eau')
+    debit_annuel = debit_eau * convertir_nombre(parametres.get('heures_par_jour', 24), 'heures_par_jour') \
+        * convertir_nombre(parametres.get('jours_par_an', 330), 'jours_par_an')
+    ph_cible = convertir_nombre(parametres.get('ph_cible', 7.0), 'ph_cible')
+    _, mesures = await lire_session_enregistree(request)
+    config_manager = request.app.state.config_manager
+
+    def construire():
+        coagulants_config, floculants_config = config_manager.load_coagulants(), config_manager.load_floculants()
+        # Meilleur essai selon la pondération par défaut de l'onglet Résultats
+        selection = scorer_essais(mesures, coagulants_config, floculants_config, None, ph_cible)
+        premiere = mesures.iloc[0]
+        return generer_rapport_html(
+            premiere['date_test'], premiere['operateur'], premiere['site_prelevement'], premiere['type_eau'],
+            float(premiere['volume_echantillon']), premiere['temps_coagulation'], premiere['vitesse_coagulation'],
+            premiere['temps_floculation'], premiere['vitesse_floculation'], eau_brute_enregistree(premiere), debit_eau, debit_annuel,
+            selection.iloc[0], coagulants_config, floculants_config,
+            tableau_essais_depuis_mesures(mesures, coagulants_config, floculants_config), selection
+        )
+
+    return HTMLResponse(await run_in_threadpool(construire))
+
+
+async def rechercher(request):
+    parametres = request.query_params
+    criteres = criteres_depuis(parametres)
+    page, taille = pagination(parametres)
+    archives = parametres.get('archives', '0') in ('1', 'true', 'oui')
+    mesures, total = await run_in_threadpool(
+        request.app.state.db_manager.rechercher_mesures, criteres, taille, archives, (page - 1) * taille
+    )
+    return JSONResponse(reponse_page({'mesures': enregistrements(mesures)}, total, page, taille))
+
+
+async def flux_mesures(request):
+    parametres = request.query_params
+    criteres = criteres_depuis(parametres)
+    format_flux = parametres.get('format', 'ndjson')
+    if format_flux not in ('ndjson', 'csv'):
+        raise ErreurRequete("format : ndjson ou csv attendu")
+    pages = request.app.state.db_manager.parcourir_mesures(criteres)
+
+    def morceaux():
+        # Une page lue à la fois : la mémoire du serveur ne dépend pas du nombre de mesures trouvées
+        for numero, page in enumerate(pages):
+            if format_flux == 'csv':
+                yield page.to_csv(index=False, header=numero == 0)
+            else:
+                yield page.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n") + "\n"
+
+    media = "text/csv; charset=utf-8" if format_flux == 'csv' else "application/x-ndjson"
+    return StreamingResponse(iterate_in_threadpool(morceaux()), media_type=media)
+
+
+async def facettes(request):
+    criteres = criteres_depuis(request.query_params)
+    archives = request.query_params.get('archives', '0') in ('1', 'true', 'oui')
+    return JSONResponse(await run_in_threadpool(request.app.state.db_manager.compter_facettes, criteres, archives))
+
+
+async def statistiques_eau_brute(request):
+    parametres = request.query_params
+    date_fin = convertir_date(parametres.get('date_fin', date.today().isoformat()), 'date_fin')
+    jours = convertir_nombre(parametres.get('jours', 90), 'jours', entier=True)
+    await run_in_threadpool(mettre_a_jour_agregats, request.app.state.db_manager)
+    statistiques = await run_in_threadpool(
+        request.app.state.db_manager.get_statistiques_eau_brute, request.path_params['site'], date_fin, jours
+    )
+    return JSONResponse({'statistiques': enregistrements(statistiques.reset_index())})
+
+
+async def serie_eau_brute(request):
+    parametre = request.path_params['parametre']
+    periode = request.query_params.get('periode', 'jour')
+    if parametre not in DatabaseManager.PARAMETRES_EAU_BRUTE:
+        raise ErreurRequete(f"Paramètre de l'eau brute inconnu : {parametre}", 404)
+    if periode not in DatabaseManager.PERIODES:
+        raise ErreurRequete(f"periode : {' ou '.join(DatabaseManager.PERIODES)} attendue")
+    debut, fin = (convertir_date(request.query_params[b], b) if request.query_params.get(b) else None for b in ('debut', 'fin'))
+    await run_in_threadpool(mettre_a_jour_agregats, request.app.state.db_manager)
+    serie = await run_in_threadpool(
+        request.app.state.db_manager.get_serie_eau_brute, request.path_params['site'], parametre, periode, debut, fin
+    )
+    serie['debut'] = serie['debut'].dt.strftime("%Y-%m-%d")
+    return JSONResponse({'serie': enregistrements(serie)})
+
+
+async def historique(request):
+    colonne = request.path_params['colonne']
+    if colonne not in DatabaseManager.COLONNES_HISTORIQUE:
+        raise ErreurRequete(f"Colonne d'historique inconnue : {colonne}", 404)
+    debut, fin = (convertir_date(request.query_params[b], b) if request.query_params.get(b) else None for b in ('debut', 'fin'))
+    max_points = convertir_nombre(request.query_params.get('max_points', 2000), 'max_points', entier=True)
+    points, nombre = await run_in_threadpool(
+        request.app.state.db_manager.get_historique_essais, request.path_params['site'], colonne, debut, fin, max(max_points, 2)
+    )
+    points['date_test'] = points['date_test'].dt.strftime("%Y-%m-%d")
+    return JSONResponse({'nombre': nombre, 'points': enregistrements(points)})
+
+
+async def comparaison(request):
+    parametres = request.query_params
+    await run_in_threadpool(mettre_a_jour_agregats, request.app.state.db_manager)
+    agregats = await run_in_threadpool(
+        request.app.state.db_manager.get_comparaison, parametres.getlist('combinaison'), parametres.get('debut'), parametres.get('fin')
+    )
+    return JSONResponse({'agregats': enregistrements(agregats)})
+
+
+async def lire_json(request):
+    try:
+        corps = await request.json()
+    except ValueError:
+        raise ErreurRequete("Corps JSON invalide", 400)
+    if not isinstance(corps, dict):
+        raise ErreurRequete("Corps JSON : objet attendu", 400)
+    return corps
+
+
+async def erreur_requete(request, erreur):
+    return JSONResponse({'erreur': str(erreur)}, status_code=erreur.statut)
+
+
+class VerificationJeton:
+    """Refuse les requêtes sans l'en-tête Authorization: Bearer <jeton> attendu"""
+
+    def __init__(self, app, jeton):
+        self.app = app
+        self.attendu = f"Bearer {jeton}".encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not hmac.compare_digest(dict(scope["headers"]).get(b"authorization", b""), self.attendu):
+            await JSONResponse({'erreur': "Jeton d'accès manquant ou invalide"}, status_code=401)(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+@asynccontextmanager
+async def cycle_de_vie(app):
+    # Schéma créé ou mis à jour une fois par processus, avant la première requête
+    app.state.db_manager = await run_in_threadpool(ouvrir_base)
+    await run_in_threadpool(mettre_a_jour_agregats, app.state.db_manager)
+    app.state.config_manager = ConfigManager()
+    yield
+
+
+def creer_application(jeton=None):
+    routes = [
+        Route("/api/sante", sante),
+        Route("/api/sessions", creer_session, methods=["POST"]),
+        Route("/api/sessions", liste_sessions),
+        Route("/api/sessions/{identifiant}", detail_session),
+        Route("/api/sessions/{identifiant}/essais", ajouter_essais, methods=["POST"]),
+        Route("/api/sessions/{identifiant}/rapport", rapport_session),
+        Route("/api/mesures", rechercher),
+        Route("/api/mesures/flux", flux_mesures),
+        Route("/api/facettes", facettes),
+        Route("/api/eau-brute/{site}/statistiques", statistiques_eau_brute),
+        Route("/api/eau-brute/{site}/{parametre}", serie_eau_brute),
+        Route("/api/historique/{site}/{colonne}", historique),
+        Route("/api/comparaison", comparaison),
+    ]
+    return Starlette(
+        routes=routes,
+        middleware=[Middleware(VerificationJeton, jeton=jeton)] if jeton else [],
+        exception_handlers={ErreurRequete: erreur_requete},
+        lifespan=cycle_de_vie
+    )
+
+
+app = creer_application(os.environ.get("JAR_TEST_API_JETON"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API HTTP/JSON locale de Jar Test")
+    parser.add_argument("--hote", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--processus", type=int, default=1, help="Processus serveurs (la base est partagée sans risque entre processus)")
+    args = parser.parse_args()
+    print(f"API Jar Test sur http://{args.hote}:{args.port}/api (base : {os.environ.get('JAR_TEST_BASE', 'jar_test_database.db')})")
+    uvicorn.run("api_jar_test:app", host=args.hote, port=args.port, workers=args.processus,
+                app_dir=os.path.dirname(os.path.abspath(__file__)), log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Archivage des anciennes sessions de jar_test_database.db et compactage de la base.
+
+Les sessions antérieures à la date limite (premier jour du mois, `--age-jours` avant
+aujourd'hui) sont déplacées dans une base d'archive par année (archives/<base>_<année>.db,
+même schéma et même index plein texte), une ligne de synthèse par combinaison restant
+dans sessions_archivees. Les séries de l'eau brute et les agrégats de comparaison ne sont
+pas touchés. La base est ensuite compactée par vacuum incrémental, par étapes courtes
+entre lesquelles l'application peut continuer d'écrire.
+
+L'application relit les archives à la demande (« Inclure les archives » de la recherche,
+get_all_mesures(archives=True)).
+
+Exemple :
+    python archivage.py --base jar_test_database.db --age-jours 730
+    python archivage.py --age-jours 365 --simulation
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+
+def date_limite(age_jours, aujourd_hui=None):
+    """Premier jour du mois contenant la date d'il y a `age_jours` : seuls des mois entiers sont archivés"""
+    jour = (aujourd_hui or date.today()) - timedelta(days=age_jours)
+    return jour.replace(day=1).isoformat()
+
+
+def schema_archive(conn):
+    """Définitions de mesures_jar_test, de ses index et de l'index plein texte dans la base courante"""
+    return conn.execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE sql IS NOT NULL AND ((tbl_name = 'mesures_jar_test' AND type IN ('table', 'index')) OR name = 'recherche_mesures')
+        ORDER BY type = 'index'
+    """).fetchall()
+
+
+def preparer_archive(chemin, schema):
+    """Crée la base d'archive et les objets du schéma qui lui manquent"""
+    os.makedirs(os.path.dirname(chemin), exist_ok=True)
+    conn = sqlite3.connect(chemin)
+    existants = {ligne[0] for ligne in conn.execute("SELECT name FROM sqlite_master")}
+    for nom, sql in schema:
+        if nom not in existants:
+            conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+
+def archiver(db_manager, limite, simulation=False):
+    """Déplace les sessions antérieures à `limite` dans les bases d'archive annuelles ; renvoie le nombre d'essais par année"""
+    conn = sqlite3.connect(db_manager.db_file)
+    annees = [int(ligne[0]) for ligne in conn.execute(
+        "SELECT DISTINCT substr(date_test, 1, 4) FROM mesures_jar_test WHERE date_test < ? ORDER BY 1", (limite,)
+    )]
+    schema = schema_archive(conn)
+    bilan = {}
+    for annee in annees:
+        debut, fin = f"{annee}-01-01", min(limite, f"{annee + 1}-01-01")
+        periode = "date_test >= ? AND date_test < ?"
+        if simulation:
+            bilan[annee] = conn.execute(f"SELECT COUNT(*) FROM mesures_jar_test WHERE {periode}", (debut, fin)).fetchone()[0]
+            continue
+
+        chemin = db_manager.chemin_archive(annee)
+        preparer_archive(chemin, schema)
+        # ATTACH hors transaction ; copie, synthèse et suppression sont validées ensemble (transaction sur les deux bases)
+        conn.execute("ATTACH DATABASE ? AS archive", (chemin,))
+        colonnes = ", ".join(ligne[1] for ligne in conn.execute("PRAGMA archive.table_info(mesures_jar_test)"))
+        conn.execute(f"""
+            INSERT OR REPLACE INTO archive.mesures_jar_test ({colonnes})
+            SELECT {colonnes} FROM main.mesures_jar_test WHERE {periode}
+        """, (debut, fin))
+        conn.execute("""
+            INSERT OR REPLACE INTO main.sessions_archivees
+            SELECT date_test, operateur, site_prelevement, combinaison, MAX(type_eau), COUNT(*), MAX(abattement), ?
+            FROM main.mesures_jar_test WHERE date_test >= ? AND date_test < ?
+            GROUP BY date_test, operateur, site_prelevement, combinaison
+        """, (os.path.basename(chemin), debut, fin))
+        bilan[annee] = conn.execute(f"DELETE FROM main.mesures_jar_test WHERE {periode}", (debut, fin)).rowcount
+        # Suppressions sans effet sur les tables dérivées, qui comptent aussi les archives : pas de recalcul à rattraper
+        db_manager.compter_ecritures(conn, 0, int(bilan[annee] > 0))
+        conn.execute("INSERT INTO archive.recherche_mesures (recherche_mesures) VALUES ('rebuild')")
+        conn.commit()
+        conn.execute("DETACH DATABASE archive")
+    conn.close()
+    return bilan
+
+
+def compacter(db_file, pages_par_etape=1000, complet=False):
+    """Rend au système les pages libérées ; renvoie le mode de compactage utilisé"""
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    if complet or conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Le passage en auto_vacuum incrémental ne prend effet qu'après un VACUUM complet, qui bloque la base
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        mode = "complet"
+    else:
+        # Étapes courtes : chacune est une transaction, les écritures de l'application passent entre deux
+        while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages_par_etape)})").fetchall()
+        mode = "incrémental"
+    conn.execute("PRAGMA optimize")
+    conn.close()
+    return mode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivage des anciennes sessions et compactage de la base Jar Test")
+    parser.add_argument("--base", default="jar_test_database.db")
+    parser.add_argument("--age-jours", type=int, default=730, help="Âge minimal des sessions archivées (jours)")
+    parser.add_argument("--pages-par-etape", type=int, default=1000, help="Pages libérées par étape de vacuum incrémental")
+    parser.add_argument("--vacuum-complet", action="store_true", help="VACUUM complet (défragmente, mais bloque la base)")
+    parser.add_argument("--simulation", action="store_true", help="Affiche ce qui serait archivé sans rien modifier")
+    args = parser.parse_args()
+
+    # Schéma à jour (sessions_archivees) via l'application, importée sans navigateur
+    logging.disable(logging.WARNING)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from jar_test4 import DatabaseManager
+    db_manager = DatabaseManager(args.base)
+
+    limite = date_limite(args.age_jours)
+    taille_avant = os.path.getsize(args.base)
+    debut = time.perf_counter()
+    bilan = archiver(db_manager, limite, args.simulation)
+    for annee, nombre in bilan.items():
+        destination = "" if args.simulation else f" -> {db_manager.chemin_archive(annee)}"
+        print(f"{annee} : {nombre} essais{destination}")
+    if args.simulation:
+        print(f"Simulation : {sum(bilan.values())} essais antérieurs au {limite} seraient archivés")
+        return
+    print(f"{sum(bilan.values())} essais antérieurs au {limite} archivés en {time.perf_counter() - debut:.1f} s")
+
+    debut = time.perf_counter()
+    mode = compacter(args.base, args.pages_par_etape, args.vacuum_complet)
+    print(f"Compactage {mode} en {time.perf_counter() - debut:.1f} s : "
+          f"{taille_avant / 1024 ** 2:.1f} Mo -> {os.path.getsize(args.base) / 1024 ** 2:.1f} Mo")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""Test de charge de l'API HTTP/JSON de Jar Test (api_jar_test.py).
+
+Démarre l'API sur une base jetable préremplie de mesures synthétiques, puis plusieurs clients
+simultanés enchaînent pendant --duree secondes un mélange pondéré de requêtes : envoi groupé
+des essais d'une session (comme un LIMS), recherche paginée, liste des sessions, facettes,
+séries de l'eau brute, comparaison entre sites, rapport HTML et lecture en flux des mesures
+d'un site. Relève par route le débit, les latences p50/p95/p99 et les erreurs, puis vérifie
+que chaque essai envoyé se retrouve en base. Code de sortie 1 en cas d'erreur ou d'essai perdu.
+
+--base choisit le stockage de l'API démarrée (JAR_TEST_BASE, fichier SQLite temporaire par
+défaut) ; --url vise une API déjà démarrée, sans préremplissage (à réserver à une base de test :
+les sessions envoyées y restent, sous des opérateurs « LIMS ... »).
+
+Exemple :
+    python benchmark_api.py --clients 16 --duree 30 --lignes 50000
+    python benchmark_api.py --processus 4 --clients 32 --base postgresql://jar_test@localhost/jar_test_charge
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote, urlencode, urlsplit
+
+import numpy as np
+
+from benchmark_jar_test import COMBINAISONS, SITES, generer_mesures, masquer_journaux_streamlit, remplir_base
+from benchmark_stockage import port_libre, sessions_de
+
+POIDS_ROUTES = {
+    'envoi_essais': 20, 'recherche': 25, 'sessions': 10, 'facettes': 10,
+    'serie_eau_brute': 10, 'comparaison': 5, 'rapport': 10, 'flux': 5
+}
+TEXTES_RECHERCHE = ["pac", "em-540", "temoin", "fecl3", "sulfate", "polydadmac"]
+
+
+def charge_session(lignes, conditions, mesures_essai, parametres_eau_brute):
+    """Corps de POST /api/sessions pour les essais d'une session synthétique"""
+    premiere = lignes[0]
+    session = {
+        'date_test': premiere['date_test'],
+        # Opérateur distinct des mesures préremplies : chaque envoi crée une nouvelle session
+        'operateur': f"LIMS {premiere['operateur']}",
+        'site_prelevement': premiere['site_prelevement'],
+        **{champ: premiere[champ] for champ in conditions},
+        'eau_brute': {parametre: premiere[parametre] for parametre in parametres_eau_brute}
+    }
+    essais = [{'combinaison': ligne['combinaison'], 'essai': ligne['essai'], **{m: ligne[m] for m in mesures_essai}} for ligne in lignes]
+    return {'session': session, 'essais': essais}
+
+
+class ServeurAPI:
+    """api_jar_test.py démarré dans un dossier jetable (base, catalogues de réactifs)"""
+
+    def __init__(self, base, processus):
+        self.dossier = tempfile.mkdtemp(prefix="charge_api_jar_test_")
+        self.base = base or os.path.join(self.dossier, "jar_test_database.db")
+        self.processus = processus
+        self.port = port_libre()
+        self.process = None
+
+    def preremplir(self, mesures):
+        from jar_test4 import DatabaseManager, ouvrir_base
+        os.environ["JAR_TEST_BASE"] = self.base
+        db_manager = ouvrir_base()
+        if isinstance(db_manager, DatabaseManager) and db_manager.SAUVEGARDE_LOCALE:
+            # Insertion directe, puis séries et agrégats recalculés comme après un import
+            remplir_base(self.base, mesures)
+            db_manager.rattraper_agregats()
+        else:
+            for lignes in sessions_de(mesures):
+                db_manager.save_mesures(lignes)
+
+    def demarrer(self):
+        dossier_depot = os.path.dirname(os.path.abspath(__file__))
+        for nom in ("coagulants_config.json", "floculants_config.json", "parametres_config.json"):
+            if os.path.exists(os.path.join(dossier_depot, nom)):
+                shutil.copy(os.path.join(dossier_depot, nom), self.dossier)
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(dossier_depot, "api_jar_test.py"), "--port", str(self.port), "--processus", str(self.processus)],
+            cwd=self.dossier, env=dict(os.environ, JAR_TEST_BASE=self.base), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        url = f"http://127.0.0.1:{self.port}"
+        for _ in range(600):
+            try:
+                if requete(url, "GET", "/api/sante")[0] == 200:
+                    return url
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("L'API n'a pas démarré")
+
+    def arreter(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+        shutil.rmtree(self.dossier, ignore_errors=True)
+
+
+def requete(url, methode, chemin, corps=None, connexion=None):
+    """Une requête HTTP ; renvoie (statut, corps lu en entier)"""
+    adresse = urlsplit(url)
+    conn = connexion or http.client.HTTPConnection(adresse.hostname, adresse.port, timeout=120)
+    donnees = json.dumps(corps).encode() if corps is not None else None
+    conn.request(methode, chemin, body=donnees, headers={'Content-Type': "application/json"} if donnees else {})
+    reponse = conn.getresponse()
+    contenu = reponse.read()
+    if connexion is None:
+        conn.close()
+    return reponse.status, contenu
+
+
+class Client(threading.Thread):
+    """Client HTTP (connexion persistante) qui enchaîne des requêtes tirées selon POIDS_ROUTES jusqu'à l'échéance"""
+
+    def __init__(self, numero, url, echeance, graine, file_envois, sessions_rapport):
+        super().__init__()
+        self.url = url
+        self.echeance = echeance
+        self.rng = random.Random(graine * 1000 + numero)
+        self.file_envois = file_envois
+        self.sessions_rapport = sessions_rapport
+        self.routes, self.poids = zip(*POIDS_ROUTES.items())
+        self.resultats = []
+        self.envoyees = []
+
+    def chemin(self, route):
+        rng = self.rng
+        if route == 'recherche':
+            return "/api/mesures?" + urlencode({'texte': rng.choice(TEXTES_RECHERCHE), 'page': rng.randint(1, 5), 'taille': 100})
+        if route == 'sessions':
+            return "/api/sessions?" + urlencode({'site_prelevement': rng.choice(SITES), 'page': rng.randint(1, 3), 'taille': 50})
+        if route == 'facettes':
+            return "/api/facettes?" + urlencode({'texte': rng.choice(TEXTES_RECHERCHE)})
+        if route == 'serie_eau_brute':
+            parametre = rng.choice(['turbidite_entree', 'ph_entree', 'dco_entree'])
+            return f"/api/eau-brute/{quote(rng.choice(SITES))}/{parametre}?periode={rng.choice(['jour', 'semaine'])}"
+        if route == 'comparaison':
+            return "/api/comparaison?" + urlencode({'combinaison': rng.sample(COMBINAISONS, 2)}, doseq=True)
+        if route == 'rapport':
+            return f"/api/sessions/{rng.choice(self.sessions_rapport)}/rapport"
+        if route == 'flux':
+            return "/api/mesures/flux?" + urlencode({'site_prelevement': rng.choice(SITES), 'date_debut': "2023-01-01"})
+
+    def run(self):
+        adresse = urlsplit(self.url)
+        connexion = http.client.HTTPConnection(adresse.hostname, adresse.port, timeout=120)
+        while time.perf_counter() < self.echeance:
+            route = self.rng.choices(self.routes, self.poids)[0]
+            corps = None
+            if route == 'envoi_essais':
+                corps = self.file_envois()
+            debut = time.perf_counter()
+            try:
+                if corps is not None:
+                    statut, contenu = requete(self.url, "POST", "/api/sessions", corps, connexion)
+                else:
+                    statut, contenu = requete(self.url, "GET", self.chemin(route), connexion=connexion)
+            except (OSError, http.client.HTTPException) as e:
+                statut, contenu = str(e), b""
+                connexion.close()
+                connexion = http.client.HTTPConnection(adresse.hostname, adresse.port, timeout=120)
+            self.resultats.append((route, time.perf_counter() - debut, statut, len(contenu)))
+            if corps is not None and statut == 201:
+                self.envoyees.append(corps)
+        connexion.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de l'API HTTP/JSON de Jar Test")
+    parser.add_argument("--url", default=None, help="API déjà démarrée (sinon démarrée sur une base jetable)")
+    parser.add_argument("--base", default=None, help="Stockage de l'API démarrée : fichier SQLite ou URL postgresql://")
+    parser.add_argument("--processus", type=int, default=1, help="Processus serveurs de l'API démarrée")
+    parser.add_argument("--lignes", type=int, default=50000, help="Mesures préremplies")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duree", type=float, default=30, help="Durée de la charge (s)")
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--sortie", default=None)
+    args = parser.parse_args()
+
+    masquer_journaux_streamlit()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from api_jar_test import CONDITIONS_SESSION, MESURES_ESSAI, identifiant_session
+    from jar_test4 import DatabaseManager
+
+    # Sessions préremplies et sessions à envoyer tirées ensemble : leurs clés sont toutes distinctes
+    mesures = generer_mesures(args.lignes * 2, args.graine)
+    sessions = sessions_de(mesures)
+    prerempli = mesures.iloc[:args.lignes]
+    a_envoyer = sessions[len(sessions_de(prerempli)):]
+    sessions_rapport = [identifiant_session(d, o, s) for d, o, s in
+                        prerempli[['date_test', 'operateur', 'site_prelevement']].drop_duplicates().head(200).itertuples(index=False)]
+    verrou = threading.Lock()
+    compteur = iter(range(10 ** 9))
+
+    def prochain_envoi():
+        # Au-delà des sessions prévues, les mêmes sont renvoyées : mises à jour, sans nouvel essai
+        with verrou:
+            return charge_session(a_envoyer[next(compteur) % len(a_envoyer)], CONDITIONS_SESSION, MESURES_ESSAI,
+                                  DatabaseManager.PARAMETRES_EAU_BRUTE)
+
+    serveur = None if args.url else ServeurAPI(args.base, args.processus)
+    try:
+        if serveur:
+            debut = time.perf_counter()
+            serveur.preremplir(prerempli)
+            print(f"Base préremplie : {args.lignes} mesures en {time.perf_counter() - debut:.1f} s")
+        url = serveur.demarrer() if serveur else args.url
+        avant = json.loads(requete(url, "GET", "/api/sante")[1])['mesures']
+
+        print(f"{args.clients} clients pendant {args.duree:.0f} s sur {url} ({args.processus} processus)")
+        echeance = time.perf_counter() + args.duree
+        clients = [Client(i, url, echeance, args.graine, prochain_envoi, sessions_rapport) for i in range(args.clients)]
+        debut = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        duree = time.perf_counter() - debut
+
+        apres = json.loads(requete(url, "GET", "/api/sante")[1])['mesures']
+    finally:
+        if serveur:
+            serveur.arreter()
+
+    resultats = [r for client in clients for r in client.resultats]
+    envoyees = {(c['session']['date_test'], c['session']['operateur'], c['session']['site_prelevement']): len(c['essais'])
+                for client in clients for c in client.envoyees}
+    attendu = avant + sum(envoyees.values())
+
+    resume = {}
+    print(f"  {'route':<16} {'requêtes':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'erreurs':>8}")
+    for route in POIDS_ROUTES:
+        durees = [r[1] * 1000 for r in resultats if r[0] == route]
+        if not durees:
+            continue
+        erreurs = sum(1 for r in resultats if r[0] == route and not (isinstance(r[2], int) and r[2] < 400))
+        resume[route] = {
+            'requetes': len(durees), 'par_s': len(durees) / duree,
+            'p50_ms': statistics.median(durees), 'p95_ms': float(np.percentile(durees, 95)),
+            'p99_ms': float(np.percentile(durees, 99)), 'erreurs': erreurs,
+            'octets_moyens': statistics.mean(r[3] for r in resultats if r[0] == route)
+        }
+        r = resume[route]
+        print(f"  {route:<16} {r['requetes']:9d} {r['par_s']:8.1f} {r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['p99_ms']:9.1f} {r['erreurs']:8d}")
+    erreurs = sum(r['erreurs'] for r in resume.values())
+    print(f"  total            {len(resultats):9d} {len(resultats) / duree:8.1f}  —  {erreurs} erreurs")
+    print(f"Mesures : {avant} avant, {apres} après, {attendu} attendues ({len(envoyees)} sessions envoyées)")
+
+    sortie = args.sortie or f"benchmark_api_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(sortie, 'w') as f:
+        json.dump({
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'base': args.url or args.base or "sqlite",
+            'processus': args.processus,
+            'clients': args.clients,
+            'duree_s': duree,
+            'lignes': args.lignes,
+            'mesures': {'avant': avant, 'apres': apres, 'attendues': attendu},
+            'routes': resume
+        }, f, indent=4)
+    print(f"Résultats enregistrés dans {sortie}")
+    if erreurs or apres != attendu:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
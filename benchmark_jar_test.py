@@ -0,0 +1,292 @@
+"""Benchmarks reproductibles de DatabaseManager et de la génération des rapports.
+
+Exemple :
+    python benchmark_jar_test.py --application jar_test4 --tailles 10000,100000 --sortie bench.json
+
+L'application Streamlit est importée sans navigateur (mode « bare ») : les appels
+st.* sont alors sans effet et seuls les traitements sont chronométrés.
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+COLONNES_MESURE = [
+    'date_test', 'operateur', 'site_prelevement', 'type_eau', 'volume_echantillon',
+    'temps_coagulation', 'vitesse_coagulation', 'temps_floculation', 'vitesse_floculation',
+    'combinaison', 'essai', 'coagulant_ml', 'floculant_ml', 'dco_entree', 'ph_entree',
+    'dco_sortie', 'ph_sortie', 'v_boue', 'turbidite', 'abattement', 'turbidite_entree',
+    'turbidite_sortie', 'couleur_entree', 'couleur_sortie', 'mes_entree', 'mes_sortie',
+    'uv254_entree', 'uv254_sortie', 'aluminium_residuel', 'fer_residuel',
+    'conductivite_entree', 'conductivite_sortie'
+]
+
+SITES = ["Station Nord", "Station Sud", "Rivière amont", "Forage F2", "STEP Est", "Lagune"]
+OPERATEURS = ["Martin", "Bernard", "Dubois", "Durand", "Leroy"]
+TYPES_EAU = ["Eau de surface", "Eau souterraine", "Eau usée", "Autre"]
+COMBINAISONS = [
+    "PAC_18 + EM_540", "Coagulant seul: PAC_18", "Floculant seul: EM_540", "Témoin (sans réactif)",
+    "Chlorure ferrique (FeCl3) + Polyacrylamide anionique", "Sulfate d'aluminium (Al2(SO4)3) + PolyDADMAC"
+]
+ESSAIS_PAR_COMBINAISON = 6
+COMBINAISONS_PAR_SESSION = 4
+
+
+def generer_mesures(nombre_lignes, graine=0):
+    """Génère des mesures synthétiques réalistes, par sessions de 4 combinaisons x 6 essais"""
+    rng = np.random.default_rng(graine)
+    par_session = COMBINAISONS_PAR_SESSION * ESSAIS_PAR_COMBINAISON
+    nombre_sessions = -(-nombre_lignes // par_session)
+
+    # Caractéristiques par session, répétées sur chaque essai
+    session = np.repeat(np.arange(nombre_sessions), par_session)[:nombre_lignes]
+    # Triplets (jour, site, opérateur) tirés sans remise : chaque session a une clé naturelle distincte
+    debut = date(2020, 1, 1)
+    jours = max(5 * 365, -(-nombre_sessions // (len(SITES) * len(OPERATEURS))))
+    cles = rng.choice(jours * len(SITES) * len(OPERATEURS), nombre_sessions, replace=False)
+    dates = np.array([(debut + timedelta(days=int(j))).isoformat() for j in cles // (len(SITES) * len(OPERATEURS))])
+    sites = (cles // len(OPERATEURS)) % len(SITES)
+    operateurs = cles % len(OPERATEURS)
+    turbidite = rng.lognormal(2.5, 0.6, nombre_sessions)
+    dco = rng.lognormal(5.0, 0.5, nombre_sessions)
+    ph = rng.normal(7.2, 0.4, nombre_sessions)
+
+    rang = np.arange(nombre_lignes) % par_session
+    combinaison = (rang // ESSAIS_PAR_COMBINAISON + session) % len(COMBINAISONS)
+    essai = rang % ESSAIS_PAR_COMBINAISON + 1
+    coagulant_ml = (essai - 1) * rng.uniform(0.02, 0.08, nombre_lignes)
+    efficacite = 1 - np.exp(-(essai - 1) / 2.5)
+    abattement = np.clip(70 * efficacite + rng.normal(0, 4, nombre_lignes), 0, 100)
+    dco_entree = dco[session]
+
+    mesures = pd.DataFrame({
+        'date_test': dates[session],
+        'operateur': np.array(OPERATEURS)[operateurs[session]],
+        'site_prelevement': np.array(SITES)[sites[session]],
+        'type_eau': np.array(TYPES_EAU)[sites[session] % len(TYPES_EAU)],
+        'volume_echantillon': 1.0,
+        'temps_coagulation': 2,
+        'vitesse_coagulation': 200,
+        'temps_floculation': 20,
+        'vitesse_floculation': 30,
+        'combinaison': np.array(COMBINAISONS)[combinaison],
+        'essai': essai,
+        'coagulant_ml': coagulant_ml.round(4),
+        'floculant_ml': np.where(essai > 1, 0.002, 0.0),
+        'dco_entree': dco_entree.round(1),
+        'ph_entree': ph[session].round(2),
+        'dco_sortie': (dco_entree * (1 - abattement / 100)).round(1),
+        'ph_sortie': (ph[session] - 0.1 * (essai - 1)).round(2),
+        'v_boue': (essai * rng.uniform(2, 6, nombre_lignes)).round(1),
+        'turbidite': '',
+        'abattement': abattement.round(2),
+        'turbidite_entree': turbidite[session].round(2),
+        'turbidite_sortie': (turbidite[session] * (1 - efficacite * 0.9)).round(2),
+        'couleur_entree': 25.0,
+        'couleur_sortie': 5.0,
+        'mes_entree': 50.0,
+        'mes_sortie': 8.0,
+        'uv254_entree': 0.1,
+        'uv254_sortie': 0.05,
+        'aluminium_residuel': 0.05,
+        'fer_residuel': 0.02,
+        'conductivite_entree': 500.0,
+        'conductivite_sortie': 510.0
+    })
+    return mesures
+
+
+def remplir_base(db_file, mesures, taille_lot=50000):
+    """Insère les mesures synthétiques par lots (préparation, non chronométrée)"""
+    conn = sqlite3.connect(db_file)
+    requete = f"INSERT INTO mesures_jar_test ({', '.join(COLONNES_MESURE)}) VALUES ({', '.join('?' * len(COLONNES_MESURE))})"
+    for debut in range(0, len(mesures), taille_lot):
+        lot = mesures.iloc[debut:debut + taille_lot][COLONNES_MESURE]
+        conn.executemany(requete, lot.itertuples(index=False, name=None))
+    conn.commit()
+    conn.close()
+
+
+def masquer_journaux_streamlit():
+    """Hors navigateur, Streamlit avertit à chaque appel st.* : on ne garde que les erreurs"""
+    logging.disable(logging.WARNING)
+
+
+def chronometrer(fonction, repetitions):
+    """Exécute la fonction `repetitions` fois et retourne les durées en secondes"""
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        fonction()
+        durees.append(time.perf_counter() - debut)
+    return durees
+
+
+def construire_tableau_essais(mesures_session):
+    """Reconstruit un tableau_essais de l'application à partir des lignes d'une session"""
+    tableau_essais = {}
+    for combinaison, df in mesures_session.groupby('combinaison'):
+        tableau_essais[combinaison] = pd.DataFrame({
+            'Essai': df['essai'].to_numpy(),
+            'Coagulant_ml': df['coagulant_ml'].to_numpy(),
+            'Floculant_ml': df['floculant_ml'].to_numpy(),
+            'Coagulant_ppm_com': df['coagulant_ml'].to_numpy() * 1000,
+            'Floculant_ppm_com': df['floculant_ml'].to_numpy() * 1000,
+            'DCO_entree': df['dco_entree'].to_numpy(),
+            'pH_entree': df['ph_entree'].to_numpy(),
+            'DCO_sortie': df['dco_sortie'].to_numpy(),
+            'pH_sortie': df['ph_sortie'].to_numpy(),
+            'V_boue': df['v_boue'].to_numpy(),
+            'Turbidite': '',
+            'Abattement': df['abattement'].to_numpy(),
+            'Turbidite_entree': df['turbidite_entree'].to_numpy(),
+            'Turbidite_sortie': df['turbidite_sortie'].to_numpy(),
+            'Couleur_entree': df['couleur_entree'].to_numpy(),
+            'Couleur_sortie': df['couleur_sortie'].to_numpy(),
+            'MES_entree': df['mes_entree'].to_numpy(),
+            'MES_sortie': df['mes_sortie'].to_numpy(),
+            'UV254_entree': df['uv254_entree'].to_numpy(),
+            'UV254_sortie': df['uv254_sortie'].to_numpy(),
+            'Aluminium_residuel': df['aluminium_residuel'].to_numpy(),
+            'Fer_residuel': df['fer_residuel'].to_numpy(),
+            'Conductivite_entree': df['conductivite_entree'].to_numpy(),
+            'Conductivite_sortie': df['conductivite_sortie'].to_numpy()
+        })
+    return tableau_essais
+
+
+def arguments_rapport(mesures_session, config_manager):
+    """Arguments communs à generer_rapport_html / generer_rapport_pdf pour une session"""
+    premiere = mesures_session.iloc[0]
+    caracteristiques = {
+        'turbidite_entree': float(premiere['turbidite_entree']),
+        'ph_entree': float(premiere['ph_entree']),
+        'dco_entree': float(premiere['dco_entree'])
+    }
+    return dict(
+        date_test=premiere['date_test'], operateur=premiere['operateur'],
+        site_prelevement=premiere['site_prelevement'], type_eau=premiere['type_eau'],
+        volume_echantillon=1.0, temps_coagulation=2, vitesse_coagulation=200,
+        temps_floculation=20, vitesse_floculation=30, caracteristiques=caracteristiques,
+        debit_annuel=10.0 * 24 * 330,
+        meilleur_abattement=mesures_session.loc[mesures_session['abattement'].idxmax()],
+        coagulants_config=config_manager.load_coagulants(),
+        floculants_config=config_manager.load_floculants(),
+        tableau_essais=construire_tableau_essais(mesures_session)
+    )
+
+
+def executer_benchmarks(application, taille, repetitions, graine):
+    """Chronomètre toutes les opérations pour une base de `taille` lignes"""
+    module = importlib.import_module(application)
+    module_pdf = module if hasattr(module, 'generer_rapport_pdf') else None
+    resultats = []
+
+    def mesurer(operation, fonction, nombre=repetitions, lignes=None):
+        durees = chronometrer(fonction, nombre)
+        resultats.append({
+            'taille': taille,
+            'operation': operation,
+            'repetitions': nombre,
+            'lignes': lignes,
+            'min_s': min(durees),
+            'mediane_s': statistics.median(durees),
+            'moyenne_s': statistics.fmean(durees)
+        })
+        print(f"  {operation:<32} médiane {statistics.median(durees) * 1000:10.2f} ms")
+
+    dossier_initial = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench_jar_test_") as dossier:
+        os.chdir(dossier)
+        try:
+            db_manager = module.DatabaseManager()
+            config_manager = module.ConfigManager()
+            mesures = generer_mesures(taille, graine)
+            remplir_base(db_manager.db_file, mesures)
+
+            session = mesures.iloc[0]
+            nouvelle_session = generer_mesures(COMBINAISONS_PAR_SESSION * ESSAIS_PAR_COMBINAISON, graine + 1)
+            nouvelle_session['operateur'] = "Benchmark"
+            lignes_session = nouvelle_session.to_dict('records')
+
+            mesurer("save_mesure", lambda: db_manager.save_mesure(lignes_session[0]), nombre=max(repetitions, 20), lignes=1)
+            mesurer("save_mesure (session x24)", lambda: [db_manager.save_mesure(ligne) for ligne in lignes_session], lignes=len(lignes_session))
+            if hasattr(db_manager, 'save_mesures'):
+                mesurer("save_mesures (lot x24)", lambda: db_manager.save_mesures(lignes_session), lignes=len(lignes_session))
+
+            mesurer("get_all_mesures", db_manager.get_all_mesures, lignes=taille)
+            mesures_db = db_manager.get_all_mesures()
+
+            mesurer("filtre combinaison (pandas)", lambda: mesures_db[mesures_db['combinaison'] == session['combinaison']])
+            if hasattr(db_manager, 'get_mesures_combinaison'):
+                mesurer("get_mesures_combinaison (SQL)", lambda: db_manager.get_mesures_combinaison(session['combinaison']))
+
+            def filtrer_session():
+                return mesures_db[
+                    (mesures_db['date_test'] == session['date_test']) &
+                    (mesures_db['operateur'] == session['operateur']) &
+                    (mesures_db['site_prelevement'] == session['site_prelevement'])
+                ]
+            mesurer("requête session (pandas)", filtrer_session)
+            mesurer("requête session (get_all + filtre)", lambda: (db_manager.get_all_mesures(), filtrer_session()))
+
+            mesures_session = filtrer_session()
+            if hasattr(module, 'afficher_tableaux_resultats'):
+                mesurer("afficher_tableaux_resultats", lambda: module.afficher_tableaux_resultats(mesures_session))
+
+            arguments = arguments_rapport(mesures_session, config_manager)
+            if hasattr(module, 'generer_rapport_html'):
+                mesurer("generer_rapport_html", lambda: module.generer_rapport_html(debit_eau=10.0, **arguments))
+            if module_pdf is not None:
+                mesurer("generer_rapport_pdf", lambda: module_pdf.generer_rapport_pdf(**arguments))
+        finally:
+            os.chdir(dossier_initial)
+
+    return resultats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks DatabaseManager et rapports Jar Test")
+    parser.add_argument("--application", default="jar_test4", help="Module de l'application à mesurer (jar_test1 à jar_test4)")
+    parser.add_argument("--tailles", default="10000,100000,1000000", help="Nombres de lignes de mesures_jar_test, séparés par des virgules")
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--sortie", default=None, help="Fichier JSON de résultats (par défaut benchmark_<application>_<date>.json)")
+    args = parser.parse_args()
+
+    masquer_journaux_streamlit()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    resultats = []
+    for taille in [int(t) for t in args.tailles.split(",") if t.strip()]:
+        print(f"{args.application} — {taille:,} lignes")
+        resultats.extend(executer_benchmarks(args.application, taille, args.repetitions, args.graine))
+
+    sortie = args.sortie or f"benchmark_{args.application}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(sortie, 'w') as f:
+        json.dump({
+            'application': args.application,
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'graine': args.graine,
+            'resultats': resultats
+        }, f, indent=4)
+    print(f"Résultats enregistrés dans {sortie}")
+
+
+if __name__ == "__main__":
+    main()
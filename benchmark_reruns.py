@@ -0,0 +1,243 @@
+"""Harnais de mesure de la latence des reruns Streamlit, sans navigateur.
+
+Rejoue une session réaliste (ajout des combinaisons, saisie de N combinaisons x 20 essais,
+enregistrement, rapport) sur jar_test1 à jar_test4 avec l'API de test de Streamlit
+(streamlit.testing.v1.AppTest), et relève pour chaque rerun la durée, le nombre de
+widgets et le pic mémoire.
+
+Exemple :
+    python benchmark_reruns.py --applications jar_test3,jar_test4 --combinaisons 4 --essais 20
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from streamlit.testing.v1 import AppTest
+
+TYPES_WIDGETS = [
+    "button", "checkbox", "date_input", "multiselect", "number_input", "radio",
+    "selectbox", "slider", "text_area", "text_input", "toggle"
+]
+
+
+def ecrire_catalogues(dossier, nombre_combinaisons):
+    """Crée un catalogue de réactifs suffisant pour `nombre_combinaisons` combinaisons distinctes"""
+    coagulants = [{"nom": "Aucun", "dilution": 1.0, "densite": 1.0, "matiere_active": 100.0, "prix_kg": 0.0}]
+    coagulants += [
+        {"nom": f"Coagulant {i + 1}", "dilution": 1.0, "densite": 1.35, "matiere_active": 18.0, "prix_kg": 0.5 + i / 10}
+        for i in range(nombre_combinaisons)
+    ]
+    floculants = [
+        {"nom": "Aucun", "type": "Liquide", "dilution": 1.0, "densite": 1.0, "matiere_active": 100.0, "prix_kg": 0.0},
+        {"nom": "Floculant 1", "type": "Liquide", "dilution": 1.0, "densite": 1.0, "matiere_active": 45.0, "prix_kg": 3.0}
+    ]
+    parametres = {
+        "parametres_mesures": ["Turbidité", "Couleur", "pH", "Conductivité", "MES", "UV254", "Aluminium résiduel", "Fer résiduel", "DCO"],
+        "parametres_selectionnes": ["Turbidité", "pH", "DCO"]
+    }
+    for nom, contenu in (("coagulants_config.json", coagulants), ("floculants_config.json", floculants), ("parametres_config.json", parametres)):
+        with open(os.path.join(dossier, nom), 'w') as f:
+            json.dump(contenu, f, indent=4)
+    return [c["nom"] for c in coagulants[1:]]
+
+
+def masquer_journaux_streamlit():
+    """Hors navigateur, Streamlit avertit à chaque appel st.* : on ne garde que les erreurs"""
+    logging.disable(logging.WARNING)
+
+
+class Harnais:
+    """Exécute l'application et mesure chaque rerun"""
+
+    def __init__(self, fichier_application, delai, memoire=True):
+        self.app = AppTest.from_file(fichier_application, default_timeout=delai)
+        self.memoire = memoire
+        self.mesures = []
+
+    def compter_widgets(self):
+        return sum(len(self.app.get(type_widget)) for type_widget in TYPES_WIDGETS)
+
+    def rerun(self, etape):
+        if self.memoire:
+            tracemalloc.reset_peak()
+        debut = time.perf_counter()
+        self.app.run()
+        duree = time.perf_counter() - debut
+        pic = tracemalloc.get_traced_memory()[1] / 1024 ** 2 if self.memoire else None
+
+        if self.app.exception:
+            raise RuntimeError(f"{etape} : {self.app.exception[0].message}")
+        widgets = self.compter_widgets()
+        if widgets == 0:
+            raise RuntimeError(f"{etape} : aucun widget rendu (erreur à l'exécution du script ?)")
+        self.mesures.append({
+            'etape': etape,
+            'rerun': len(self.mesures) + 1,
+            'duree_s': duree,
+            'widgets': widgets,
+            'memoire_pic_mo': pic
+        })
+
+    def widget(self, type_widget, label=None, contient=None):
+        for element in self.app.get(type_widget):
+            if (label is not None and element.label == label) or (contient is not None and contient in element.label):
+                return element
+        raise LookupError(f"{type_widget} introuvable : {label or contient}")
+
+    def cocher_si_present(self, cle, etape):
+        for case in self.app.checkbox:
+            if case.key == cle:
+                case.check()
+                self.rerun(etape)
+                return
+
+
+def verifier_enregistrement(combinaisons, nombre_essais):
+    """Chaque combinaison doit avoir ses `nombre_essais` essais dans la base de l'application (dossier courant)"""
+    conn = sqlite3.connect("jar_test_database.db")
+    try:
+        enregistres = dict(conn.execute('SELECT combinaison, COUNT(*) FROM mesures_jar_test GROUP BY combinaison').fetchall())
+    finally:
+        conn.close()
+    ecarts = [f"{combinaison} : {enregistres.get(combinaison, 0)}/{nombre_essais}" for combinaison in combinaisons
+              if enregistres.get(combinaison, 0) != nombre_essais]
+    if ecarts:
+        raise RuntimeError(f"essais enregistrés incomplets ({', '.join(ecarts)})")
+
+
+def jouer_session(harnais, coagulants, nombre_combinaisons, nombre_essais, saisie_groupee):
+    """Scénario type d'un technicien : combinaisons, saisie, enregistrement, rapport"""
+    harnais.rerun("chargement")
+
+    for coagulant in coagulants[:nombre_combinaisons]:
+        harnais.widget("selectbox", label="Coagulant").select(coagulant)
+        harnais.widget("selectbox", label="Floculant").select("Floculant 1")
+        harnais.rerun("sélection réactifs")
+        harnais.widget("button", contient="Ajouter combinaison").click()
+        harnais.rerun("ajout combinaison")
+
+    combinaisons = list(harnais.app.session_state.combinaisons)
+    for combinaison in combinaisons:
+        harnais.app.number_input(key=f"nb_essais_{combinaison}").set_value(nombre_essais)
+        harnais.rerun("nombre d'essais")
+
+        for i in range(nombre_essais):
+            harnais.app.number_input(key=f"coag_ppm_{combinaison}_{i}").set_value(float(10 * i))
+            harnais.app.number_input(key=f"dco_s_{combinaison}_{i}").set_value(float(150 - 5 * i))
+            if not saisie_groupee:
+                harnais.rerun("saisie essai")
+        if saisie_groupee:
+            harnais.rerun("saisie combinaison")
+
+    for combinaison in combinaisons:
+        # jar_test4 bloque l'enregistrement de valeurs jugées suspectes tant que la case n'est pas cochée
+        harnais.cocher_si_present(f"forcer_{combinaison}", "valeurs suspectes")
+        harnais.widget("button", contient=f"Enregistrer {combinaison}").click()
+        harnais.rerun("enregistrement")
+    verifier_enregistrement(combinaisons, nombre_essais)
+
+    # Tous les onglets sont exécutés à chaque rerun : ce dernier rerun construit le rapport
+    harnais.rerun("rapport")
+
+
+def percentile(valeurs, p):
+    valeurs = sorted(valeurs)
+    index = min(len(valeurs) - 1, max(0, round(p / 100 * (len(valeurs) - 1))))
+    return valeurs[index]
+
+
+def resumer(mesures):
+    """Synthèse par étape : nombre de reruns, p50/p95/max de durée, widgets et mémoire maximaux"""
+    etapes = {}
+    for mesure in mesures:
+        etapes.setdefault(mesure['etape'], []).append(mesure)
+    return {
+        etape: {
+            'reruns': len(liste),
+            'p50_s': statistics.median(m['duree_s'] for m in liste),
+            'p95_s': percentile([m['duree_s'] for m in liste], 95),
+            'max_s': max(m['duree_s'] for m in liste),
+            'widgets_max': max(m['widgets'] for m in liste),
+            'memoire_pic_mo': max((m['memoire_pic_mo'] for m in liste if m['memoire_pic_mo'] is not None), default=None)
+        }
+        for etape, liste in etapes.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latence des reruns Streamlit des applications Jar Test")
+    parser.add_argument("--applications", default="jar_test1,jar_test2,jar_test3,jar_test4")
+    parser.add_argument("--combinaisons", type=int, default=4)
+    parser.add_argument("--essais", type=int, default=20)
+    parser.add_argument("--saisie-groupee", action="store_true", help="Un seul rerun par combinaison au lieu d'un par essai")
+    parser.add_argument("--delai", type=float, default=120, help="Délai maximal d'un rerun (s)")
+    parser.add_argument("--sans-memoire", action="store_true", help="Désactive tracemalloc, qui ralentit sensiblement les reruns")
+    parser.add_argument("--sortie", default=None)
+    args = parser.parse_args()
+
+    dossier_depot = os.path.dirname(os.path.abspath(__file__))
+    dossier_initial = os.getcwd()
+    # Base SQLite du dossier temporaire, même si l'environnement désigne une autre base à jar_test4
+    os.environ.pop("JAR_TEST_BASE", None)
+    resultats = {}
+    masquer_journaux_streamlit()
+    if not args.sans_memoire:
+        tracemalloc.start()
+
+    for application in [a.strip() for a in args.applications.split(",") if a.strip()]:
+        print(f"{application} — {args.combinaisons} combinaisons x {args.essais} essais")
+        # Base et catalogues isolés : l'application utilise des chemins relatifs
+        with tempfile.TemporaryDirectory(prefix="reruns_jar_test_") as dossier:
+            os.chdir(dossier)
+            try:
+                coagulants = ecrire_catalogues(dossier, args.combinaisons)
+                harnais = Harnais(os.path.join(dossier_depot, f"{application}.py"), args.delai, not args.sans_memoire)
+                debut = time.perf_counter()
+                erreur = None
+                try:
+                    jouer_session(harnais, coagulants, args.combinaisons, args.essais, args.saisie_groupee)
+                except Exception as e:
+                    erreur = str(e)
+                    print(f"  échec : {erreur}")
+                resultats[application] = {
+                    'duree_totale_s': time.perf_counter() - debut,
+                    'erreur': erreur,
+                    'resume': resumer(harnais.mesures) if harnais.mesures else {},
+                    'reruns': harnais.mesures
+                }
+                for etape, resume in resultats[application]['resume'].items():
+                    memoire = f"{resume['memoire_pic_mo']:7.1f} Mo" if resume['memoire_pic_mo'] is not None else ""
+                    print(f"  {etape:<20} {resume['reruns']:4d} reruns  p50 {resume['p50_s'] * 1000:8.1f} ms  "
+                          f"p95 {resume['p95_s'] * 1000:8.1f} ms  {resume['widgets_max']:5d} widgets  {memoire}")
+            finally:
+                os.chdir(dossier_initial)
+
+    if not args.sans_memoire:
+        tracemalloc.stop()
+    sortie = args.sortie or f"benchmark_reruns_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(sortie, 'w') as f:
+        json.dump({
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'combinaisons': args.combinaisons,
+            'essais': args.essais,
+            'saisie_groupee': args.saisie_groupee,
+            'applications': resultats
+        }, f, indent=4)
+    print(f"Résultats enregistrés dans {sortie}")
+    echecs = [application for application, resultat in resultats.items() if resultat['erreur']]
+    if echecs:
+        sys.exit(f"Session interrompue : {', '.join(echecs)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""Comparaison des stockages SQLite et PostgreSQL de jar_test4 : mêmes résultats, durées mesurées.
+
+Les mêmes sessions synthétiques (benchmark_jar_test.generer_mesures) sont enregistrées par
+plusieurs postes simultanés (threads) dans une base SQLite et dans une base PostgreSQL, une
+partie d'entre elles deux fois pour exercer la mise à jour concurrente des mêmes essais. Les
+API de sessions, de recherche paginée, de facettes et d'agrégats sont ensuite appelées sur
+les deux stockages : toute différence de résultat fait échouer le script (code de sortie 1).
+
+PostgreSQL : serveur existant (--url, une base temporaire y est créée puis supprimée) ou
+cluster jetable créé avec initdb et pg_ctl (--pg-bin, compte non root : initdb refuse root).
+
+Exemple :
+    python benchmark_stockage.py --url postgresql://jar_test@localhost/postgres --lignes 20000 --ecrivains 4
+    python benchmark_stockage.py --pg-bin /usr/lib/postgresql/16/bin
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmark_jar_test import generer_mesures, masquer_journaux_streamlit
+
+
+def port_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ClusterJetable:
+    """Cluster PostgreSQL temporaire (initdb + pg_ctl), supprimé à l'arrêt"""
+
+    def __init__(self, pg_bin=None):
+        self.pg_bin = pg_bin
+        self.dossier = tempfile.mkdtemp(prefix="stockage_jar_test_pg_")
+        self.donnees = os.path.join(self.dossier, "donnees")
+        self.port = port_libre()
+
+    def commande(self, nom):
+        return os.path.join(self.pg_bin, nom) if self.pg_bin else nom
+
+    def demarrer(self):
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            raise RuntimeError("initdb refuse d'être exécuté par root : utiliser un autre compte ou --url")
+        subprocess.run([self.commande("initdb"), "-D", self.donnees, "-U", "jar_test", "-A", "trust", "--no-sync"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([self.commande("pg_ctl"), "-D", self.donnees, "-l", os.path.join(self.dossier, "journal.txt"), "-w",
+                        "-o", f"-p {self.port} -k {self.dossier} -c listen_addresses='' -c fsync=off", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        return f"postgresql://jar_test@/postgres?host={self.dossier}&port={self.port}"
+
+    def arreter(self):
+        subprocess.run([self.commande("pg_ctl"), "-D", self.donnees, "-m", "fast", "-w", "stop"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.dossier, ignore_errors=True)
+
+
+class BaseTemporairePostgreSQL:
+    """Base dédiée au benchmark sur un serveur existant : les tables de l'application n'y sont jamais touchées"""
+
+    def __init__(self, url):
+        import psycopg2
+        import psycopg2.extensions
+        self.psycopg2 = psycopg2
+        self.url = url
+        self.nom = f"jar_test_benchmark_{os.getpid()}"
+        self.dsn = psycopg2.extensions.make_dsn(url, dbname=self.nom)
+
+    def executer(self, requete):
+        conn = self.psycopg2.connect(self.url)
+        conn.autocommit = True
+        conn.cursor().execute(requete)
+        conn.close()
+
+    def creer(self):
+        self.executer(f"CREATE DATABASE {self.nom}")
+        return self.dsn
+
+    def supprimer(self):
+        self.executer(f"DROP DATABASE IF EXISTS {self.nom}")
+
+
+def sessions_de(mesures):
+    """Essais groupés par session (date, opérateur, site), dans l'ordre de génération"""
+    return [groupe.to_dict('records') for _, groupe in mesures.groupby(['date_test', 'operateur', 'site_prelevement'], sort=False)]
+
+
+def enregistrer(db_manager, sessions, ecrivains):
+    """Enregistre les sessions depuis `ecrivains` threads ; renvoie la durée totale et les durées par session"""
+    durees = []
+    verrou = threading.Lock()
+
+    def enregistrer_session(lignes):
+        debut = time.perf_counter()
+        db_manager.save_mesures(lignes)
+        with verrou:
+            durees.append(time.perf_counter() - debut)
+
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=ecrivains) as executeur:
+        list(executeur.map(enregistrer_session, sessions))
+    return time.perf_counter() - debut, durees
+
+
+def normaliser(valeur):
+    """Résultat comparable entre stockages : tables sans id ni created_at, lignes triées"""
+    if isinstance(valeur, pd.DataFrame):
+        table = valeur.drop(columns=[c for c in ('id', 'created_at') if c in valeur.columns]).reset_index(drop=True)
+        lignes = [tuple(normaliser(v) for v in ligne) for ligne in table.astype(object).itertuples(index=False, name=None)]
+        # Tri sur les valeurs arrondies : l'ordre ne dépend pas des erreurs d'arrondi
+        return list(table.columns), sorted(lignes, key=lambda ligne: repr([f"{v:.6g}" if isinstance(v, float) else v for v in ligne]))
+    if isinstance(valeur, pd.Series):
+        return normaliser(valeur.to_frame())
+    if isinstance(valeur, dict):
+        return {cle: normaliser(v) for cle, v in valeur.items()}
+    if isinstance(valeur, (list, tuple)):
+        return [normaliser(v) for v in valeur]
+    if isinstance(valeur, pd.Timestamp):
+        return valeur.isoformat()
+    if isinstance(valeur, np.generic):
+        valeur = valeur.item()
+    if isinstance(valeur, float):
+        return None if math.isnan(valeur) else valeur
+    return valeur
+
+
+def identiques(a, b):
+    """Égalité aux erreurs d'arrondi près : les sommes ne sont pas faites dans le même ordre par les deux moteurs"""
+    if isinstance(a, float) and isinstance(b, (int, float)) or isinstance(b, float) and isinstance(a, (int, float)):
+        # Tolérance absolue : écart-type d'une série constante, issu d'une différence de sommes de carrés
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+    if isinstance(a, dict) and isinstance(b, dict):
+        return list(a) == list(b) and all(identiques(a[cle], b[cle]) for cle in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(identiques(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def scenarios(mesures):
+    """Appels comparés sur les deux stockages : (nom, fonction de db_manager)"""
+    sites = sorted(mesures['site_prelevement'].unique())
+    date_fin = mesures['date_test'].max()
+    recherche = {'texte': "em-540", 'plages': {'abattement': (20.0, 80.0)}, 'facettes': {'site_prelevement': sites[:3]}}
+    accentuee = {'texte': "temoin", 'date_debut': "2021-01-01", 'date_fin': "2022-12-31"}
+
+    def avec(db_manager):
+        def page(criteres, numero, limite=100):
+            # Dates seulement, triées : dans une même date, l'ordre des id dépend de l'ordre d'enregistrement des postes
+            mesures_page, nombre = db_manager.rechercher_mesures(criteres, limite, decalage=(numero - 1) * limite)
+            return sorted(mesures_page['date_test']), nombre
+
+        return [
+            ("compter_mesures", db_manager.compter_mesures),
+            ("get_all_mesures", db_manager.get_all_mesures),
+            ("get_mesures_combinaison", lambda: db_manager.get_mesures_combinaison("PAC_18 + EM_540")),
+            ("rechercher_mesures (tout)", lambda: db_manager.rechercher_mesures(recherche)),
+            ("rechercher_mesures (page 3)", lambda: page(recherche, 3)),
+            ("rechercher_mesures (accents)", lambda: db_manager.rechercher_mesures(accentuee)),
+            ("compter_facettes", lambda: db_manager.compter_facettes(recherche)),
+            ("get_bornes", lambda: [db_manager.get_bornes('date_test'), db_manager.get_bornes('abattement')]),
+            ("get_sites_eau_brute", db_manager.get_sites_eau_brute),
+            ("get_serie_eau_brute (jour)", lambda: db_manager.get_serie_eau_brute(sites[0], 'turbidite_entree')),
+            ("get_serie_eau_brute (semaine)", lambda: db_manager.get_serie_eau_brute(sites[1], 'dco_entree', 'semaine')),
+            ("get_statistiques_eau_brute", lambda: db_manager.get_statistiques_eau_brute(sites[0], date_fin, 365)),
+            ("get_historique_essais", lambda: db_manager.get_historique_essais(sites[0], 'abattement', max_points=200)),
+            ("get_comparaison", db_manager.get_comparaison),
+            ("get_dimensions_comparaison", db_manager.get_dimensions_comparaison),
+        ]
+    return avec
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparaison des stockages SQLite et PostgreSQL de Jar Test")
+    parser.add_argument("--url", default=None, help="Serveur PostgreSQL existant (une base temporaire y est créée)")
+    parser.add_argument("--pg-bin", default=None, help="Dossier d'initdb et pg_ctl pour un cluster jetable (sinon PATH)")
+    parser.add_argument("--lignes", type=int, default=20000)
+    parser.add_argument("--ecrivains", type=int, default=4, help="Postes enregistrant en même temps")
+    parser.add_argument("--reenregistrees", type=float, default=0.1, help="Part des sessions enregistrées une seconde fois")
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--sortie", default=None)
+    args = parser.parse_args()
+
+    masquer_journaux_streamlit()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from jar_test4 import DatabaseManager, DatabaseManagerPostgreSQL
+
+    mesures = generer_mesures(args.lignes, args.graine)
+    sessions = sessions_de(mesures)
+    rng = np.random.default_rng(args.graine)
+    # Sessions enregistrées deux fois, à des moments différents : mises à jour concurrentes des mêmes essais
+    doublons = [sessions[i] for i in rng.choice(len(sessions), int(len(sessions) * args.reenregistrees), replace=False)]
+    a_enregistrer = sessions + doublons
+    rng.shuffle(a_enregistrer)
+    scenarios_de = scenarios(mesures)
+
+    serveur = ClusterJetable(args.pg_bin) if args.url is None else None
+    url = serveur.demarrer() if serveur else args.url
+    base_pg = BaseTemporairePostgreSQL(url)
+    dossier = tempfile.mkdtemp(prefix="stockage_jar_test_")
+    resultats = {}
+    differences = []
+    try:
+        stockages = {
+            'sqlite': DatabaseManager(os.path.join(dossier, "jar_test_database.db")),
+            'postgresql': DatabaseManagerPostgreSQL(base_pg.creer(), taille_pool=max(args.ecrivains, 2)),
+        }
+        print(f"{len(sessions)} sessions ({args.lignes} essais) + {len(doublons)} réenregistrées, {args.ecrivains} postes")
+        sorties = {}
+        for nom, db_manager in stockages.items():
+            duree, durees = enregistrer(db_manager, a_enregistrer, args.ecrivains)
+            if nom == 'postgresql':
+                # Statistiques du planificateur, tenues à jour par autovacuum en service : sans elles,
+                # la recherche plein texte d'une base tout juste remplie n'utilise pas l'index GIN
+                conn = db_manager.connecter()
+                conn.execute("ANALYZE")
+                conn.commit()
+                conn.close()
+            resultats[nom] = {'enregistrement': {
+                'duree_s': duree,
+                'sessions_par_s': len(a_enregistrer) / duree,
+                'p50_ms': statistics.median(durees) * 1000,
+                'p95_ms': float(np.percentile(durees, 95)) * 1000,
+                'max_ms': max(durees) * 1000
+            }, 'requetes': {}}
+            e = resultats[nom]['enregistrement']
+            print(f"  {nom:<10} enregistrement {e['duree_s']:7.2f} s  {e['sessions_par_s']:7.1f} sessions/s  "
+                  f"p50 {e['p50_ms']:7.1f} ms  p95 {e['p95_ms']:7.1f} ms  max {e['max_ms']:7.1f} ms")
+
+            sorties[nom] = {}
+            for requete, fonction in scenarios_de(db_manager):
+                durees = []
+                for _ in range(args.repetitions):
+                    debut = time.perf_counter()
+                    sortie = fonction()
+                    durees.append(time.perf_counter() - debut)
+                sorties[nom][requete] = normaliser(sortie)
+                resultats[nom]['requetes'][requete] = statistics.median(durees) * 1000
+
+        print(f"  {'requête':<32} {'sqlite':>10} {'postgresql':>12}")
+        for requete in sorties['sqlite']:
+            identique = identiques(sorties['sqlite'][requete], sorties['postgresql'][requete])
+            if not identique:
+                differences.append(requete)
+            print(f"  {requete:<32} {resultats['sqlite']['requetes'][requete]:8.1f} ms {resultats['postgresql']['requetes'][requete]:9.1f} ms"
+                  f"  {'identique' if identique else 'DIFFÉRENT'}")
+        stockages['postgresql'].pool.pool.closeall()
+        base_pg.supprimer()
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+        if serveur:
+            serveur.arreter()
+
+    sortie = args.sortie or f"benchmark_stockage_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(sortie, 'w') as f:
+        json.dump({
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'lignes': args.lignes,
+            'ecrivains': args.ecrivains,
+            'reenregistrees': len(doublons),
+            'differences': differences,
+            'resultats': resultats
+        }, f, indent=4)
+    print(f"Résultats enregistrés dans {sortie}")
+    if differences:
+        print(f"Résultats différents entre stockages : {', '.join(differences)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
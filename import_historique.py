@@ -0,0 +1,336 @@
+"""Import en masse de l'historique des jar tests (CSV / Excel) dans mesures_jar_test.
+
+Les fichiers sont lus par blocs, les colonnes associées à celles de save_mesure,
+les sessions (date, opérateur, site) déjà présentes en base ignorées, puis les lignes
+insérées par grandes transactions, index et triggers supprimés pendant le chargement et
+recréés à la fin. Le verrou d'écriture de l'application est tenu pendant tout l'import :
+ses enregistrements attendent la fin du chargement (jar_test1.py à jar_test3.py ne prennent
+pas ce verrou et doivent être fermés pendant l'import).
+
+Exemple :
+    python import_historique.py historique_2015_2023.csv --base jar_test_database.db
+    python import_historique.py essais.xlsx --correspondance colonnes.json --taille-bloc 50000
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+COLONNES_MESURE = [
+    'date_test', 'operateur', 'site_prelevement', 'type_eau', 'volume_echantillon',
+    'temps_coagulation', 'vitesse_coagulation', 'temps_floculation', 'vitesse_floculation',
+    'combinaison', 'essai', 'coagulant_ml', 'floculant_ml', 'dco_entree', 'ph_entree',
+    'dco_sortie', 'ph_sortie', 'v_boue', 'turbidite', 'abattement', 'turbidite_entree',
+    'turbidite_sortie', 'couleur_entree', 'couleur_sortie', 'mes_entree', 'mes_sortie',
+    'uv254_entree', 'uv254_sortie', 'aluminium_residuel', 'fer_residuel',
+    'conductivite_entree', 'conductivite_sortie'
+]
+COLONNES_TEXTE = ['date_test', 'operateur', 'site_prelevement', 'type_eau', 'combinaison', 'turbidite']
+COLONNES_ENTIERES = ['temps_coagulation', 'vitesse_coagulation', 'temps_floculation', 'vitesse_floculation', 'essai']
+CLE_SESSION = ['date_test', 'operateur', 'site_prelevement']
+CLE_ESSAI = CLE_SESSION + ['combinaison', 'essai']
+
+# Intitulés courants des feuilles de calcul, en plus du nom de colonne lui-même
+ALIAS = {
+    'date_test': ["date", "date essai", "date du test"],
+    'operateur': ["operateur", "technicien"],
+    'site_prelevement': ["site", "site de prelevement", "lieu"],
+    'type_eau': ["type d eau", "eau"],
+    'volume_echantillon': ["volume", "volume echantillon"],
+    'essai': ["pot", "numero essai", "n essai"],
+    'coagulant_ml': ["coagulant", "coagulant ml"],
+    'floculant_ml': ["floculant", "floculant ml"],
+    'dco_entree': ["dco e", "dco brute"],
+    'dco_sortie': ["dco s", "dco traitee"],
+    'ph_entree': ["ph e", "ph brut"],
+    'ph_sortie': ["ph s", "ph traite"],
+    'v_boue': ["volume boue", "boues"],
+    'abattement': ["abattement dco"],
+}
+
+
+def normaliser_nom(nom):
+    """'DCO sortie (mg/L)' -> 'dco sortie'"""
+    nom = unicodedata.normalize("NFKD", str(nom)).encode("ascii", "ignore").decode()
+    nom = re.sub(r"\(.*?\)|\[.*?\]", " ", nom.lower())
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", nom).split())
+
+
+def proposer_correspondance(colonnes_fichier, imposee=None):
+    """Colonne du fichier -> colonne de mesures_jar_test (nom, nom avec espaces ou alias)"""
+    normalisees = {normaliser_nom(c): c for c in colonnes_fichier}
+    correspondance = {}
+    for colonne in COLONNES_MESURE:
+        for nom in [colonne.replace("_", " ")] + ALIAS.get(colonne, []):
+            if nom in normalisees:
+                correspondance[normalisees[nom]] = colonne
+                break
+    for source, colonne in (imposee or {}).items():
+        if colonne not in COLONNES_MESURE:
+            raise ValueError(f"Colonne inconnue dans la correspondance : {colonne}")
+        correspondance = {s: c for s, c in correspondance.items() if c != colonne}
+        correspondance[source] = colonne
+    return correspondance
+
+
+def lire_blocs(chemin, taille_bloc, feuille=0):
+    """Lit le fichier par blocs de `taille_bloc` lignes sans le charger entièrement"""
+    if chemin.lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook
+        classeur = load_workbook(chemin, read_only=True, data_only=True)
+        onglet = classeur.worksheets[feuille] if isinstance(feuille, int) else classeur[feuille]
+        lignes = onglet.iter_rows(values_only=True)
+        entetes = [str(e) for e in next(lignes)]
+        bloc = []
+        for ligne in lignes:
+            bloc.append(ligne)
+            if len(bloc) == taille_bloc:
+                yield pd.DataFrame(bloc, columns=entetes)
+                bloc = []
+        if bloc:
+            yield pd.DataFrame(bloc, columns=entetes)
+        classeur.close()
+        return
+
+    with open(chemin, encoding="utf-8-sig", errors="replace") as f:
+        premiere_ligne = f.readline()
+    # Les exports « ; » des tableurs français utilisent la virgule décimale : le parseur C convertit alors
+    # directement les nombres, bien plus vite qu'une conversion des colonnes texte après coup
+    separateur = ";" if premiere_ligne.count(";") > premiere_ligne.count(",") else ","
+    decimal = "," if separateur == ";" else "."
+    yield from pd.read_csv(chemin, sep=separateur, decimal=decimal, chunksize=taille_bloc, encoding="utf-8-sig")
+
+
+def convertir_numerique(serie):
+    """Conversion vectorisée acceptant la virgule décimale"""
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(float)
+    texte = serie.astype(str).str.strip().str.replace(",", ".", regex=False)
+    return pd.to_numeric(texte, errors="coerce")
+
+
+def convertir_dates(serie, format_date=None):
+    """Dates au format `format_date` ; par défaut ISO (AAAA-MM-JJ) d'abord, puis jour en premier (JJ/MM/AAAA) pour les autres"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    if format_date:
+        return pd.to_datetime(serie, format=format_date, errors="coerce")
+    # Sans format, pandas déduit celui de la première valeur et l'applique à tout le bloc :
+    # avec dayfirst, 2020-05-01 serait lu AAAA-JJ-MM, soit le 5 janvier, et 2020-05-13 rejeté
+    texte = serie.astype(str).str.strip()
+    dates = pd.to_datetime(texte.str[:10], format="%Y-%m-%d", errors="coerce")
+    autres = dates.isna() & serie.notna() & (texte != "")
+    if autres.any():
+        dates[autres] = pd.to_datetime(texte[autres], format="mixed", dayfirst=True, errors="coerce")
+    return dates
+
+
+def preparer_bloc(bloc, correspondance, valeurs_defaut, format_date=None):
+    """Renomme, type et complète un bloc ; renvoie (lignes prêtes, nombre de lignes rejetées)"""
+    bloc = bloc[[c for c in correspondance if c in bloc.columns]].rename(columns=correspondance)
+    mesures = pd.DataFrame(index=bloc.index)
+    for colonne in COLONNES_MESURE:
+        if colonne in bloc:
+            source = bloc[colonne]
+        elif colonne in valeurs_defaut:
+            source = pd.Series(valeurs_defaut[colonne], index=bloc.index)
+        else:
+            source = pd.Series("" if colonne in COLONNES_TEXTE else 0.0, index=bloc.index)
+        if colonne == 'date_test':
+            mesures[colonne] = convertir_dates(source, format_date).dt.strftime("%Y-%m-%d")
+        elif colonne in COLONNES_TEXTE:
+            mesures[colonne] = source.fillna("").astype(str).str.strip()
+        else:
+            mesures[colonne] = convertir_numerique(source)
+
+    # Abattement recalculé lorsqu'il n'est pas fourni
+    if 'abattement' not in bloc:
+        entree, sortie = mesures['dco_entree'].to_numpy(), mesures['dco_sortie'].to_numpy()
+        mesure = (entree > 0) & (sortie > 0)
+        mesures['abattement'] = np.where(mesure, (entree - sortie) / np.where(mesure, entree, 1.0) * 100, 0.0)
+
+    valides = mesures['date_test'].notna() & mesures['essai'].notna() & (mesures['combinaison'] != "")
+    mesures = mesures[valides]
+    numeriques = [c for c in COLONNES_MESURE if c not in COLONNES_TEXTE]
+    mesures[numeriques] = mesures[numeriques].fillna(0.0)
+    mesures[COLONNES_ENTIERES] = mesures[COLONNES_ENTIERES].astype(int)
+    return mesures, int((~valides).sum())
+
+
+def differer_index(conn):
+    """Supprime les index et triggers de mesures_jar_test et renvoie leur définition pour les recréer"""
+    objets = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = 'mesures_jar_test' AND sql IS NOT NULL"
+    ).fetchall()
+    for type_objet, nom, _ in objets:
+        conn.execute(f'DROP {type_objet.upper()} "{nom}"')
+    return [sql for _, _, sql in objets]
+
+
+def indexer_plein_texte(conn, dernier_id):
+    """Ajoute à l'index plein texte les lignes insérées après dernier_id (ses triggers étaient différés)"""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'recherche_mesures'").fetchone():
+        return
+    colonnes = ", ".join(ligne[1] for ligne in conn.execute("PRAGMA table_info(recherche_mesures)"))
+    conn.execute(f"INSERT INTO recherche_mesures (rowid, {colonnes}) SELECT id, {colonnes} FROM mesures_jar_test WHERE id > ?", (dernier_id,))
+
+
+def recreer_index(conn, definitions, dernier_id):
+    """Recrée les index et triggers différés ; renvoie ceux qui n'ont pas pu l'être, avec l'erreur"""
+    echecs = []
+    for sql in definitions:
+        try:
+            conn.execute(sql)
+        except sqlite3.Error as e:
+            echecs.append((sql, e))
+    try:
+        indexer_plein_texte(conn, dernier_id)
+    except sqlite3.Error as e:
+        echecs.append(("index plein texte", e))
+    conn.commit()
+    return echecs
+
+
+def importer(chemin, db_manager, correspondance_imposee=None, valeurs_defaut=None, taille_bloc=20000,
+             lignes_par_transaction=200000, feuille=0, format_date=None):
+    """Charge le fichier et renvoie le bilan de l'import"""
+    # Aucun enregistrement de l'application pendant que la clé unique et les triggers sont supprimés
+    with db_manager.verrou_ecriture():
+        conn = sqlite3.connect(db_manager.db_file, timeout=db_manager.DELAI_ATTENTE)
+        try:
+            return charger(conn, db_manager, chemin, correspondance_imposee, valeurs_defaut or {}, taille_bloc,
+                           lignes_par_transaction, feuille, format_date)
+        finally:
+            conn.close()
+
+
+def charger(conn, db_manager, chemin, correspondance_imposee, valeurs_defaut, taille_bloc, lignes_par_transaction, feuille, format_date):
+    """Import dans la base ouverte par `conn`, sous le verrou d'écriture"""
+    conn.execute("PRAGMA cache_size = -200000")
+    sessions_existantes = set(conn.execute(
+        f"SELECT DISTINCT {', '.join(CLE_SESSION)} FROM mesures_jar_test"
+    ).fetchall())
+    dernier_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM mesures_jar_test").fetchone()[0]
+    index_differes = differer_index(conn)
+    conn.commit()
+
+    requete = (f"INSERT INTO mesures_jar_test ({', '.join(COLONNES_MESURE)}, created_at) "
+               f"VALUES ({', '.join('?' * len(COLONNES_MESURE))}, ?)")
+    bilan = {'lues': 0, 'inserees': 0, 'rejetees': 0, 'sessions_existantes': 0, 'doublons': 0}
+    deja_vus = set()
+    correspondance = None
+    en_cours = 0
+    debut = time.perf_counter()
+    try:
+        conn.execute("BEGIN")
+        for bloc in lire_blocs(chemin, taille_bloc, feuille):
+            if correspondance is None:
+                correspondance = proposer_correspondance(bloc.columns, correspondance_imposee)
+                manquantes = [c for c in ['date_test', 'combinaison', 'essai'] if c not in correspondance.values() and c not in valeurs_defaut]
+                if manquantes:
+                    raise ValueError(f"Colonnes obligatoires introuvables : {', '.join(manquantes)}")
+            bilan['lues'] += len(bloc)
+            mesures, rejetees = preparer_bloc(bloc, correspondance, valeurs_defaut, format_date)
+            bilan['rejetees'] += rejetees
+
+            cles_session = pd.MultiIndex.from_frame(mesures[CLE_SESSION])
+            existante = cles_session.isin(list(sessions_existantes)) if sessions_existantes else np.zeros(len(mesures), bool)
+            bilan['sessions_existantes'] += int(existante.sum())
+            mesures = mesures[~existante]
+
+            cles_essai = list(mesures[CLE_ESSAI].itertuples(index=False, name=None))
+            nouveau = np.fromiter((cle not in deja_vus for cle in cles_essai), bool, len(cles_essai))
+            doublon_bloc = mesures[CLE_ESSAI].duplicated().to_numpy()
+            garder = nouveau & ~doublon_bloc
+            deja_vus.update(cle for cle, g in zip(cles_essai, garder) if g)
+            bilan['doublons'] += int((~garder).sum())
+            mesures = mesures[garder]
+
+            # La date de l'essai sert de date de création : l'historique se classe après les saisies récentes
+            lignes = mesures[COLONNES_MESURE].assign(created_at=mesures['date_test'] + " 00:00:00")
+            conn.executemany(requete, lignes.itertuples(index=False, name=None))
+            bilan['inserees'] += len(lignes)
+            en_cours += len(lignes)
+            if en_cours >= lignes_par_transaction:
+                # Insertions comptées avec leur transaction, sans report dans les tables dérivées (recalculées à la fin)
+                db_manager.compter_ecritures(conn, en_cours, 0, tables_derivees=False)
+                conn.commit()
+                conn.execute("BEGIN")
+                en_cours = 0
+
+            duree = time.perf_counter() - debut
+            print(f"  {bilan['lues']:>10} lues  {bilan['inserees']:>10} insérées  {bilan['inserees'] / duree:>10.0f} lignes/s", flush=True)
+        db_manager.compter_ecritures(conn, en_cours, 0, tables_derivees=False)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        # Index recréés avant de remonter l'erreur de l'import, qu'un échec de recréation ne masque pas
+        for sql, erreur in recreer_index(conn, index_differes, dernier_id):
+            print(f"  Non recréé ({erreur}) : {sql}", file=sys.stderr)
+        raise
+    debut_index = time.perf_counter()
+    echecs = recreer_index(conn, index_differes, dernier_id)
+    if echecs:
+        raise RuntimeError("Import terminé, mais index ou triggers non recréés :\n"
+                           + "\n".join(f"  {erreur} : {sql}" for sql, erreur in echecs))
+    bilan['duree_index_s'] = time.perf_counter() - debut_index
+
+    bilan['duree_s'] = time.perf_counter() - debut
+    bilan['lignes_par_s'] = bilan['inserees'] / bilan['duree_s'] if bilan['duree_s'] > 0 else 0.0
+    bilan['correspondance'] = correspondance
+    return bilan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import en masse de l'historique des jar tests")
+    parser.add_argument("fichiers", nargs="+", help="Fichiers CSV ou Excel (.xlsx)")
+    parser.add_argument("--base", default="jar_test_database.db")
+    parser.add_argument("--correspondance", default=None, help="JSON {colonne du fichier: colonne de mesures_jar_test}")
+    parser.add_argument("--defaut", action="append", default=[], metavar="COLONNE=VALEUR",
+                        help="Valeur des colonnes absentes du fichier, ex. --defaut site_prelevement='Station Nord'")
+    parser.add_argument("--feuille", default="0", help="Feuille Excel (numéro ou nom)")
+    parser.add_argument("--format-date", default=None,
+                        help="Format des dates, ex. %%d/%%m/%%Y (par défaut AAAA-MM-JJ, sinon jour en premier)")
+    parser.add_argument("--taille-bloc", type=int, default=20000)
+    parser.add_argument("--lignes-par-transaction", type=int, default=200000)
+    args = parser.parse_args()
+
+    correspondance = None
+    if args.correspondance:
+        with open(args.correspondance, 'r') as f:
+            correspondance = json.load(f)
+    valeurs_defaut = dict(defaut.split("=", 1) for defaut in args.defaut)
+    feuille = int(args.feuille) if args.feuille.isdigit() else args.feuille
+
+    # Création de la table avec le schéma de l'application (importée sans navigateur)
+    logging.disable(logging.WARNING)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from jar_test4 import DatabaseManager
+    db_manager = DatabaseManager(args.base)
+
+    for chemin in args.fichiers:
+        print(f"{chemin} -> {args.base}")
+        bilan = importer(chemin, db_manager, correspondance, valeurs_defaut, args.taille_bloc,
+                         args.lignes_par_transaction, feuille, args.format_date)
+        print(f"  correspondance : {bilan['correspondance']}")
+        print(f"  {bilan['inserees']} lignes insérées sur {bilan['lues']} lues en {bilan['duree_s']:.1f} s "
+              f"({bilan['lignes_par_s']:.0f} lignes/s, index recréés en {bilan['duree_index_s']:.1f} s)")
+        print(f"  ignorées : {bilan['sessions_existantes']} (session déjà en base), "
+              f"{bilan['doublons']} (doublons), {bilan['rejetees']} (date, combinaison ou essai manquant)")
+
+    # Séries de l'eau brute et agrégats de comparaison ne sont tenus à jour que par save_mesures : recalcul complet après l'import
+    debut = time.perf_counter()
+    db_manager.rattraper_agregats()
+    print(f"Séries de l'eau brute et agrégats de comparaison recalculés en {time.perf_counter() - debut:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,19 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import io
+import hashlib
+import threading
+from collections import OrderedDict
 from datetime import datetime
+from matplotlib.figure import Figure
 import plotly.graph_objects as go
 import plotly.express as px
 import json
 import sqlite3
 import os
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors
 from reportlab.lib.units import inch
@@ -56,6 +59,10 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 class DatabaseManager:
+    CLE_NATURELLE = ("date_test", "operateur", "site_prelevement", "combinaison", "essai")
+    # Dernière version de schema_migrations (migrations de jar_test4.py) dont cette application connaît les tables
+    VERSION_SCHEMA = 6
+
     def __init__(self):
         self.db_file = "jar_test_database.db"
         self.init_database()
@@ -63,6 +70,13 @@ class DatabaseManager:
     def init_database(self):
         conn = sqlite3.connect(self.db_file)
         cursor = conn.cursor()
+
+        # Base migrée par une version plus récente de jar_test4.py : ne pas y écrire avec un schéma inconnu
+        if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_migrations'").fetchone():
+            version = cursor.execute('SELECT MAX(version) FROM schema_migrations').fetchone()[0]
+            if version is not None and version > self.VERSION_SCHEMA:
+                conn.close()
+                raise RuntimeError(f"Schéma de la base en version {version}, plus récent que cette version de l'application")
         
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS mesures_jar_test (
@@ -102,9 +116,34 @@ class DatabaseManager:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+
+        # Clé naturelle d'un essai : l'enregistrer à nouveau met à jour la ligne existante
+        index_cle = f'CREATE UNIQUE INDEX IF NOT EXISTS idx_mesures_cle_naturelle ON mesures_jar_test ({", ".join(self.CLE_NATURELLE)})'
+        try:
+            cursor.execute(index_cle)
+        except sqlite3.IntegrityError:
+            # Base enregistrée avant la clé : dédoublonnage unique puis création de l'index
+            self.supprimer_doublons(cursor)
+            cursor.execute(index_cle)
+
+        # Compteurs d'écritures de jar_test4.py (migration 4), s'il a déjà ouvert la base
+        self.compteurs_mesures = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'compteurs_mesures'"
+        ).fetchone() is not None
         
         conn.commit()
         conn.close()
+
+    def supprimer_doublons(self, cursor):
+        """Ne conserve que le dernier enregistrement de chaque essai (session, combinaison, essai)"""
+        # L'index unique tient pour distinctes les clés contenant NULL : GROUP BY les réunirait, elles sont laissées
+        cle_complete = " AND ".join(f"{colonne} IS NOT NULL" for colonne in self.CLE_NATURELLE)
+        cursor.execute(f'''
+            DELETE FROM mesures_jar_test WHERE {cle_complete} AND id NOT IN (
+                SELECT MAX(id) FROM mesures_jar_test WHERE {cle_complete} GROUP BY {", ".join(self.CLE_NATURELLE)}
+            )
+        ''')
+        return cursor.rowcount
     
     def save_mesure(self, data):
         conn = sqlite3.connect(self.db_file)
@@ -120,6 +159,20 @@ class DatabaseManager:
                 uv254_entree, uv254_sortie, aluminium_residuel, fer_residuel,
                 conductivite_entree, conductivite_sortie
             ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (date_test, operateur, site_prelevement, combinaison, essai) DO UPDATE SET
+                type_eau = excluded.type_eau, volume_echantillon = excluded.volume_echantillon,
+                temps_coagulation = excluded.temps_coagulation, vitesse_coagulation = excluded.vitesse_coagulation,
+                temps_floculation = excluded.temps_floculation, vitesse_floculation = excluded.vitesse_floculation,
+                coagulant_ml = excluded.coagulant_ml, floculant_ml = excluded.floculant_ml,
+                dco_entree = excluded.dco_entree, ph_entree = excluded.ph_entree,
+                dco_sortie = excluded.dco_sortie, ph_sortie = excluded.ph_sortie, v_boue = excluded.v_boue,
+                turbidite = excluded.turbidite, abattement = excluded.abattement,
+                turbidite_entree = excluded.turbidite_entree, turbidite_sortie = excluded.turbidite_sortie,
+                couleur_entree = excluded.couleur_entree, couleur_sortie = excluded.couleur_sortie,
+                mes_entree = excluded.mes_entree, mes_sortie = excluded.mes_sortie,
+                uv254_entree = excluded.uv254_entree, uv254_sortie = excluded.uv254_sortie,
+                aluminium_residuel = excluded.aluminium_residuel, fer_residuel = excluded.fer_residuel,
+                conductivite_entree = excluded.conductivite_entree, conductivite_sortie = excluded.conductivite_sortie
         ''', (
             data['date_test'], data['operateur'], data['site_prelevement'], data['type_eau'],
             data['volume_echantillon'], data['temps_coagulation'], data['vitesse_coagulation'],
@@ -132,6 +185,9 @@ class DatabaseManager:
             data['aluminium_residuel'], data['fer_residuel'], data['conductivite_entree'],
             data['conductivite_sortie']
         ))
+        if self.compteurs_mesures:
+            # Insertion ou mise à jour, sans report dans les tables dérivées : jar_test4.py les recalcule à son démarrage
+            cursor.execute('UPDATE compteurs_mesures SET modifications = modifications + 1')
         
         conn.commit()
         conn.close()
@@ -340,10 +396,170 @@ def calculer_volume_solution_commerciale(ppm_commercial, volume_ppm, volume_eau_
     """Calcule le volume de solution commerciale pure"""
     return ppm_commercial * volume_ppm * volume_eau_l
 
+def extraire_reactifs_combinaison(combinaison):
+    """Retourne les noms (coagulant, floculant) d'une combinaison"""
+    coagulant_nom = "Aucun"
+    floculant_nom = "Aucun"
+    if "Coagulant seul:" in combinaison:
+        coagulant_nom = combinaison.replace("Coagulant seul: ", "")
+    elif "Floculant seul:" in combinaison:
+        floculant_nom = combinaison.replace("Floculant seul: ", "")
+    elif " + " in combinaison:
+        parts = combinaison.split(" + ")
+        coagulant_nom = parts[0]
+        floculant_nom = parts[1]
+    return coagulant_nom, floculant_nom
+
+def calculer_consommation_annuelle(ppm_commercial, densite, matiere_active, prix_kg, debit_annuel):
+    """Calcule le volume (L/an), les masses commerciale et active (kg/an) et le coût (€/an) d'un réactif"""
+    # 1 ppm = 1 g de produit commercial par m³ : g/an -> kg/an. La matière active et la dilution n'interviennent
+    # pas ici : elles servent seulement à convertir les mL dosés en ppm (calculer_volume_ppm)
+    masse_commerciale = ppm_commercial * debit_annuel / 1000
+    masse_active = masse_commerciale * matiere_active / 100
+    volume_l = masse_commerciale / np.where(np.asarray(densite, dtype=float) > 0, densite, np.nan)
+    cout = masse_commerciale * prix_kg
+    return volume_l, masse_commerciale, masse_active, cout
+
+def caracteristiques_reactif(reactif):
+    """Retourne (densite, matiere_active, prix_kg) d'un réactif du catalogue"""
+    return reactif['densite'], reactif['matiere_active'], reactif['prix_kg']
+
+def projeter_consommation_annuelle(tableau_essais, coagulants_config, floculants_config, debit_annuel):
+    """Projette la consommation et le coût annuels des réactifs pour chaque essai de chaque combinaison"""
+    if not tableau_essais:
+        return pd.DataFrame()
+
+    # Caractéristiques des réactifs, une ligne par combinaison
+    reactifs = []
+    for combinaison in tableau_essais:
+        coag_nom, floc_nom = extraire_reactifs_combinaison(combinaison)
+        coag_info = next((c for c in coagulants_config if c["nom"] == coag_nom), coagulants_config[0])
+        floc_info = next((f for f in floculants_config if f["nom"] == floc_nom), floculants_config[0])
+        reactifs.append((combinaison,) + caracteristiques_reactif(coag_info) + caracteristiques_reactif(floc_info))
+    reactifs = pd.DataFrame(reactifs, columns=[
+        'Combinaison',
+        'coag_densite', 'coag_matiere_active', 'coag_prix_kg',
+        'floc_densite', 'floc_matiere_active', 'floc_prix_kg'
+    ])
+
+    # Table unique de tous les essais de la session, calcul vectorisé
+    essais = pd.concat(tableau_essais, names=['Combinaison', None]).reset_index(level=0)
+    essais = essais[['Combinaison', 'Essai', 'Coagulant_ppm_com', 'Floculant_ppm_com']].merge(reactifs, on='Combinaison', how='left')
+
+    projection = pd.DataFrame({'Combinaison': essais['Combinaison'], 'Essai': essais['Essai'].astype(int)})
+    for prefixe, colonne_ppm in (('Coag', 'Coagulant_ppm_com'), ('Floc', 'Floculant_ppm_com')):
+        cle = prefixe.lower()
+        volume_l, masse_commerciale, masse_active, cout = calculer_consommation_annuelle(
+            essais[colonne_ppm].to_numpy(dtype=float),
+            essais[f'{cle}_densite'].to_numpy(dtype=float),
+            essais[f'{cle}_matiere_active'].to_numpy(dtype=float),
+            essais[f'{cle}_prix_kg'].to_numpy(dtype=float),
+            debit_annuel
+        )
+        projection[f'{prefixe} (ppm com.)'] = essais[colonne_ppm].to_numpy(dtype=float)
+        projection[f'{prefixe} (L/an)'] = volume_l
+        projection[f'{prefixe} commercial (kg/an)'] = masse_commerciale
+        projection[f'{prefixe} actif (kg/an)'] = masse_active
+        projection[f'{prefixe} (€/an)'] = cout
+
+    projection['Total (€/an)'] = projection['Coag (€/an)'] + projection['Floc (€/an)']
+    projection['Coût (€/m³)'] = projection['Total (€/an)'] / debit_annuel if debit_annuel else 0.0
+    return projection
+
+# Colonnes lues par les graphiques : seules elles entrent dans l'empreinte des mesures
+COLONNES_GRAPHIQUES = ['combinaison', 'essai', 'coagulant_ml', 'abattement', 'v_boue']
+
+class CacheFigures:
+    """Figures mémorisées par empreinte des données, avec éviction LRU au-delà de taille_max entrées"""
+    
+    def __init__(self, taille_max=32):
+        self.taille_max = taille_max
+        self.entrees = OrderedDict()
+        # Le cache est partagé par les sessions, servies chacune dans leur propre thread
+        self.verrou = threading.Lock()
+    
+    def obtenir(self, cle, construire):
+        with self.verrou:
+            if cle in self.entrees:
+                self.entrees.move_to_end(cle)
+                return self.entrees[cle]
+        valeur = construire()
+        with self.verrou:
+            self.entrees[cle] = valeur
+            while len(self.entrees) > self.taille_max:
+                self.entrees.popitem(last=False)
+        return valeur
+
+@st.cache_resource
+def obtenir_cache_figures():
+    """Cache de figures partagé entre reruns et sessions"""
+    return CacheFigures()
+
+def empreinte_mesures(mesures):
+    """Empreinte des colonnes tracées, ordre des lignes compris (il fixe le tracé des courbes)"""
+    valeurs = pd.util.hash_pandas_object(mesures[COLONNES_GRAPHIQUES], index=False).values
+    return hashlib.sha1(valeurs.tobytes()).hexdigest()
+
+def figures_resultats(mesures):
+    """Figures plotly de l'onglet Résultats, reconstruites seulement si les mesures changent"""
+    def construire():
+        fig_dco = px.line(
+            mesures, x='coagulant_ml', y='abattement', color='combinaison',
+            title='Abattement DCO en fonction du dosage de coagulant',
+            markers=True
+        )
+        fig_boue = px.bar(
+            mesures, x='essai', y='v_boue', color='combinaison',
+            title='Volume de boue par essai et combinaison',
+            barmode='group'
+        )
+        return fig_dco, fig_boue
+    return obtenir_cache_figures().obtenir(('plotly', empreinte_mesures(mesures)), construire)
+
+def images_resultats(mesures):
+    """Graphiques PNG des rapports, rendus une fois par jeu de mesures"""
+    def construire():
+        images = {}
+        combinaisons = list(dict.fromkeys(mesures['combinaison']))
+        
+        # Figure plutôt que pyplot : l'état global de pyplot n'est pas sûr entre threads
+        fig = Figure(figsize=(8, 4), dpi=100)
+        ax = fig.add_subplot()
+        for combinaison in combinaisons:
+            donnees = mesures[mesures['combinaison'] == combinaison]
+            ax.plot(donnees['coagulant_ml'], donnees['abattement'], marker='o', label=combinaison)
+        ax.set_title('Abattement DCO en fonction du dosage de coagulant')
+        ax.set_xlabel('Coagulant (mL)')
+        ax.set_ylabel('Abattement (%)')
+        ax.grid(alpha=0.3)
+        ax.legend(fontsize=7)
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+        images['abattement'] = buffer.getvalue()
+        
+        fig = Figure(figsize=(8, 4), dpi=100)
+        ax = fig.add_subplot()
+        largeur = 0.8 / max(len(combinaisons), 1)
+        for j, combinaison in enumerate(combinaisons):
+            donnees = mesures[mesures['combinaison'] == combinaison]
+            ax.bar(donnees['essai'] + (j - (len(combinaisons) - 1) / 2) * largeur, donnees['v_boue'], width=largeur, label=combinaison)
+        ax.set_title('Volume de boue par essai et combinaison')
+        ax.set_xlabel('Essai')
+        ax.set_ylabel('Volume de boue (mL)')
+        ax.grid(alpha=0.3, axis='y')
+        ax.legend(fontsize=7)
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+        images['boue'] = buffer.getvalue()
+        return images
+    return obtenir_cache_figures().obtenir(('png', empreinte_mesures(mesures)), construire)
+
 def generer_rapport_pdf(date_test, operateur, site_prelevement, type_eau, volume_echantillon, 
                        temps_coagulation, vitesse_coagulation, temps_floculation, vitesse_floculation,
                        caracteristiques, debit_annuel, meilleur_abattement, coagulants_config, floculants_config,
-                       tableau_essais):
+                       tableau_essais, images=None):
     """Génère un rapport PDF avec les informations actuelles et les tableaux des essais"""
     
     buffer = io.BytesIO()
@@ -469,6 +685,37 @@ def generer_rapport_pdf(date_test, operateur, site_prelevement, type_eau, volume
         story.append(table)
         story.append(Spacer(1, 0.2*inch))
     
+    # Projection annuelle des réactifs
+    projection = projeter_consommation_annuelle(tableau_essais, coagulants_config, floculants_config, debit_annuel)
+    if not projection.empty:
+        story.append(Paragraph("💶 Projection annuelle des réactifs", styles['Heading2']))
+        table_data = [["Combinaison", "Essai", "Coag (kg/an)", "Coag (€/an)", "Floc (kg/an)", "Floc (€/an)", "Total (€/an)", "€/m³"]]
+        for _, ligne in projection.iterrows():
+            table_data.append([
+                Paragraph(ligne['Combinaison'], styles['Normal']),
+                str(ligne['Essai']),
+                f"{ligne['Coag commercial (kg/an)']:,.1f}",
+                f"{ligne['Coag (€/an)']:,.2f}",
+                f"{ligne['Floc commercial (kg/an)']:,.1f}",
+                f"{ligne['Floc (€/an)']:,.2f}",
+                f"{ligne['Total (€/an)']:,.2f}",
+                f"{ligne['Coût (€/m³)']:.4f}"
+            ])
+        table_projection = Table(table_data, colWidths=[1.6*inch, 0.5*inch, 0.8*inch, 0.8*inch, 0.8*inch, 0.8*inch, 0.8*inch, 0.6*inch])
+        table_projection.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.lightblue),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 8),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('FONTSIZE', (0, 1), (-1, -1), 7),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.black)
+        ]))
+        story.append(table_projection)
+        story.append(Spacer(1, 0.2*inch))
+    
     # Meilleur Résultat
     if meilleur_abattement is not None:
         story.append(Paragraph("🏆 Meilleur Résultat", styles['Heading2']))
@@ -491,6 +738,14 @@ def generer_rapport_pdf(date_test, operateur, site_prelevement, type_eau, volume
             ('GRID', (0, 0), (-1, -1), 1, colors.black)
         ]))
         story.append(table_meilleur)
+        story.append(Spacer(1, 0.2*inch))
+    
+    # Graphiques pré-rendus (images_resultats)
+    if images:
+        story.append(Paragraph("📈 Graphiques", styles['Heading2']))
+        for image in images.values():
+            story.append(Image(io.BytesIO(image), width=6*inch, height=3*inch))
+            story.append(Spacer(1, 0.1*inch))
     
     # Pied de page
     story.append(Spacer(1, 0.3*inch))
@@ -1040,10 +1295,12 @@ def main():
             coagulant_info = next((c for c in coagulants_config if c["nom"] == coagulant_nom), coagulants_config[0])
             floculant_info = next((f for f in floculants_config if f["nom"] == floculant_nom), floculants_config[0])
             
-            # Initialiser le tableau pour cette combinaison
-            if combinaison not in st.session_state.tableau_essais:
+            # Initialiser le tableau pour cette combinaison, ou le compléter si le nombre d'essais augmente
+            tableau = st.session_state.tableau_essais.get(combinaison)
+            deja_saisis = 0 if tableau is None else len(tableau)
+            if deja_saisis < nombre_essais:
                 donnees_initiales = []
-                for i in range(nombre_essais):
+                for i in range(deja_saisis, nombre_essais):
                     # Calcul des dosages par défaut
                     coag_ml = 0.0
                     floc_ml = 0.0
@@ -1089,7 +1346,8 @@ def main():
                         'Conductivite_sortie': 0.0
                     })
                 
-                st.session_state.tableau_essais[combinaison] = pd.DataFrame(donnees_initiales)
+                nouveaux = pd.DataFrame(donnees_initiales)
+                st.session_state.tableau_essais[combinaison] = nouveaux if tableau is None else pd.concat([tableau, nouveaux], ignore_index=True)
             
             # Interface de saisie
             st.write("**Tableau de saisie:**")
@@ -1272,21 +1530,12 @@ def main():
             
             if not mesures_courantes.empty:
                 col1, col2 = st.columns(2)
+                fig_dco, fig_boue = figures_resultats(mesures_courantes)
                 
                 with col1:
-                    fig_dco = px.line(
-                        mesures_courantes, x='coagulant_ml', y='abattement', color='combinaison',
-                        title='Abattement DCO en fonction du dosage de coagulant',
-                        markers=True
-                    )
                     st.plotly_chart(fig_dco, use_container_width=True)
                 
                 with col2:
-                    fig_boue = px.bar(
-                        mesures_courantes, x='essai', y='v_boue', color='combinaison',
-                        title='Volume de boue par essai et combinaison',
-                        barmode='group'
-                    )
                     st.plotly_chart(fig_boue, use_container_width=True)
     
     with tab4:
@@ -1357,16 +1606,22 @@ def main():
                         
                         rapport += f"| {int(row['Essai'])} | {row['Coagulant_ppm_com']:.2f} | {coag_actif:.2f} | {row['Floculant_ppm_com']:.2f} | {floc_actif:.2f} | {row['DCO_entree']:.2f} | {row['DCO_sortie']:.2f} | {row['pH_entree']:.2f} | {row['pH_sortie']:.2f} | {row['V_boue']:.2f} | {row['Abattement']:.2f}% |\n"
                 
-                rapport += f"\n---\n*Rapport généré automatiquement le {datetime.now().strftime("%d/%m/%Y à %H:%M")}*"
+                rapport += f"\n---\n*Rapport généré automatiquement le {datetime.now().strftime('%d/%m/%Y à %H:%M')}*"
                 
                 st.markdown(rapport)
                 
+                # Mêmes images pour l'affichage du rapport et pour le PDF
+                images = images_resultats(mesures_courantes)
+                st.markdown("## 📈 Graphiques")
+                for image in images.values():
+                    st.image(image)
+                
                 # Téléchargement du rapport en PDF avec les tableaux
                 pdf_buffer = generer_rapport_pdf(
                     date_test, operateur, site_prelevement, type_eau, volume_echantillon,
                     temps_coagulation, vitesse_coagulation, temps_floculation, vitesse_floculation,
                     caracteristiques, debit_annuel, meilleur_abattement, coagulants_config, floculants_config,
-                    st.session_state.tableau_essais
+                    st.session_state.tableau_essais, images
                 )
                 
                 st.download_button(
@@ -6,6 +6,33 @@ from datetime import datetime
 import json
 import sqlite3
 import os
+import re
+import sys
+import math
+import unicodedata
+import time
+import functools
+import threading
+import copy
+import random
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict, defaultdict, deque
+from datetime import timedelta
+
+import plotly.graph_objects as go
+try:
+    # Stockage PostgreSQL facultatif (JAR_TEST_BASE=postgresql://...)
+    import psycopg2
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+try:
+    import fcntl
+except ImportError:
+    # Windows : verrouillage par msvcrt
+    fcntl = None
+    import msvcrt
 
 # Configuration de la page
 st.set_page_config(
@@ -61,15 +88,617 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@contextmanager
+def verrou_fichier(chemin):
+    """Verrou exclusif entre processus (et entre threads), posé sur le fichier <chemin>.lock"""
+    with open(chemin + ".lock", "a+b") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            # LK_LOCK n'essaie qu'une fois par seconde : essais non bloquants rapprochés
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.005)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def signature_fichier(etat):
+    """Identifie une version d'un fichier : chaque remplacement atomique crée un nouveau fichier"""
+    return (etat.st_ino, etat.st_mtime_ns, etat.st_size)
+
+def ecrire_json_atomique(chemin, donnees, tentatives=5):
+    """Écrit un fichier temporaire puis le renomme : un lecteur voit l'ancien ou le nouveau contenu, jamais un fichier tronqué"""
+    # Nom fixe : l'appelant tient verrou_fichier(chemin)
+    temporaire = chemin + ".tmp"
+    with open(temporaire, 'w') as f:
+        json.dump(donnees, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    for tentative in range(tentatives):
+        try:
+            os.replace(temporaire, chemin)
+            return
+        except PermissionError:
+            # Windows refuse le remplacement tant qu'un lecteur a le fichier ouvert
+            if tentative == tentatives - 1:
+                raise
+            time.sleep(0.05 * (tentative + 1))
+
+def ajouter_au_journal(fichier, lignes, taille_max):
+    """Ajoute des lignes à un journal tournant : au-delà de taille_max, l'ancien fichier devient .1"""
+    try:
+        # Journal partagé par les processus de l'application : une seule rotation à la fois
+        with verrou_fichier(fichier):
+            if os.path.exists(fichier) and os.path.getsize(fichier) > taille_max:
+                os.replace(fichier, fichier + ".1")
+            with open(fichier, 'a', encoding="utf-8") as f:
+                f.writelines(ligne + "\n" for ligne in lignes)
+    except OSError:
+        pass
+
+class Chronometre:
+    """Mesure légère de la durée des sections de l'application, désactivée par défaut"""
+
+    def __init__(self, fichier_journal="jar_test_diagnostic.log", taille_historique=500, taille_max_journal=1_000_000):
+        self.actif = os.environ.get("JAR_TEST_DIAGNOSTIC", "0") == "1"
+        self.fichier_journal = fichier_journal
+        self.taille_max_journal = taille_max_journal
+        self.durees = defaultdict(lambda: deque(maxlen=taille_historique))
+        if self.actif:
+            self.charger_journal()
+
+    def charger_journal(self):
+        """Reprend les durées du journal pour des statistiques sur plusieurs redémarrages"""
+        try:
+            with open(self.fichier_journal, encoding="utf-8") as f:
+                for ligne in f:
+                    morceaux = ligne.rstrip("\n").split(";")
+                    if len(morceaux) == 3:
+                        self.durees[morceaux[1]].append(float(morceaux[2]))
+        except (OSError, ValueError):
+            pass
+
+    def enregistrer(self, nom, duree_ms):
+        self.durees[nom].append(duree_ms)
+        ajouter_au_journal(
+            self.fichier_journal,
+            [f"{datetime.now().isoformat(timespec='milliseconds')};{nom};{duree_ms:.3f}"],
+            self.taille_max_journal
+        )
+
+    @contextmanager
+    def _mesurer(self, nom):
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.enregistrer(nom, (time.perf_counter() - debut) * 1000)
+
+    def section(self, nom):
+        """Contexte chronométrant une section (sans effet si le diagnostic est désactivé)"""
+        return self._mesurer(nom) if self.actif else nullcontext()
+
+    def instrumenter(self, nom):
+        """Décorateur chronométrant chaque appel de la fonction"""
+        def decorateur(fonction):
+            @functools.wraps(fonction)
+            def enveloppe(*args, **kwargs):
+                if not self.actif:
+                    return fonction(*args, **kwargs)
+                with self._mesurer(nom):
+                    return fonction(*args, **kwargs)
+            return enveloppe
+        return decorateur
+
+    def statistiques(self):
+        """Nombre d'appels et p50/p95/max (ms) par section"""
+        lignes = []
+        for nom, durees in list(self.durees.items()):
+            valeurs = np.array(durees)
+            if len(valeurs):
+                lignes.append({
+                    'Section': nom,
+                    'Appels': len(valeurs),
+                    'p50 (ms)': np.percentile(valeurs, 50),
+                    'p95 (ms)': np.percentile(valeurs, 95),
+                    'Max (ms)': valeurs.max()
+                })
+        if not lignes:
+            return pd.DataFrame()
+        return pd.DataFrame(lignes).sort_values('p95 (ms)', ascending=False).round(2).reset_index(drop=True)
+
+@st.cache_resource
+def obtenir_chronometre():
+    """Chronomètre partagé entre reruns et sessions"""
+    return Chronometre()
+
+chronometre = obtenir_chronometre()
+
+def afficher_diagnostic():
+    """Panneau de diagnostic des performances (JAR_TEST_DIAGNOSTIC=1)"""
+    if not chronometre.actif:
+        return
+    with st.sidebar.expander("🩺 Diagnostic des performances", expanded=False):
+        statistiques = chronometre.statistiques()
+        if statistiques.empty:
+            st.write("Aucune mesure pour l'instant.")
+        else:
+            st.dataframe(statistiques, use_container_width=True)
+        st.caption(f"Journal : {chronometre.fichier_journal}")
+        if st.button("🧹 Réinitialiser les statistiques"):
+            chronometre.durees.clear()
+
+class TraceurSQL:
+    """Journal des requêtes SQL de DatabaseManager avec détection des parcours complets de table"""
+
+    TABLE_SURVEILLEE = "mesures_jar_test"
+
+    def __init__(self, fichier_journal="jar_test_sql_trace.log", taille_historique=2000,
+                 frequence_plan=20, taille_max_journal=5_000_000, taille_cache_plans=500):
+        self.actif = os.environ.get("JAR_TEST_TRACE_SQL", "0") == "1"
+        self.fichier_journal = fichier_journal
+        self.taille_max_journal = taille_max_journal
+        self.frequence_plan = frequence_plan
+        self.requetes = deque(maxlen=taille_historique)
+        # Requête -> [exécutions, dernier plan], les moins récemment vues évincées au-delà de taille_cache_plans
+        # (requêtes au texte variable, par exemple des listes IN de longueur différente)
+        self.taille_cache_plans = taille_cache_plans
+        self.plans = OrderedDict()
+        self.motif_scan = re.compile(rf"\bSCAN (TABLE )?{self.TABLE_SURVEILLEE}\b")
+
+    def connecter(self, db_file, **options):
+        if not self.actif:
+            return sqlite3.connect(db_file, **options)
+        conn = sqlite3.connect(db_file, factory=ConnexionTracee, **options)
+        conn.traceur = self
+        return conn
+
+    @staticmethod
+    def origine_appel():
+        """Méthode de DatabaseManager appelée et ligne de l'application qui l'a appelée"""
+        # Comparaison par nom : Streamlit redéfinit la classe à chaque rerun alors que le traceur est en cache
+        def dans_database_manager(cadre):
+            return type(cadre.f_locals.get('self')).__name__ == "DatabaseManager"
+
+        cadre = sys._getframe(1)
+        while cadre is not None and not dans_database_manager(cadre):
+            cadre = cadre.f_back
+        if cadre is None:
+            return ""
+        methode = cadre.f_code.co_name
+        appelant = cadre.f_back
+        while appelant is not None and (
+            appelant.f_code.co_name == "enveloppe"
+            or appelant.f_code.co_filename.endswith("contextlib.py")
+            or dans_database_manager(appelant)
+        ):
+            appelant = appelant.f_back
+        if appelant is None:
+            return methode
+        return f"{methode} ← {appelant.f_code.co_name}:{appelant.f_lineno}"
+
+    def plan_requete(self, conn, requete, parametres):
+        """EXPLAIN QUERY PLAN, échantillonné : première exécution puis une sur frequence_plan"""
+        suivi = self.plans.get(requete)
+        if suivi is None:
+            suivi = self.plans[requete] = [0, None]
+            if len(self.plans) > self.taille_cache_plans:
+                self.plans.popitem(last=False)
+        else:
+            self.plans.move_to_end(requete)
+        numero = suivi[0]
+        suivi[0] += 1
+        if not requete.upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+            return ""
+        if numero % self.frequence_plan == 0 or suivi[1] is None:
+            try:
+                curseur = sqlite3.Connection.cursor(conn, sqlite3.Cursor)
+                lignes = curseur.execute(f"EXPLAIN QUERY PLAN {requete}", parametres).fetchall()
+                suivi[1] = " | ".join(str(ligne[-1]) for ligne in lignes)
+            except sqlite3.Error:
+                suivi[1] = ""
+        return suivi[1]
+
+    def nouvelle_trace(self, conn, requete, parametres, nombre_parametres):
+        requete = " ".join(requete.split())
+        plan = self.plan_requete(conn, requete, parametres)
+        trace = {
+            'horodatage': datetime.now().isoformat(timespec='milliseconds'),
+            'origine': self.origine_appel(),
+            'requete': requete,
+            'parametres': nombre_parametres,
+            'duree_ms': 0.0,
+            'lignes': 0,
+            'plan': plan,
+            'scan_complet': bool(self.motif_scan.search(plan))
+        }
+        self.requetes.append(trace)
+        return trace
+
+    def ecrire_journal(self, traces):
+        ajouter_au_journal(self.fichier_journal, [
+            f"{t['horodatage']};{t['origine']};{t['duree_ms']:.3f};{t['parametres']};{t['lignes']};"
+            f"{'SCAN' if t['scan_complet'] else ''};{t['requete']}"
+            for t in traces
+        ], self.taille_max_journal)
+
+    def synthese(self):
+        """Requêtes regroupées : exécutions, durées, lignes et parcours complets"""
+        if not self.requetes:
+            return pd.DataFrame()
+        df = pd.DataFrame(list(self.requetes))
+        synthese = df.groupby('requete').agg(
+            Exécutions=('duree_ms', 'size'),
+            Total_ms=('duree_ms', 'sum'),
+            p95_ms=('duree_ms', lambda d: np.percentile(d, 95)),
+            Lignes_moy=('lignes', 'mean'),
+            Paramètres=('parametres', 'max'),
+            Scan_complet=('scan_complet', 'any'),
+            Origines=('origine', lambda o: ", ".join(sorted(set(o))))
+        ).reset_index().rename(columns={'requete': 'Requête'})
+        return synthese.sort_values('Total_ms', ascending=False).round(2).reset_index(drop=True)
+
+class CurseurTrace(sqlite3.Cursor):
+    """Curseur mesurant durée et lignes de chaque requête"""
+
+    def execute(self, requete, parametres=()):
+        self.trace = self.connection.traceur.nouvelle_trace(self.connection, requete, parametres, len(parametres))
+        debut = time.perf_counter()
+        try:
+            return super().execute(requete, parametres)
+        finally:
+            self.trace['duree_ms'] += (time.perf_counter() - debut) * 1000
+            self.trace['lignes'] = max(self.rowcount, 0)
+            self.connection.traces.append(self.trace)
+
+    def executemany(self, requete, sequence_parametres):
+        sequence_parametres = list(sequence_parametres)
+        nombre = sum(len(p) for p in sequence_parametres)
+        self.trace = self.connection.traceur.nouvelle_trace(self.connection, requete, (), nombre)
+        debut = time.perf_counter()
+        try:
+            return super().executemany(requete, sequence_parametres)
+        finally:
+            self.trace['duree_ms'] += (time.perf_counter() - debut) * 1000
+            self.trace['lignes'] = max(self.rowcount, 0)
+            self.connection.traces.append(self.trace)
+
+    def _lire(self, lecture, *args):
+        debut = time.perf_counter()
+        resultat = lecture(*args)
+        if getattr(self, 'trace', None) is not None:
+            self.trace['duree_ms'] += (time.perf_counter() - debut) * 1000
+            self.trace['lignes'] += len(resultat) if isinstance(resultat, list) else int(resultat is not None)
+        return resultat
+
+    def fetchall(self):
+        return self._lire(super().fetchall)
+
+    def fetchmany(self, *args):
+        return self._lire(super().fetchmany, *args)
+
+    def fetchone(self):
+        return self._lire(super().fetchone)
+
+class ConnexionTracee(sqlite3.Connection):
+    """Connexion SQLite dont les curseurs sont tracés ; le journal est écrit à la fermeture"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.traceur = None
+        self.traces = []
+
+    def cursor(self, factory=CurseurTrace):
+        return super().cursor(factory)
+
+    def execute(self, requete, parametres=()):
+        return self.cursor().execute(requete, parametres)
+
+    def executemany(self, requete, sequence_parametres):
+        return self.cursor().executemany(requete, sequence_parametres)
+
+    def close(self):
+        if self.traces:
+            self.traceur.ecrire_journal(self.traces)
+            self.traces = []
+        super().close()
+
+@st.cache_resource
+def obtenir_traceur_sql():
+    """Traceur SQL partagé entre reruns et sessions"""
+    return TraceurSQL()
+
+traceur_sql = obtenir_traceur_sql()
+
+def afficher_trace_sql():
+    """Panneau des requêtes SQL tracées (JAR_TEST_TRACE_SQL=1)"""
+    if not traceur_sql.actif:
+        return
+    with st.sidebar.expander("🔎 Trace SQL", expanded=False):
+        synthese = traceur_sql.synthese()
+        if synthese.empty:
+            st.write("Aucune requête tracée pour l'instant.")
+        else:
+            scans = synthese[synthese['Scan_complet']]
+            if not scans.empty:
+                st.warning(f"{len(scans)} requête(s) parcourent toute la table {TraceurSQL.TABLE_SURVEILLEE}")
+            st.dataframe(synthese, use_container_width=True)
+            with st.expander("Dernières requêtes"):
+                dernieres = pd.DataFrame(list(traceur_sql.requetes)[-50:][::-1])
+                st.dataframe(dernieres.drop(columns=['plan']).round(3), use_container_width=True)
+        st.caption(f"Journal : {traceur_sql.fichier_journal}")
+        if st.button("🧹 Vider la trace SQL"):
+            traceur_sql.requetes.clear()
+
+def debut_periode_eau_brute(date_test, periode):
+    """Premier jour de la période (jour, ou lundi de la semaine) contenant date_test"""
+    jour = datetime.strptime(str(date_test)[:10], "%Y-%m-%d").date()
+    if periode == "semaine":
+        jour -= timedelta(days=jour.weekday())
+    return jour.isoformat()
+
+def requete_plein_texte(texte):
+    """Requête FTS5 : chaque mot saisi doit commencer un mot indexé (guillemets et opérateurs sont ignorés)"""
+    return " ".join(f'"{mot}"*' for mot in re.findall(r"[^\W_]+", texte))
+
+def requete_plein_texte_postgresql(texte):
+    """Requête tsquery : chaque mot saisi, sans accents, doit commencer un mot indexé"""
+    mots = re.findall(r"[^\W_]+", unicodedata.normalize("NFKD", texte.lower()).encode("ascii", "ignore").decode())
+    return " & ".join(f"{mot}:*" for mot in mots)
+
+def transaction_ecriture(tentatives=4, attente=0.5, verrou=True):
+    """Écriture de DatabaseManager sérialisée selon le stockage, rejouée en cas de conflit avec un autre processus.
+    Avec verrou=False, la fonction prend elle-même le verrou d'écriture (plusieurs transactions successives)"""
+    def decorateur(fonction):
+        @functools.wraps(fonction)
+        def enveloppe(self, *args, **kwargs):
+            for tentative in range(tentatives):
+                try:
+                    with self.verrou_ecriture() if verrou else nullcontext():
+                        return fonction(self, *args, **kwargs)
+                except Exception as e:
+                    if not self.est_conflit(e) or tentative == tentatives - 1:
+                        raise
+                # Hors du bloc except : la connexion de l'essai manqué est libérée pendant l'attente.
+                # Attente exponentielle avec gigue : les processus en conflit ne réessaient pas ensemble
+                time.sleep(attente * 2 ** tentative * random.uniform(0.5, 1.5))
+        return enveloppe
+    return decorateur
+
+class TransactionMigration:
+    """Transaction d'une migration du schéma, sous le verrou d'écriture ; valider_lot() la valide et en ouvre une
+    nouvelle, pour qu'une reconstruction par lots laisse passer les écritures de l'application entre deux lots"""
+
+    def __init__(self, db_manager, conn):
+        self.db_manager = db_manager
+        self.conn = conn
+        self.verrou = None
+        self.cursor = None
+
+    def debuter(self):
+        self.verrou = self.db_manager.verrou_ecriture()
+        self.verrou.__enter__()
+        try:
+            # SQLite n'ouvre pas de transaction avant un CREATE ou un DROP : ouverture explicite
+            if self.db_manager.SQL_DEBUT_TRANSACTION:
+                self.conn.execute(self.db_manager.SQL_DEBUT_TRANSACTION)
+            self.cursor = self.conn.cursor()
+        except Exception:
+            self.verrou.__exit__(None, None, None)
+            raise
+
+    def terminer(self, valider):
+        try:
+            if valider:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.verrou.__exit__(None, None, None)
+
+    def valider_lot(self):
+        self.terminer(True)
+        self.debuter()
+
+    def annuler_lot(self):
+        self.terminer(False)
+        self.debuter()
+
+    def __enter__(self):
+        self.debuter()
+        return self
+
+    def __exit__(self, type_erreur, erreur, trace):
+        self.terminer(type_erreur is None)
+
+@st.cache_resource
+def bases_pretes():
+    """Bases SQLite (chemin, inode) dont ce processus a migré le schéma : vérifié une fois par processus, pas à chaque rerun"""
+    return set()
+
+def cle_base(db_file):
+    # L'inode distingue une base supprimée puis recréée au même chemin
+    try:
+        return (os.path.abspath(db_file), os.stat(db_file).st_ino)
+    except OSError:
+        return None
+
 class DatabaseManager:
-    def __init__(self):
-        self.db_file = "jar_test_database.db"
-        self.init_database()
+    """Stockage des mesures dans un fichier SQLite ; ses méthodes publiques forment l'interface commune des stockages"""
+    CLE_NATURELLE = ("date_test", "operateur", "site_prelevement", "combinaison", "essai")
+    PARAMETRES_EAU_BRUTE = ['turbidite_entree', 'couleur_entree', 'ph_entree', 'conductivite_entree', 'mes_entree', 'uv254_entree', 'dco_entree']
+    PERIODES = {'jour': "date_test", 'semaine': "date(date_test, '-6 days', 'weekday 1')"}
+    COLONNES_TEXTE_RECHERCHE = ['operateur', 'site_prelevement', 'combinaison', 'type_eau']
+    FACETTES_RECHERCHE = ['site_prelevement', 'combinaison', 'operateur', 'type_eau']
+    COLONNES_NUMERIQUES = ['volume_echantillon', 'temps_coagulation', 'vitesse_coagulation', 'temps_floculation', 'vitesse_floculation',
+                           'essai', 'coagulant_ml', 'floculant_ml', 'dco_entree', 'ph_entree', 'dco_sortie', 'ph_sortie', 'v_boue',
+                           'abattement', 'turbidite_entree', 'turbidite_sortie', 'couleur_entree', 'couleur_sortie', 'mes_entree',
+                           'mes_sortie', 'uv254_entree', 'uv254_sortie', 'aluminium_residuel', 'fer_residuel',
+                           'conductivite_entree', 'conductivite_sortie']
+    COLONNES_HISTORIQUE = ['abattement', 'dco_sortie', 'v_boue', 'ph_sortie', 'turbidite_sortie', 'couleur_sortie',
+                           'mes_sortie', 'uv254_sortie', 'aluminium_residuel', 'fer_residuel', 'conductivite_sortie']
+    # Attente maximale d'un verrou tenu par un autre processus (s), avant nouvel essai de la transaction
+    DELAI_ATTENTE = 10
+    # Fragments SQL propres au dialecte, redéfinis par les autres stockages
+    SQL_INTERVALLE = "MIN(CAST((julianday(date_test) - julianday(?)) * ? / (julianday(?) - julianday(?) + 1) AS INTEGER), ?)"
+    SQL_PLEIN_TEXTE = "id IN (SELECT rowid FROM recherche_mesures WHERE recherche_mesures MATCH ?)"
+    requete_texte = staticmethod(requete_plein_texte)
+    SQL_DEBUT_TRANSACTION = "BEGIN IMMEDIATE"
+    SQL_TABLE_EXISTE = "SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?)"
+    SQL_VERROU_LOT = ""
+    SQL_SANS_ROWID = " WITHOUT ROWID"
+    TYPE_REEL = "REAL"
+    # Instantanés et archives par fichiers (sauvegarde.py, archivage.py)
+    SAUVEGARDE_LOCALE = True
+    # Migrations du schéma dans l'ordre d'application : (version, méthode, description). Une migration publiée
+    # ne change plus ; une évolution du schéma s'ajoute en fin de liste (migration.py, ou au démarrage).
+    # jar_test1.py à jar_test3.py refusent une base au-delà de leur VERSION_SCHEMA : à relever s'ils restent compatibles
+    MIGRATIONS = [
+        (1, '_migration_schema_initial', "Mesures, séries de l'eau brute, comparaison entre sites, recherche plein texte, archives"),
+        (2, '_migration_eau_brute_sessions_par_site', "Séries de l'eau brute rangées par site"),
+        (3, '_migration_index_combinaison', "Index des essais par combinaison"),
+        (4, '_migration_compteurs_mesures', "Compteurs des écritures de mesures_jar_test"),
+        (5, '_migration_ecritures_agregees', "Écritures reportées dans les tables dérivées"),
+        (6, '_migration_compteurs_par_transaction', "Compteurs d'écritures tenus par transaction, sans triggers"),
+    ]
+    # Lignes recopiées par transaction lors d'une reconstruction de table
+    TAILLE_LOT_MIGRATION = 5000
+
+    def __init__(self, db_file="jar_test_database.db", migrer_schema=True):
+        self.db_file = db_file
+        if migrer_schema and cle_base(db_file) not in bases_pretes():
+            self.init_database()
+            bases_pretes().add(cle_base(db_file))
+
+    def connecter(self):
+        return traceur_sql.connecter(self.db_file, timeout=self.DELAI_ATTENTE)
+
+    def verrou_ecriture(self):
+        # File d'attente du système : un processus en attente est réveillé dès la libération du verrou,
+        # alors que le délai d'attente de SQLite le fait dormir par paliers et laisse les autres passer devant
+        return verrou_fichier(self.db_file)
+
+    @staticmethod
+    def est_conflit(erreur):
+        """Base restée verrouillée par un autre processus au-delà du délai d'attente"""
+        return isinstance(erreur, sqlite3.OperationalError) and ("locked" in str(erreur) or "busy" in str(erreur))
+
+    def chemin_archive(self, annee):
+        """Base d'archive d'une année, dans le dossier archives/ à côté de la base"""
+        racine = os.path.splitext(os.path.basename(self.db_file))[0]
+        return os.path.join(os.path.dirname(os.path.abspath(self.db_file)), "archives", f"{racine}_{annee}.db")
+
+    def fichiers_archives(self, annees=None):
+        """Bases d'archive existantes par année, éventuellement restreintes à certaines années"""
+        dossier = os.path.dirname(self.chemin_archive(0))
+        if not os.path.isdir(dossier):
+            return {}
+        motif = re.compile(re.escape(os.path.splitext(os.path.basename(self.db_file))[0]) + r"_(\d{4})\.db$")
+        fichiers = {}
+        for nom in sorted(os.listdir(dossier)):
+            correspondance = motif.match(nom)
+            if correspondance and (annees is None or int(correspondance.group(1)) in annees):
+                fichiers[int(correspondance.group(1))] = os.path.join(dossier, nom)
+        return fichiers
+
+    def _interroger_archives(self, requete, params=(), annees=None):
+        """Exécute une requête de lecture sur chaque base d'archive et renvoie toutes les lignes obtenues"""
+        lignes = []
+        for chemin in self.fichiers_archives(annees).values():
+            conn = traceur_sql.connecter(chemin)
+            cursor = conn.cursor()
+            cursor.execute(requete, params)
+            lignes += cursor.fetchall()
+            conn.close()
+        return lignes
     
+    @chronometre.instrumenter("DatabaseManager.init_database")
     def init_database(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
+        # Journal WAL (persistant) : lectures et sauvegardes à chaud ne bloquent pas les enregistrements.
+        # Réglage hors transaction, donc hors des migrations
+        with self.verrou_ecriture():
+            conn = self.connecter()
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.close()
+        self.migrer()
+
+    @contextmanager
+    def verrou_migration(self, conn):
+        # Distinct du verrou d'écriture, que les migrations reprennent à chaque transaction : deux processus
+        # qui démarrent ensemble appliquent les migrations l'un après l'autre, le second n'a plus rien à faire
+        with verrou_fichier(self.db_file + ".migration"):
+            yield
+
+    def _versions_appliquees(self, conn):
+        """Versions de schéma enregistrées par la base, avec leur description et leur date d'application"""
+        if not conn.execute(self.SQL_TABLE_EXISTE, ('schema_migrations',)).fetchone()[0]:
+            return {}
+        lignes = conn.execute('SELECT version, description, appliquee_le FROM schema_migrations').fetchall()
+        return {version: (description, appliquee_le) for version, description, appliquee_le in lignes}
+
+    def etat_migrations(self):
+        """Migrations connues et enregistrées : (version, description, date d'application ou None si en attente)"""
+        conn = self.connecter()
+        appliquees = self._versions_appliquees(conn)
+        conn.close()
+        etat = [(version, description, appliquees.get(version, (None, None))[1]) for version, _, description in self.MIGRATIONS]
+        connues = {version for version, _, _ in self.MIGRATIONS}
+        return etat + [(version, *appliquees[version]) for version in sorted(set(appliquees) - connues)]
+
+    @chronometre.instrumenter("DatabaseManager.migrer")
+    def migrer(self, cible=None, taille_lot=None, progression=None):
+        """Applique dans l'ordre les migrations en attente, jusqu'à la version `cible` ; renvoie les versions appliquées"""
+        taille_lot = taille_lot or self.TAILLE_LOT_MIGRATION
+        conn = self.connecter()
+        appliquees = []
+        try:
+            with self.verrou_migration(conn):
+                with TransactionMigration(self, conn) as transaction:
+                    transaction.cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS schema_migrations (
+                            version INTEGER PRIMARY KEY,
+                            description TEXT,
+                            appliquee_le TEXT,
+                            duree REAL
+                        )
+                    ''')
+                versions = self._versions_appliquees(conn)
+                inconnues = set(versions) - {version for version, _, _ in self.MIGRATIONS}
+                if inconnues:
+                    raise RuntimeError(f"Schéma de la base en version {max(inconnues)}, plus récent que cette version de l'application")
+                for version, methode, description in self.MIGRATIONS:
+                    if version not in versions and (cible is None or version <= cible):
+                        self._appliquer_migration(conn, version, methode, description, taille_lot, progression)
+                        appliquees.append(version)
+        finally:
+            conn.close()
+        return appliquees
+
+    @transaction_ecriture(verrou=False)
+    def _appliquer_migration(self, conn, version, methode, description, taille_lot, progression):
+        # Rejouée en entier après un conflit : la dernière transaction, annulée, n'a pas enregistré la version
+        debut = time.perf_counter()
+        with TransactionMigration(self, conn) as transaction:
+            getattr(self, methode)(transaction, taille_lot, progression)
+            transaction.cursor.execute(
+                'INSERT INTO schema_migrations (version, description, appliquee_le, duree) VALUES (?, ?, ?, ?)',
+                (version, description, datetime.now().isoformat(" ", "seconds"), time.perf_counter() - debut)
+            )
+
+    def _migration_schema_initial(self, transaction, taille_lot, progression):
+        """Schéma antérieur au suivi des versions : sans effet sur une base qui l'a déjà"""
+        cursor = transaction.cursor
+
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS mesures_jar_test (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -108,62 +737,1446 @@ class DatabaseManager:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
-        
-        conn.commit()
-        conn.close()
-    
-    def save_mesure(self, data):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
+
+        # Clé naturelle d'un essai : l'enregistrer à nouveau met à jour la ligne existante
+        index_cle = f'CREATE UNIQUE INDEX IF NOT EXISTS idx_mesures_cle_naturelle ON mesures_jar_test ({", ".join(self.CLE_NATURELLE)})'
+        try:
+            cursor.execute(index_cle)
+        except sqlite3.IntegrityError:
+            # Base enregistrée avant la clé : dédoublonnage unique puis création de l'index
+            self.supprimer_doublons(cursor)
+            cursor.execute(index_cle)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_mesures_site_date ON mesures_jar_test (site_prelevement, date_test)')
+
+        # Séries temporelles de l'eau brute : une ligne par session et agrégats par site, paramètre et période
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS eau_brute_sessions (
+                date_test TEXT,
+                operateur TEXT,
+                site_prelevement TEXT,
+                {", ".join(f"{p} REAL" for p in self.PARAMETRES_EAU_BRUTE)},
+                PRIMARY KEY (date_test, operateur, site_prelevement)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS eau_brute_agregats (
+                site_prelevement TEXT,
+                parametre TEXT,
+                periode TEXT,
+                debut TEXT,
+                nombre INTEGER,
+                somme REAL,
+                somme_carres REAL,
+                minimum REAL,
+                maximum REAL,
+                PRIMARY KEY (site_prelevement, parametre, periode, debut)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_eau_brute_sessions_site ON eau_brute_sessions (site_prelevement, date_test)')
+        # Base antérieure aux séries : construction initiale depuis l'historique
+        if cursor.execute('SELECT NOT EXISTS (SELECT 1 FROM eau_brute_sessions) AND EXISTS (SELECT 1 FROM mesures_jar_test)').fetchone()[0]:
+            self._reconstruire_series_eau_brute(cursor)
+
+        # Comparaison entre sites : agrégats mensuels par site, type d'eau et combinaison
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS comparaison_agregats (
+                site_prelevement TEXT,
+                type_eau TEXT,
+                combinaison TEXT,
+                mois TEXT,
+                nombre_sessions INTEGER,
+                nombre_essais INTEGER,
+                meilleur_abattement REAL,
+                abattement_median REAL,
+                dose_coagulant_mediane REAL,
+                dose_floculant_mediane REAL,
+                PRIMARY KEY (site_prelevement, type_eau, combinaison, mois)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_comparaison_mois ON comparaison_agregats (mois, combinaison)')
+        if cursor.execute('SELECT NOT EXISTS (SELECT 1 FROM comparaison_agregats) AND EXISTS (SELECT 1 FROM mesures_jar_test)').fetchone()[0]:
+            self._reconstruire_comparaison(cursor)
+
+        # Index plein texte (opérateur, site, réactifs, type d'eau) adossé à mesures_jar_test et tenu à jour par triggers
+        colonnes = ", ".join(self.COLONNES_TEXTE_RECHERCHE)
+        nouvelles = ", ".join(f"new.{c}" for c in self.COLONNES_TEXTE_RECHERCHE)
+        anciennes = ", ".join(f"old.{c}" for c in self.COLONNES_TEXTE_RECHERCHE)
+        index_absent = cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM sqlite_master WHERE name = 'recherche_mesures')").fetchone()[0]
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS recherche_mesures USING fts5(
+                {colonnes}, content='mesures_jar_test', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS recherche_mesures_insertion AFTER INSERT ON mesures_jar_test BEGIN
+                INSERT INTO recherche_mesures (rowid, {colonnes}) VALUES (new.id, {nouvelles});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS recherche_mesures_suppression AFTER DELETE ON mesures_jar_test BEGIN
+                INSERT INTO recherche_mesures (recherche_mesures, rowid, {colonnes}) VALUES ('delete', old.id, {anciennes});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS recherche_mesures_modification AFTER UPDATE OF {colonnes} ON mesures_jar_test BEGIN
+                INSERT INTO recherche_mesures (recherche_mesures, rowid, {colonnes}) VALUES ('delete', old.id, {anciennes});
+                INSERT INTO recherche_mesures (rowid, {colonnes}) VALUES (new.id, {nouvelles});
+            END
+        ''')
+        if index_absent:
+            cursor.execute("INSERT INTO recherche_mesures (recherche_mesures) VALUES ('rebuild')")
+        # Sessions déplacées dans les bases d'archive (archivage.py) : une ligne de synthèse par combinaison
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sessions_archivees (
+                date_test TEXT,
+                operateur TEXT,
+                site_prelevement TEXT,
+                combinaison TEXT,
+                type_eau TEXT,
+                nombre_essais INTEGER,
+                meilleur_abattement REAL,
+                archive TEXT,
+                PRIMARY KEY (date_test, operateur, site_prelevement, combinaison)
+            )
+        ''')
+        # Index couvrant des facettes : leur comptage parcourt l'index plutôt que la table
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_mesures_facettes ON mesures_jar_test ({", ".join(self.FACETTES_RECHERCHE)})')
+
+    def supprimer_doublons(self, cursor):
+        """Ne conserve que le dernier enregistrement de chaque essai (session, combinaison, essai)"""
+        # L'index unique tient pour distinctes les clés contenant NULL : GROUP BY les réunirait, elles sont laissées
+        cle_complete = " AND ".join(f"{colonne} IS NOT NULL" for colonne in self.CLE_NATURELLE)
+        cursor.execute(f'''
+            DELETE FROM mesures_jar_test WHERE {cle_complete} AND id NOT IN (
+                SELECT MAX(id) FROM mesures_jar_test WHERE {cle_complete} GROUP BY {", ".join(self.CLE_NATURELLE)}
+            )
+        ''')
+        return cursor.rowcount
+
+    def _reconstruire_table(self, transaction, table, creation, colonnes, cle, taille_lot, progression=None):
+        """Remplace `table` par la table définie par `creation` ({table} : nom provisoire), remplie par lots selon `cle`,
+        la clé primaire de l'ancienne table. Entre deux lots l'application continue d'écrire : des triggers reportent
+        ses écritures dans la nouvelle table, qui ne remplace l'ancienne que si elles ont le même nombre de lignes"""
+        provisoire = f"{table}_reconstruction"
+        liste = ", ".join(colonnes)
+        cursor = transaction.cursor
+        # Reconstruction interrompue : reprise depuis le début
+        self._retirer_recopie(cursor, table, provisoire)
+        cursor.execute(f"DROP TABLE IF EXISTS {provisoire}")
+        cursor.execute(creation.format(table=provisoire))
+        self._installer_recopie(cursor, table, provisoire, colonnes, cle)
+        total = cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        transaction.valider_lot()
+        try:
+            self._recopier_par_lots(transaction, table, provisoire, liste, cle, taille_lot, progression, total)
+            self._remplacer_table(transaction.cursor, table, provisoire)
+        except BaseException:
+            # Les triggers ne doivent pas survivre à l'échec : ils ralentiraient chaque écriture de l'application
+            try:
+                transaction.annuler_lot()
+                self._retirer_recopie(transaction.cursor, table, provisoire)
+                transaction.cursor.execute(f"DROP TABLE IF EXISTS {provisoire}")
+                transaction.valider_lot()
+            except Exception:
+                # Nettoyage refait au début de la prochaine tentative ; l'erreur remontée reste celle de la reconstruction
+                pass
+            raise
+
+    def _recopier_par_lots(self, transaction, table, provisoire, liste, cle, taille_lot, progression, total):
+        liste_cle, marqueurs = ", ".join(cle), ", ".join("?" * len(cle))
+        # Lots délimités par la clé (parcours de l'index), et non par OFFSET sur toute la table
+        dernier, copiees = (), 0
+        while True:
+            cursor = transaction.cursor
+            conditions = [f"({liste_cle}) > ({marqueurs})"] if dernier else ["1 = 1"]
+            fin = cursor.execute(
+                f"SELECT {liste_cle} FROM {table} WHERE {conditions[0]} ORDER BY {liste_cle} LIMIT 1 OFFSET ?", (*dernier, taille_lot - 1)
+            ).fetchone()
+            if fin:
+                conditions.append(f"({liste_cle}) <= ({marqueurs})")
+            # Lignes déjà reportées par les triggers : leur version, plus récente, est conservée
+            cursor.execute(f'''
+                INSERT INTO {provisoire} ({liste})
+                SELECT {liste} FROM {table} WHERE {" AND ".join(conditions)}{self.SQL_VERROU_LOT}
+                ON CONFLICT DO NOTHING
+            ''', (*dernier, *(fin or ())))
+            copiees += cursor.rowcount
+            transaction.valider_lot()
+            if progression:
+                progression(min(copiees, total), total)
+            if not fin:
+                break
+            dernier = tuple(fin)
+
+    def _installer_recopie(self, cursor, table, provisoire, colonnes, cle):
+        """Triggers qui reportent dans `provisoire` les écritures faites sur `table` pendant sa reconstruction"""
+        liste = ", ".join(colonnes)
+        nouvelles = ", ".join(f"new.{c}" for c in colonnes)
+        condition = " AND ".join(f"{c} = old.{c}" for c in cle)
+        cursor.execute(f'''
+            CREATE TRIGGER {provisoire}_insertion AFTER INSERT ON {table} BEGIN
+                INSERT OR REPLACE INTO {provisoire} ({liste}) VALUES ({nouvelles});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER {provisoire}_modification AFTER UPDATE ON {table} BEGIN
+                DELETE FROM {provisoire} WHERE {condition};
+                INSERT OR REPLACE INTO {provisoire} ({liste}) VALUES ({nouvelles});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER {provisoire}_suppression AFTER DELETE ON {table} BEGIN
+                DELETE FROM {provisoire} WHERE {condition};
+            END
+        ''')
+
+    def _retirer_recopie(self, cursor, table, provisoire):
+        for evenement in ("insertion", "modification", "suppression"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {provisoire}_{evenement}")
+
+    def _remplacer_table(self, cursor, table, provisoire):
+        self._retirer_recopie(cursor, table, provisoire)
+        avant = cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        apres = cursor.execute(f"SELECT COUNT(*) FROM {provisoire}").fetchone()[0]
+        if avant != apres:
+            raise RuntimeError(f"Reconstruction de {table} : {apres} lignes recopiées sur {avant}, table d'origine conservée")
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {provisoire} RENAME TO {table}")
+
+    def _migration_eau_brute_sessions_par_site(self, transaction, taille_lot, progression):
+        """Séries de l'eau brute rangées par site : la clé commence par le site, dont les sessions se lisent d'un seul parcours.
+        L'index (site, date) devient inutile ; avec SQLite, la table est rangée selon sa clé (WITHOUT ROWID)"""
+        # La nouvelle clé primaire refuse les valeurs nulles, que la recopie par lots ne verrait d'ailleurs pas.
+        # Sessions sans date, opérateur ou site (enregistrées par une autre application) : retirées avant la recopie,
+        # puis séries recalculées depuis mesures_jar_test (_reconstruire_series_eau_brute)
+        cles_nulles = transaction.cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM eau_brute_sessions WHERE date_test IS NULL OR operateur IS NULL OR site_prelevement IS NULL)'
+        ).fetchone()[0]
+        if cles_nulles:
+            transaction.cursor.execute('DELETE FROM eau_brute_sessions WHERE date_test IS NULL OR operateur IS NULL OR site_prelevement IS NULL')
+        self._reconstruire_table(transaction, 'eau_brute_sessions', f'''
+            CREATE TABLE {{table}} (
+                date_test TEXT,
+                operateur TEXT,
+                site_prelevement TEXT,
+                {", ".join(f"{p} {self.TYPE_REEL}" for p in self.PARAMETRES_EAU_BRUTE)},
+                PRIMARY KEY (site_prelevement, date_test, operateur)
+            ){self.SQL_SANS_ROWID}
+        ''', ['date_test', 'operateur', 'site_prelevement', *self.PARAMETRES_EAU_BRUTE],
+            ('date_test', 'operateur', 'site_prelevement'), taille_lot, progression)
+        if cles_nulles:
+            self._reconstruire_series_eau_brute(transaction.cursor)
+
+    def _migration_index_combinaison(self, transaction, taille_lot, progression):
+        """Essais d'une combinaison, des plus récents aux plus anciens (historique de l'optimisation bayésienne)"""
+        transaction.cursor.execute('CREATE INDEX IF NOT EXISTS idx_mesures_combinaison ON mesures_jar_test (combinaison, id)')
+
+    def _migration_compteurs_mesures(self, transaction, taille_lot, progression):
+        """Lignes insérées et transactions ayant modifié ou supprimé des lignes de mesures_jar_test, comptées par ceux qui
+        écrivent (compter_ecritures) : un calcul incrémental par id sait ainsi s'il a manqué une mise à jour ou une suppression"""
+        cursor = transaction.cursor
+        cursor.execute('CREATE TABLE IF NOT EXISTS compteurs_mesures (insertions BIGINT NOT NULL, modifications BIGINT NOT NULL)')
+        cursor.execute('INSERT INTO compteurs_mesures SELECT 0, 0 WHERE NOT EXISTS (SELECT 1 FROM compteurs_mesures)')
+
+    def _migration_ecritures_agregees(self, transaction, taille_lot, progression):
+        """Écritures de mesures_jar_test déjà reportées dans les séries de l'eau brute et les agrégats de comparaison.
+        Un écart avec les compteurs signale des essais enregistrés sans eux (jar_test1.py à jar_test3.py) ; -1 : écritures
+        antérieures inconnues, un premier recalcul complet a lieu au démarrage suivant"""
+        transaction.cursor.execute('ALTER TABLE compteurs_mesures ADD COLUMN agregees BIGINT NOT NULL DEFAULT -1')
+
+    def _migration_compteurs_par_transaction(self, transaction, taille_lot, progression):
+        """Base migrée en versions 4 et 5 quand des triggers comptaient chaque ligne écrite (mise à jour de la même ligne
+        de compteurs à chaque essai) : triggers et ancienne table retirés, compteurs recréés"""
+        cursor = transaction.cursor
+        self._retirer_triggers_comptage(cursor)
+        cursor.execute('DROP TABLE IF EXISTS compteurs')
+        if not cursor.execute(self.SQL_TABLE_EXISTE, ('compteurs_mesures',)).fetchone()[0]:
+            self._migration_compteurs_mesures(transaction, taille_lot, progression)
+            self._migration_ecritures_agregees(transaction, taille_lot, progression)
+
+    def _retirer_triggers_comptage(self, cursor):
+        for evenement in ('insert', 'update', 'delete'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS compteurs_mesures_{evenement}")
+
+    def compter_ecritures(self, cursor, insertions, modifications, tables_derivees=True):
+        """Compte une transaction d'écriture de mesures_jar_test : lignes insérées, et 1 si des lignes ont été modifiées ou
+        supprimées. Avec tables_derivees, séries de l'eau brute et agrégats de comparaison restent justes après elle (ils
+        restent en retard s'ils l'étaient déjà)"""
+        # Une seule mise à jour par transaction, juste avant la validation : sous PostgreSQL, la ligne commune à tous les
+        # postes n'est verrouillée qu'un instant. Les expressions lisent les valeurs d'avant la mise à jour
+        agregees = "CASE WHEN agregees = insertions + modifications THEN agregees + ? ELSE agregees END" if tables_derivees else "agregees"
+        cursor.execute(
+            f"UPDATE compteurs_mesures SET insertions = insertions + ?, modifications = modifications + ?, agregees = {agregees}",
+            (insertions, modifications) + ((insertions + modifications,) if tables_derivees else ())
+        )
+
+    def _compter_existants(self, cursor, lignes):
+        """Nombre d'essais de `lignes` déjà enregistrés (clé naturelle), lus par l'index unique"""
+        cles = list({tuple(data[c] for c in self.CLE_NATURELLE) for data in lignes})
+        existants = 0
+        for debut in range(0, len(cles), 500):
+            lot = cles[debut:debut + 500]
+            marqueurs = ", ".join([f"({', '.join('?' * len(self.CLE_NATURELLE))})"] * len(lot))
+            existants += cursor.execute(
+                f"SELECT COUNT(*) FROM mesures_jar_test WHERE ({', '.join(self.CLE_NATURELLE)}) IN (VALUES {marqueurs})",
+                [valeur for cle in lot for valeur in cle]
+            ).fetchone()[0]
+        return len(cles), existants
+    
+    @chronometre.instrumenter("DatabaseManager.save_mesure")
+    def save_mesure(self, data):
+        self.save_mesures([data])
+
+    @chronometre.instrumenter("DatabaseManager.save_mesures")
+    @transaction_ecriture()
+    def save_mesures(self, lignes):
+        """Enregistre plusieurs essais en une transaction et met à jour les séries de l'eau brute"""
+        conn = self.connecter()
+        cursor = conn.cursor()
+        # Essais nouveaux ou enregistrés à nouveau, pour les compteurs d'écritures. Un essai du même nom validé entre ce
+        # comptage et l'insertion par un autre poste fausse le nombre d'insertions : IndexEauBrute se reconstruit alors
+        cles, existants = self._compter_existants(cursor, lignes)
+        
+        cursor.executemany('''
+            INSERT INTO mesures_jar_test (
+                date_test, operateur, site_prelevement, type_eau, volume_echantillon,
+                temps_coagulation, vitesse_coagulation, temps_floculation, vitesse_floculation,
+                combinaison, essai, coagulant_ml, floculant_ml, dco_entree, ph_entree,
+                dco_sortie, ph_sortie, v_boue, turbidite, abattement, turbidite_entree,
+                turbidite_sortie, couleur_entree, couleur_sortie, mes_entree, mes_sortie,
+                uv254_entree, uv254_sortie, aluminium_residuel, fer_residuel,
+                conductivite_entree, conductivite_sortie
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (date_test, operateur, site_prelevement, combinaison, essai) DO UPDATE SET
+                type_eau = excluded.type_eau, volume_echantillon = excluded.volume_echantillon,
+                temps_coagulation = excluded.temps_coagulation, vitesse_coagulation = excluded.vitesse_coagulation,
+                temps_floculation = excluded.temps_floculation, vitesse_floculation = excluded.vitesse_floculation,
+                coagulant_ml = excluded.coagulant_ml, floculant_ml = excluded.floculant_ml,
+                dco_entree = excluded.dco_entree, ph_entree = excluded.ph_entree,
+                dco_sortie = excluded.dco_sortie, ph_sortie = excluded.ph_sortie, v_boue = excluded.v_boue,
+                turbidite = excluded.turbidite, abattement = excluded.abattement,
+                turbidite_entree = excluded.turbidite_entree, turbidite_sortie = excluded.turbidite_sortie,
+                couleur_entree = excluded.couleur_entree, couleur_sortie = excluded.couleur_sortie,
+                mes_entree = excluded.mes_entree, mes_sortie = excluded.mes_sortie,
+                uv254_entree = excluded.uv254_entree, uv254_sortie = excluded.uv254_sortie,
+                aluminium_residuel = excluded.aluminium_residuel, fer_residuel = excluded.fer_residuel,
+                conductivite_entree = excluded.conductivite_entree, conductivite_sortie = excluded.conductivite_sortie
+        ''', [(
+            data['date_test'], data['operateur'], data['site_prelevement'], data['type_eau'],
+            data['volume_echantillon'], data['temps_coagulation'], data['vitesse_coagulation'],
+            data['temps_floculation'], data['vitesse_floculation'], data['combinaison'],
+            data['essai'], data['coagulant_ml'], data['floculant_ml'], data['dco_entree'],
+            data['ph_entree'], data['dco_sortie'], data['ph_sortie'], data['v_boue'],
+            data['turbidite'], data['abattement'], data['turbidite_entree'],
+            data['turbidite_sortie'], data['couleur_entree'], data['couleur_sortie'],
+            data['mes_entree'], data['mes_sortie'], data['uv254_entree'], data['uv254_sortie'],
+            data['aluminium_residuel'], data['fer_residuel'], data['conductivite_entree'],
+            data['conductivite_sortie']
+        ) for data in lignes])
+        sessions = {(data['date_test'], data['operateur'], data['site_prelevement']) for data in lignes}
+        self._rafraichir_series_eau_brute(cursor, sessions)
+        self._rafraichir_comparaison(cursor, sessions)
+        self.compter_ecritures(cursor, cles - existants, int(existants > 0 or cles < len(lignes)))
+        
+        conn.commit()
+        conn.close()
+
+    def _ecritures_et_agregees(self, cursor):
+        return tuple(cursor.execute('SELECT insertions + modifications, agregees FROM compteurs_mesures').fetchone())
+
+    @chronometre.instrumenter("DatabaseManager.agregats_en_retard")
+    def agregats_en_retard(self):
+        """Vrai si des essais ont été enregistrés ou supprimés sans mise à jour des séries de l'eau brute et des agrégats
+        de comparaison (jar_test1.py à jar_test3.py, modification directe de la base)"""
+        conn = self.connecter()
+        ecritures, agregees = self._ecritures_et_agregees(conn.cursor())
+        conn.close()
+        return ecritures != agregees
+
+    @chronometre.instrumenter("DatabaseManager.rattraper_agregats")
+    @transaction_ecriture()
+    def rattraper_agregats(self):
+        """Recalcule séries de l'eau brute et agrégats de comparaison s'ils sont en retard ; renvoie True s'il l'a fallu"""
+        conn = self.connecter()
+        cursor = conn.cursor()
+        # Compteurs lus avant le recalcul : une écriture validée pendant celui-ci laisse un écart, rattrapé la fois suivante
+        ecritures, agregees = self._ecritures_et_agregees(cursor)
+        if ecritures == agregees:
+            conn.close()
+            return False
+        self._reconstruire_series_eau_brute(cursor)
+        self._reconstruire_comparaison(cursor)
+        cursor.execute('UPDATE compteurs_mesures SET agregees = ?', (ecritures,))
+        conn.commit()
+        conn.close()
+        return True
+
+    def _inserer_agregats(self, cursor, periode, filtre="", parametres_filtre=()):
+        """Agrège eau_brute_sessions par site et période (les valeurs nulles sont des mesures absentes)"""
+        debut = self.PERIODES[periode]
+        selections = [f'''
+            SELECT site_prelevement, '{p}', '{periode}', {debut} AS debut_periode,
+                   COUNT(NULLIF({p}, 0)), SUM(NULLIF({p}, 0)), SUM(NULLIF({p}, 0) * NULLIF({p}, 0)),
+                   MIN(NULLIF({p}, 0)), MAX(NULLIF({p}, 0))
+            FROM eau_brute_sessions {filtre}
+            GROUP BY site_prelevement, debut_periode
+            HAVING COUNT(NULLIF({p}, 0)) > 0
+        ''' for p in self.PARAMETRES_EAU_BRUTE]
+        cursor.execute(
+            'INSERT INTO eau_brute_agregats (site_prelevement, parametre, periode, debut, nombre, somme, somme_carres, minimum, maximum) '
+            + ' UNION ALL '.join(selections),
+            tuple(parametres_filtre) * len(self.PARAMETRES_EAU_BRUTE)
+        )
+
+    def _rafraichir_series_eau_brute(self, cursor, sessions):
+        """Mise à jour incrémentale : seules les sessions enregistrées et leurs jours/semaines sont recalculés"""
+        colonnes = ", ".join(self.PARAMETRES_EAU_BRUTE)
+        # Mêmes clés que _reconstruire_series_eau_brute : sessions sans date ignorées, '' à la place d'un opérateur ou site nul
+        sessions = {(date_test, operateur or "", site or "") for date_test, operateur, site in sessions if date_test}
+        for date_test, operateur, site in sessions:
+            cursor.execute(f'''
+                INSERT INTO eau_brute_sessions (date_test, operateur, site_prelevement, {colonnes})
+                SELECT date_test, COALESCE(operateur, ''), COALESCE(site_prelevement, ''), {colonnes} FROM mesures_jar_test
+                WHERE id = (SELECT MAX(id) FROM mesures_jar_test
+                            WHERE date_test = ? AND COALESCE(operateur, '') = ? AND COALESCE(site_prelevement, '') = ?)
+                ON CONFLICT (date_test, operateur, site_prelevement) DO UPDATE SET
+                {", ".join(f"{p} = excluded.{p}" for p in self.PARAMETRES_EAU_BRUTE)}
+            ''', (str(date_test), operateur, site))
+
+        for periode, debut in self.PERIODES.items():
+            periodes = {(site, debut_periode_eau_brute(date_test, periode)) for date_test, _, site in sessions}
+            for site, debut_periode in periodes:
+                cursor.execute('DELETE FROM eau_brute_agregats WHERE site_prelevement = ? AND periode = ? AND debut = ?',
+                               (site, periode, debut_periode))
+                self._inserer_agregats(cursor, periode, f"WHERE site_prelevement = ? AND {debut} = ?", (site, debut_periode))
+
+    def _reconstruire_series_eau_brute(self, cursor):
+        colonnes = ", ".join(self.PARAMETRES_EAU_BRUTE)
+        # La clé de la table refuse les valeurs nulles : une session sans date n'a pas sa place dans une série,
+        # un opérateur ou un site absent devient ''
+        cle = "date_test, COALESCE(operateur, ''), COALESCE(site_prelevement, '')"
+        selection = f'''
+            SELECT {cle}, {colonnes} FROM mesures_jar_test
+            WHERE id IN (SELECT MAX(id) FROM mesures_jar_test WHERE date_test IS NOT NULL AND date_test <> '' GROUP BY {cle})
+        '''
+        cursor.execute('DELETE FROM eau_brute_sessions')
+        cursor.execute('DELETE FROM eau_brute_agregats')
+        cursor.executemany(
+            f'INSERT INTO eau_brute_sessions VALUES ({", ".join("?" * (len(self.PARAMETRES_EAU_BRUTE) + 3))})',
+            self._interroger_archives(selection)
+        )
+        # Une session enregistrée à nouveau après son archivage : la version de la base courante l'emporte
+        cursor.execute(f'''
+            INSERT INTO eau_brute_sessions (date_test, operateur, site_prelevement, {colonnes}) {selection}
+            ON CONFLICT (date_test, operateur, site_prelevement) DO UPDATE SET
+            {", ".join(f"{p} = excluded.{p}" for p in self.PARAMETRES_EAU_BRUTE)}
+        ''')
+        for periode in self.PERIODES:
+            self._inserer_agregats(cursor, periode)
+
+    @chronometre.instrumenter("DatabaseManager.reconstruire_series_eau_brute")
+    @transaction_ecriture()
+    def reconstruire_series_eau_brute(self):
+        """Recalcule toutes les séries (après un import direct dans mesures_jar_test)"""
+        conn = self.connecter()
+        cursor = conn.cursor()
+        self._reconstruire_series_eau_brute(cursor)
+        conn.commit()
+        conn.close()
+
+    def _inserer_comparaison(self, cursor, filtre="", parametres_filtre=(), annees=None):
+        """Agrège les essais par site, type d'eau, combinaison et mois (dose efficace : celle du meilleur essai de chaque session)"""
+        requete = f'''
+            WITH essais AS (
+                SELECT site_prelevement, COALESCE(type_eau, '') AS type_eau, combinaison, substr(date_test, 1, 7) AS mois, abattement,
+                       coagulant_ml / NULLIF(volume_echantillon, 0) AS dose_coagulant,
+                       floculant_ml / NULLIF(volume_echantillon, 0) AS dose_floculant,
+                       ROW_NUMBER() OVER (PARTITION BY date_test, operateur, site_prelevement, combinaison ORDER BY abattement DESC, essai) AS rang,
+                       COUNT(*) OVER (PARTITION BY date_test, operateur, site_prelevement, combinaison) AS nombre_essais
+                FROM mesures_jar_test WHERE abattement > 0 {filtre}
+            )
+            SELECT site_prelevement, type_eau, combinaison, mois, abattement, dose_coagulant, dose_floculant, nombre_essais
+            FROM essais WHERE rang = 1
+        '''
+        cursor.execute(requete, parametres_filtre)
+        # Les optimums des sessions archivées des mêmes années sont lus dans les bases d'archive
+        optimums = pd.DataFrame(
+            cursor.fetchall() + self._interroger_archives(requete, parametres_filtre, annees),
+            columns=[description[0] for description in cursor.description]
+        )
+        if optimums.empty:
+            return
+        # SQLite n'a pas de médiane : les optimums de session sont agrégés par pandas
+        agregats = optimums.groupby(['site_prelevement', 'type_eau', 'combinaison', 'mois'], sort=False).agg(
+            nombre_sessions=('abattement', 'size'), nombre_essais=('nombre_essais', 'sum'),
+            meilleur_abattement=('abattement', 'max'), abattement_median=('abattement', 'median'),
+            dose_coagulant_mediane=('dose_coagulant', 'median'), dose_floculant_mediane=('dose_floculant', 'median')
+        ).reset_index().astype(object)
+        cursor.executemany(
+            'INSERT INTO comparaison_agregats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            agregats.where(agregats.notna(), None).itertuples(index=False, name=None)
+        )
+
+    def _rafraichir_comparaison(self, cursor, sessions):
+        """Recalcule les mois touchés par les sessions enregistrées, site par site"""
+        for site, mois in {(site, str(date_test)[:7]) for date_test, _, site in sessions}:
+            annee, numero = int(mois[:4]), int(mois[5:7])
+            mois_suivant = f"{annee + numero // 12:04d}-{numero % 12 + 1:02d}-01"
+            cursor.execute('DELETE FROM comparaison_agregats WHERE site_prelevement = ? AND mois = ?', (site, mois))
+            self._inserer_comparaison(cursor, "AND site_prelevement = ? AND date_test >= ? AND date_test < ?",
+                                      (site, f"{mois}-01", mois_suivant), {annee})
+
+    def _reconstruire_comparaison(self, cursor):
+        cursor.execute('DELETE FROM comparaison_agregats')
+        self._inserer_comparaison(cursor)
+
+    @chronometre.instrumenter("DatabaseManager.reconstruire_comparaison")
+    @transaction_ecriture()
+    def reconstruire_comparaison(self):
+        """Recalcule tous les agrégats de comparaison (après un import direct dans mesures_jar_test)"""
+        conn = self.connecter()
+        cursor = conn.cursor()
+        self._reconstruire_comparaison(cursor)
+        conn.commit()
+        conn.close()
+
+    @chronometre.instrumenter("DatabaseManager.get_comparaison")
+    def get_comparaison(self, combinaisons=None, debut=None, fin=None):
+        """Agrégats mensuels de comparaison, restreints aux combinaisons et aux mois (AAAA-MM) demandés"""
+        filtre = "mois >= ? AND mois <= ?"
+        params = [debut or "0000-00", fin or "9999-99"]
+        if combinaisons:
+            filtre += f" AND combinaison IN ({', '.join('?' * len(combinaisons))})"
+            params += list(combinaisons)
+        conn = self.connecter()
+        cursor = conn.cursor()
+        
+        cursor.execute(f'SELECT * FROM comparaison_agregats WHERE {filtre}', params)
+        results = cursor.fetchall()
+        
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        return pd.DataFrame(results, columns=columns)
+
+    @chronometre.instrumenter("DatabaseManager.get_dimensions_comparaison")
+    def get_dimensions_comparaison(self):
+        """Mois et combinaisons présents dans les agrégats de comparaison"""
+        conn = self.connecter()
+        mois = [ligne[0] for ligne in conn.execute('SELECT DISTINCT mois FROM comparaison_agregats ORDER BY mois')]
+        combinaisons = [ligne[0] for ligne in conn.execute('SELECT DISTINCT combinaison FROM comparaison_agregats ORDER BY combinaison')]
+        conn.close()
+        return mois, combinaisons
+
+    @chronometre.instrumenter("DatabaseManager.get_serie_eau_brute")
+    def get_serie_eau_brute(self, site, parametre, periode="jour", debut=None, fin=None):
+        """Série d'un paramètre de l'eau brute sur un site : nombre, moyenne, écart-type, min et max par période"""
+        conn = self.connecter()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT debut, nombre, somme, somme_carres, minimum, maximum FROM eau_brute_agregats
+            WHERE site_prelevement = ? AND parametre = ? AND periode = ? AND debut >= ? AND debut <= ?
+            ORDER BY debut
+        ''', (site, parametre, periode, str(debut or "0000-00-00"), str(fin or "9999-99-99")))
+        results = cursor.fetchall()
+        
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        serie = pd.DataFrame(results, columns=columns)
+        serie['debut'] = pd.to_datetime(serie['debut'])
+        serie['moyenne'] = serie['somme'] / serie['nombre']
+        serie['ecart_type'] = np.sqrt(np.maximum(serie['somme_carres'] / serie['nombre'] - serie['moyenne'] ** 2, 0.0))
+        return serie[['debut', 'nombre', 'moyenne', 'ecart_type', 'minimum', 'maximum']]
+
+    @chronometre.instrumenter("DatabaseManager.get_statistiques_eau_brute")
+    def get_statistiques_eau_brute(self, site, date_fin, jours=90):
+        """Moyenne et écart-type glissants de chaque paramètre de l'eau brute du site sur les `jours` précédant date_fin"""
+        fin = debut_periode_eau_brute(date_fin, "jour")
+        debut = (datetime.strptime(fin, "%Y-%m-%d").date() - timedelta(days=jours)).isoformat()
+        conn = self.connecter()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT parametre, SUM(nombre) AS nombre, SUM(somme) AS somme, SUM(somme_carres) AS somme_carres
+            FROM eau_brute_agregats
+            WHERE site_prelevement = ? AND periode = 'jour' AND debut >= ? AND debut < ?
+            GROUP BY parametre
+        ''', (site, debut, fin))
+        results = cursor.fetchall()
+        
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        statistiques = pd.DataFrame(results, columns=columns).set_index('parametre')
+        statistiques['moyenne'] = statistiques['somme'] / statistiques['nombre']
+        statistiques['ecart_type'] = np.sqrt(np.maximum(statistiques['somme_carres'] / statistiques['nombre'] - statistiques['moyenne'] ** 2, 0.0))
+        return statistiques[['nombre', 'moyenne', 'ecart_type']]
+
+    @chronometre.instrumenter("DatabaseManager.get_sites_eau_brute")
+    def get_sites_eau_brute(self):
+        conn = self.connecter()
+        sites = [ligne[0] for ligne in conn.execute('SELECT DISTINCT site_prelevement FROM eau_brute_sessions ORDER BY site_prelevement')]
+        conn.close()
+        return sites
+    
+    @chronometre.instrumenter("DatabaseManager.get_historique_essais")
+    def get_historique_essais(self, site, colonne, debut=None, fin=None, max_points=2000):
+        """Valeurs d'une colonne des essais d'un site dans le temps, réduites au minimum et au maximum par intervalle au-delà de max_points"""
+        if colonne not in self.COLONNES_HISTORIQUE:
+            raise ValueError(f"Colonne d'historique inconnue : {colonne}")
+        # 0 est la valeur d'un champ non renseigné dans la grille de saisie
+        filtre = f"site_prelevement = ? AND date_test >= ? AND date_test <= ? AND {colonne} IS NOT NULL AND {colonne} != 0"
+        params = [site, str(debut or "0000-00-00"), str(fin or "9999-99-99")]
+        conn = self.connecter()
+        cursor = conn.cursor()
+        
+        cursor.execute(f'SELECT COUNT(*), MIN(date_test), MAX(date_test) FROM mesures_jar_test WHERE {filtre}', params)
+        nombre, premier, dernier = cursor.fetchone()
+        if nombre <= max_points:
+            cursor.execute(f'SELECT date_test, {colonne} AS valeur FROM mesures_jar_test WHERE {filtre} ORDER BY date_test, id', params)
+        else:
+            # Intervalles de même durée entre la première et la dernière date ; dans chacun, seuls l'essai
+            # minimal et l'essai maximal sont renvoyés, à leur date : l'enveloppe de la courbe est conservée
+            intervalles = max(max_points // 2, 1)
+            cursor.execute(f'''
+                WITH points AS (
+                    SELECT id, date_test, {colonne} AS valeur, {self.SQL_INTERVALLE} AS intervalle
+                    FROM mesures_jar_test WHERE {filtre}
+                ), rangs AS (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY intervalle ORDER BY valeur, id) AS rang_min,
+                              ROW_NUMBER() OVER (PARTITION BY intervalle ORDER BY valeur DESC, id) AS rang_max
+                    FROM points
+                )
+                SELECT date_test, valeur FROM rangs WHERE rang_min = 1 OR rang_max = 1 ORDER BY date_test, id
+            ''', [premier, intervalles, dernier, premier, intervalles - 1] + params)
+        results = cursor.fetchall()
+        conn.close()
+        
+        historique = pd.DataFrame(results, columns=['date_test', 'valeur'])
+        historique['date_test'] = pd.to_datetime(historique['date_test'])
+        return historique, nombre
+
+    def _filtre_recherche(self, criteres, sauf=None):
+        """Clause WHERE et paramètres des critères de recherche ; la sélection de la facette `sauf` est ignorée"""
+        conditions = []
+        params = []
+        requete = self.requete_texte(criteres.get('texte', ''))
+        if requete:
+            conditions.append(self.SQL_PLEIN_TEXTE)
+            params.append(requete)
+        if criteres.get('date_debut'):
+            conditions.append('date_test >= ?')
+            params.append(str(criteres['date_debut']))
+        if criteres.get('date_fin'):
+            conditions.append('date_test <= ?')
+            params.append(str(criteres['date_fin']))
+        for colonne, (minimum, maximum) in criteres.get('plages', {}).items():
+            if colonne not in self.COLONNES_NUMERIQUES:
+                raise ValueError(f"Colonne numérique inconnue : {colonne}")
+            conditions.append(f'{colonne} BETWEEN ? AND ?')
+            params += [minimum, maximum]
+        for facette, valeurs in criteres.get('facettes', {}).items():
+            if facette not in self.FACETTES_RECHERCHE:
+                raise ValueError(f"Facette inconnue : {facette}")
+            if facette != sauf and valeurs:
+                conditions.append(f"{facette} IN ({', '.join('?' * len(valeurs))})")
+                params += list(valeurs)
+        return ('WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    def _annees_recherche(self, criteres, archives):
+        """Années d'archive à interroger : aucune sans archives, sinon celles de la période recherchée"""
+        if not archives:
+            return set()
+        if not (criteres.get('date_debut') or criteres.get('date_fin')):
+            return None
+        premiere = int(str(criteres.get('date_debut') or "0001")[:4])
+        derniere = int(str(criteres.get('date_fin') or "9999")[:4])
+        return set(range(premiere, derniere + 1))
+
+    @chronometre.instrumenter("DatabaseManager.rechercher_mesures")
+    def rechercher_mesures(self, criteres, limite=None, archives=False, decalage=0):
+        """Page de `limite` mesures répondant aux critères à partir du rang `decalage`, des plus récentes aux plus anciennes,
+        et leur nombre total (archives comprises si demandé)"""
+        filtre, params = self._filtre_recherche(criteres)
+        annees = self._annees_recherche(criteres, archives)
+        requete_nombre = f'SELECT COUNT(*) FROM mesures_jar_test {filtre}'
+        requete = f'SELECT * FROM mesures_jar_test {filtre} ORDER BY date_test DESC, id DESC'
+        page = []
+        if limite and annees != set():
+            # Chaque archive renvoie ses `decalage + limite` premières lignes : leur fusion contient la page demandée
+            requete += ' LIMIT ?'
+            page = [decalage + limite]
+        elif limite:
+            requete += ' LIMIT ? OFFSET ?'
+            page = [limite, decalage]
+        conn = self.connecter()
+        cursor = conn.cursor()
+        
+        nombre = cursor.execute(requete_nombre, params).fetchone()[0]
+        cursor.execute(requete, params + page)
+        results = cursor.fetchall()
+        
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        if annees != set():
+            nombre += sum(ligne[0] for ligne in self._interroger_archives(requete_nombre, params, annees))
+            results += self._interroger_archives(requete, params + page, annees)
+            mesures = pd.DataFrame(results, columns=columns).sort_values(['date_test', 'id'], ascending=False)
+            return (mesures.iloc[decalage:decalage + limite] if limite else mesures).reset_index(drop=True), nombre
+        return pd.DataFrame(results, columns=columns), nombre
+
+    @chronometre.instrumenter("DatabaseManager.compter_facettes")
+    def compter_facettes(self, criteres, archives=False):
+        """Nombre de mesures par valeur de chaque facette, sous les autres critères que la facette elle-même"""
+        selectionnees = [f for f in self.FACETTES_RECHERCHE if criteres.get('facettes', {}).get(f)]
+        libres = [f for f in self.FACETTES_RECHERCHE if f not in selectionnees]
+        facettes = {facette: defaultdict(int) for facette in self.FACETTES_RECHERCHE}
+        annees = self._annees_recherche(criteres, archives)
+        conn = self.connecter()
+        cursor = conn.cursor()
+
+        def compter(requete, params):
+            cursor.execute(requete, params)
+            return cursor.fetchall() + (self._interroger_archives(requete, params, annees) if annees != set() else [])
+        
+        # Les facettes sans sélection partagent le même filtre : un seul parcours, groupé sur toutes à la fois
+        if libres:
+            filtre, params = self._filtre_recherche(criteres)
+            for ligne in compter(f'SELECT {", ".join(libres)}, COUNT(*) FROM mesures_jar_test {filtre} GROUP BY {", ".join(libres)}', params):
+                for facette, valeur in zip(libres, ligne):
+                    facettes[facette][valeur] += ligne[-1]
+        for facette in selectionnees:
+            filtre, params = self._filtre_recherche(criteres, sauf=facette)
+            for valeur, nombre in compter(f'SELECT {facette}, COUNT(*) FROM mesures_jar_test {filtre} GROUP BY {facette}', params):
+                facettes[facette][valeur] += nombre
+        conn.close()
+        
+        return {
+            facette: dict(sorted(((v, n) for v, n in comptes.items() if v not in (None, "")), key=lambda vn: (-vn[1], vn[0])))
+            for facette, comptes in facettes.items()
+        }
+
+    @chronometre.instrumenter("DatabaseManager.get_bornes")
+    def get_bornes(self, colonne, archives=False):
+        """Plus petite et plus grande valeur d'une colonne (date_test ou colonne numérique)"""
+        if colonne != 'date_test' and colonne not in self.COLONNES_NUMERIQUES:
+            raise ValueError(f"Colonne inconnue : {colonne}")
+        requete = f'SELECT MIN({colonne}), MAX({colonne}) FROM mesures_jar_test'
+        conn = self.connecter()
+        bornes = [conn.execute(requete).fetchone()]
+        conn.close()
+        if archives:
+            bornes += self._interroger_archives(requete)
+        minimums = [b[0] for b in bornes if b[0] is not None]
+        maximums = [b[1] for b in bornes if b[1] is not None]
+        return (min(minimums), max(maximums)) if minimums else (None, None)
+
+    @chronometre.instrumenter("DatabaseManager.compter_mesures")
+    def compter_mesures(self):
+        conn = self.connecter()
+        nombre = conn.execute('SELECT COUNT(*) FROM mesures_jar_test').fetchone()[0]
+        conn.close()
+        return nombre
+
+    @chronometre.instrumenter("DatabaseManager.compter_mesures_archivees")
+    def compter_mesures_archivees(self):
+        """Nombre d'essais déplacés dans les bases d'archive"""
+        conn = self.connecter()
+        nombre = conn.execute('SELECT COALESCE(SUM(nombre_essais), 0) FROM sessions_archivees').fetchone()[0]
+        conn.close()
+        return nombre
+
+    @chronometre.instrumenter("DatabaseManager.get_all_mesures")
+    def get_all_mesures(self, archives=False):
+        conn = self.connecter()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM mesures_jar_test ORDER BY created_at DESC')
+        results = cursor.fetchall()
+        
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        if archives:
+            results += self._interroger_archives('SELECT * FROM mesures_jar_test')
+            return pd.DataFrame(results, columns=columns).sort_values('created_at', ascending=False, ignore_index=True)
+        return pd.DataFrame(results, columns=columns)
+
+    @chronometre.instrumenter("DatabaseManager.get_mesures_combinaison")
+    def get_mesures_combinaison(self, combinaison):
+        conn = self.connecter()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM mesures_jar_test WHERE combinaison = ? ORDER BY created_at DESC', (combinaison,))
+        results = cursor.fetchall()
+        
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        return pd.DataFrame(results, columns=columns)
+
+    def _filtre_observations(self, combinaison, session):
+        # Essais mesurés de la combinaison, hors session en cours : ses essais enregistrés sont déjà dans le tableau de saisie
+        filtre, parametres = "combinaison = ? AND dco_sortie > 0", [combinaison]
+        if session is not None:
+            filtre += " AND NOT (date_test = ? AND operateur = ? AND site_prelevement = ?)"
+            parametres += [str(session[0]), session[1], session[2]]
+        return filtre, parametres
+
+    @chronometre.instrumenter("DatabaseManager.get_version_observations")
+    def get_version_observations(self, combinaison, session=None):
+        """(nombre, dernier id) des essais mesurés de la combinaison : change dès qu'un essai est ajouté ou retiré"""
+        filtre, parametres = self._filtre_observations(combinaison, session)
+        conn = self.connecter()
+        version = tuple(conn.execute(f'SELECT COUNT(*), MAX(id) FROM mesures_jar_test WHERE {filtre}', parametres).fetchone())
+        conn.close()
+        return version
+
+    @chronometre.instrumenter("DatabaseManager.get_observations_combinaison")
+    def get_observations_combinaison(self, combinaison, limite, session=None):
+        """Les `limite` derniers essais mesurés de la combinaison (doses, volume et abattement), hors `session`"""
+        filtre, parametres = self._filtre_observations(combinaison, session)
+        conn = self.connecter()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT volume_echantillon, coagulant_ml, floculant_ml, dco_sortie, abattement FROM mesures_jar_test
+            WHERE {filtre} ORDER BY id DESC LIMIT ?
+        ''', (*parametres, limite))
+        results = cursor.fetchall()
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        return pd.DataFrame(results, columns=columns)
+
+    @chronometre.instrumenter("DatabaseManager.get_compteurs_mesures")
+    def get_compteurs_mesures(self):
+        """(lignes insérées, transactions de modification ou de suppression, dernier id) de mesures_jar_test"""
+        conn = self.connecter()
+        compteurs = tuple(conn.execute('''
+            SELECT insertions, modifications, (SELECT COALESCE(MAX(id), 0) FROM mesures_jar_test) FROM compteurs_mesures
+        ''').fetchone())
+        conn.close()
+        return compteurs
+
+    @chronometre.instrumenter("DatabaseManager.get_mesures_depuis")
+    def get_mesures_depuis(self, dernier_id, colonnes, jusqu_a=None):
+        conn = self.connecter()
+        cursor = conn.cursor()
+        
+        filtre, parametres = ("id > ?", (dernier_id,)) if jusqu_a is None else ("id > ? AND id <= ?", (dernier_id, jusqu_a))
+        cursor.execute(f'SELECT id, {", ".join(colonnes)} FROM mesures_jar_test WHERE {filtre} ORDER BY id', parametres)
+        results = cursor.fetchall()
+        
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        return pd.DataFrame(results, columns=columns)
+
+    @chronometre.instrumenter("DatabaseManager.get_mesures_site")
+    def get_mesures_site(self, site_prelevement):
+        """Essais de toutes les sessions d'un site, des plus récents aux plus anciens"""
+        conn = self.connecter()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM mesures_jar_test WHERE site_prelevement = ? ORDER BY created_at DESC', (site_prelevement,))
+        results = cursor.fetchall()
+        
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        return pd.DataFrame(results, columns=columns)
+
+    @chronometre.instrumenter("DatabaseManager.get_mesures_session")
+    def get_mesures_session(self, date_test, operateur, site_prelevement):
+        """Essais d'une session, par combinaison et numéro d'essai"""
+        conn = self.connecter()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT * FROM mesures_jar_test WHERE date_test = ? AND operateur = ? AND site_prelevement = ?
+            ORDER BY combinaison, essai
+        ''', (str(date_test), operateur, site_prelevement))
+        results = cursor.fetchall()
+        
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        return pd.DataFrame(results, columns=columns)
+
+    @chronometre.instrumenter("DatabaseManager.lister_sessions")
+    def lister_sessions(self, criteres=None, limite=None, decalage=0):
+        """Page des sessions ayant des essais répondant aux critères, des plus récentes aux plus anciennes, et leur nombre total"""
+        filtre, params = self._filtre_recherche(criteres or {})
+        sessions = f'FROM mesures_jar_test {filtre} GROUP BY date_test, operateur, site_prelevement'
+        requete = f'''
+            SELECT date_test, operateur, site_prelevement, MAX(type_eau) AS type_eau, COUNT(DISTINCT combinaison) AS combinaisons,
+                   COUNT(*) AS essais, MAX(abattement) AS meilleur_abattement
+            {sessions} ORDER BY date_test DESC, operateur, site_prelevement
+        '''
+        page = []
+        if limite:
+            requete += ' LIMIT ? OFFSET ?'
+            page = [limite, decalage]
+        conn = self.connecter()
+        cursor = conn.cursor()
+        
+        nombre = cursor.execute(f'SELECT COUNT(*) FROM (SELECT 1 {sessions}) AS sessions', params).fetchone()[0]
+        cursor.execute(requete, params + page)
+        results = cursor.fetchall()
+        
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        return pd.DataFrame(results, columns=columns), nombre
+
+    def parcourir_mesures(self, criteres, taille_page=5000):
+        """Mesures répondant aux critères par pages successives, des plus récentes aux plus anciennes"""
+        filtre, params = self._filtre_recherche(criteres)
+        # Pagination par clé : chaque page reprend après la dernière ligne lue, sans reparcourir les précédentes
+        # comme le ferait un OFFSET ; une connexion par page, rendue pendant que l'appelant traite la page
+        suite = ('AND' if filtre else 'WHERE') + ' (date_test < ? OR (date_test = ? AND id < ?))'
+        derniere = []
+        while True:
+            conn = self.connecter()
+            cursor = conn.cursor()
+            cursor.execute(
+                f'SELECT * FROM mesures_jar_test {filtre} {suite if derniere else ""} ORDER BY date_test DESC, id DESC LIMIT ?',
+                params + derniere + [taille_page]
+            )
+            page = pd.DataFrame(cursor.fetchall(), columns=[description[0] for description in cursor.description])
+            conn.close()
+            if not page.empty:
+                yield page
+            if len(page) < taille_page:
+                return
+            derniere = [page['date_test'].iloc[-1], page['date_test'].iloc[-1], int(page['id'].iloc[-1])]
+
+    def dossier_sauvegardes(self):
+        """Dossier des instantanés, sauvegardes/ à côté de la base"""
+        return os.path.join(os.path.dirname(os.path.abspath(self.db_file)), "sauvegardes")
+
+    def lister_sauvegardes(self):
+        """Instantanés de la base, du plus récent au plus ancien"""
+        dossier = self.dossier_sauvegardes()
+        if not os.path.isdir(dossier):
+            return []
+        motif = re.compile(re.escape(os.path.splitext(os.path.basename(self.db_file))[0]) + r"_(\d{8}_\d{6})(?:_(\w+))?\.db$")
+        sauvegardes = []
+        for nom in os.listdir(dossier):
+            correspondance = motif.match(nom)
+            if correspondance:
+                chemin = os.path.join(dossier, nom)
+                sauvegardes.append({
+                    'chemin': chemin,
+                    'date': datetime.strptime(correspondance.group(1), "%Y%m%d_%H%M%S"),
+                    'etiquette': correspondance.group(2) or "",
+                    'taille_mo': os.path.getsize(chemin) / 1024 ** 2
+                })
+        return sorted(sauvegardes, key=lambda sauvegarde: (sauvegarde['date'], sauvegarde['chemin']), reverse=True)
+
+    @chronometre.instrumenter("DatabaseManager.sauvegarder")
+    def sauvegarder(self, pages_par_etape=256, pause=0.05, conserver=14, etiquette=None, progression=None):
+        """Instantané cohérent de la base par l'API de sauvegarde en ligne de SQLite ; renvoie son chemin"""
+        dossier = self.dossier_sauvegardes()
+        os.makedirs(dossier, exist_ok=True)
+        racine = os.path.splitext(os.path.basename(self.db_file))[0]
+        nom = f"{racine}_{datetime.now().strftime('%Y%m%d_%H%M%S')}" + (f"_{etiquette}" if etiquette else "")
+        chemin = os.path.join(dossier, nom + ".db")
+        # Plusieurs processus de l'application peuvent sauvegarder dans la même seconde
+        partiel = f"{chemin}.{os.getpid()}.{threading.get_ident()}.partiel"
+
+        def etape(statut, restantes, total):
+            # Appelé entre deux étapes : la pause étale les lectures disque de la copie
+            if progression:
+                progression(total - restantes, total)
+            if restantes and pause:
+                time.sleep(pause)
+
+        source = sqlite3.connect(self.db_file, timeout=self.DELAI_ATTENTE)
+        destination = sqlite3.connect(partiel)
+        verification = None
+        try:
+            # Transaction de lecture tenue pendant toute la copie : en WAL, elle fige l'état copié sans bloquer
+            # les écritures, qui sinon relanceraient la copie depuis le début à chaque enregistrement
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            source.backup(destination, pages=pages_par_etape, progress=etape)
+            source.rollback()
+            # Instantané autonome, sans fichiers -wal/-shm à côté
+            destination.execute("PRAGMA journal_mode = DELETE")
+            verification = destination.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            destination.close()
+            source.close()
+            if verification != "ok":
+                os.remove(partiel)
+        if verification != "ok":
+            raise sqlite3.DatabaseError(f"Sauvegarde invalide ({verification})")
+        # Un instantané n'apparaît dans la liste qu'une fois complet et vérifié
+        with verrou_fichier(os.path.join(dossier, racine)):
+            os.replace(partiel, chemin)
+            if conserver:
+                self._rotation(conserver)
+        return chemin
+
+    def _rotation(self, conserver):
+        """Supprime les instantanés au-delà des `conserver` plus récents"""
+        for sauvegarde in self.lister_sauvegardes()[conserver:]:
+            os.remove(sauvegarde['chemin'])
+
+    @chronometre.instrumenter("DatabaseManager.restaurer")
+    def restaurer(self, chemin):
+        """Remplace le contenu de la base par un instantané ; l'état courant est d'abord sauvegardé"""
+        instantane = sqlite3.connect(chemin)
+        try:
+            verification = instantane.execute("PRAGMA quick_check").fetchone()[0]
+            if verification != "ok":
+                raise sqlite3.DatabaseError(f"Instantané invalide ({verification})")
+            securite = self.sauvegarder(conserver=None, etiquette="avant_restauration")
+            modifications = self.get_compteurs_mesures()[1]
+            # Copie en une étape : les autres connexions voient l'ancienne ou la nouvelle base, jamais un mélange
+            destination = sqlite3.connect(self.db_file, timeout=self.DELAI_ATTENTE)
+            try:
+                instantane.backup(destination)
+            finally:
+                destination.close()
+        finally:
+            instantane.close()
+        # Instantané antérieur à une migration : même fichier, schéma à remettre à jour
+        self.init_database()
+        self._retirer_essais_archives(modifications)
+        return securite
+
+    @transaction_ecriture()
+    def _retirer_essais_archives(self, modifications):
+        """Instantané antérieur à un archivage : les essais archivés depuis sont retirés de la base restaurée, pour ne pas
+        figurer à la fois dans la base et dans les archives (qui ne sont pas sauvegardées). Une session que l'instantané
+        connaît déjà comme archivée (sessions_archivees) a été enregistrée à nouveau après l'archivage : elle est conservée"""
+        cle_session = ("date_test", "operateur", "site_prelevement", "combinaison")
+        meme_session = " AND ".join(f"s.{c} IS m.{c}" for c in cle_session)
+        meme_essai = " AND ".join(f"a.{c} IS m.{c}" for c in self.CLE_NATURELLE)
+        retires = 0
+        conn = sqlite3.connect(self.db_file, timeout=self.DELAI_ATTENTE)
+        try:
+            # Compteurs de l'instantané, peut-être égaux à ceux qu'un calcul incrémental a vus sur la base remplacée :
+            # portés au-delà de ceux-ci pour qu'il reparte de zéro. Les tables dérivées de l'instantané restent justes
+            conn.execute('''
+                UPDATE compteurs_mesures SET modifications = MAX(modifications, ?) + 1,
+                    agregees = CASE WHEN agregees = insertions + modifications THEN insertions + MAX(modifications, ?) + 1 ELSE agregees END
+            ''', (modifications, modifications))
+            conn.commit()
+            for chemin in self.fichiers_archives().values():
+                # ATTACH hors transaction ; suppression et synthèse validées ensemble
+                conn.execute("ATTACH DATABASE ? AS archive", (chemin,))
+                retirees = conn.execute(f'''
+                    DELETE FROM main.mesures_jar_test AS m
+                    WHERE NOT EXISTS (SELECT 1 FROM main.sessions_archivees s WHERE {meme_session})
+                      AND EXISTS (SELECT 1 FROM archive.mesures_jar_test a WHERE {meme_essai})
+                ''').rowcount
+                # Comme à l'archivage, les tables dérivées restent justes (elles comptent aussi les archives)
+                self.compter_ecritures(conn, 0, int(retirees > 0))
+                retires += retirees
+                # Synthèse des sessions de l'archive, comme à l'archivage (archivage.py)
+                conn.execute('''
+                    INSERT OR REPLACE INTO main.sessions_archivees
+                    SELECT date_test, operateur, site_prelevement, combinaison, MAX(type_eau), COUNT(*), MAX(abattement), ?
+                    FROM archive.mesures_jar_test
+                    GROUP BY date_test, operateur, site_prelevement, combinaison
+                ''', (os.path.basename(chemin),))
+                conn.commit()
+                conn.execute("DETACH DATABASE archive")
+        finally:
+            conn.close()
+        return retires
+
+class PoolPostgreSQL:
+    """Connexions PostgreSQL partagées par les sessions d'un processus ; au-delà de `taille`, l'emprunt attend une connexion rendue"""
+
+    def __init__(self, url, taille=10):
+        if psycopg2 is None:
+            raise RuntimeError("Le stockage PostgreSQL nécessite le paquet psycopg2 (pip install psycopg2-binary)")
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, taille, url)
+        self.places = threading.BoundedSemaphore(taille)
+        self.schema_pret = False
+
+    def emprunter(self):
+        self.places.acquire()
+        try:
+            conn = self.pool.getconn()
+            if conn.closed:
+                # Connexion coupée par le serveur : remplacée par une nouvelle
+                self.pool.putconn(conn, close=True)
+                conn = self.pool.getconn()
+            return conn
+        except Exception:
+            self.places.release()
+            raise
+
+    def rendre(self, conn):
+        self.pool.putconn(conn, close=bool(conn.closed))
+        self.places.release()
+
+@st.cache_resource
+def obtenir_pool_postgresql(url, taille=10):
+    """Pool de connexions partagé entre reruns et sessions"""
+    return PoolPostgreSQL(url, taille)
+
+def adapter_parametre(valeur):
+    """Valeurs transmises comme sqlite3 les enregistre : dates en texte ISO, scalaires numpy en types Python"""
+    if isinstance(valeur, np.generic):
+        return valeur.item()
+    if isinstance(valeur, datetime):
+        return valeur.isoformat(" ")
+    if hasattr(valeur, 'isoformat'):
+        return valeur.isoformat()
+    return valeur
+
+class CurseurPostgreSQL:
+    """Curseur psycopg2 présenté comme un curseur sqlite3 : paramètres ?, execute chaînable"""
+
+    def __init__(self, curseur):
+        self.curseur = curseur
+
+    @staticmethod
+    def convertir(requete):
+        return requete.replace('%', '%%').replace('?', '%s')
+
+    def execute(self, requete, parametres=()):
+        self.curseur.execute(self.convertir(requete), [adapter_parametre(v) for v in parametres])
+        return self
+
+    def executemany(self, requete, sequence_parametres):
+        # Envoi par paquets : un aller-retour serveur pour 500 lignes au lieu d'un par ligne
+        psycopg2.extras.execute_batch(
+            self.curseur, self.convertir(requete), [[adapter_parametre(v) for v in p] for p in sequence_parametres], page_size=500
+        )
+        return self
+
+    def fetchone(self):
+        return self.curseur.fetchone()
+
+    def fetchall(self):
+        return self.curseur.fetchall()
+
+    def __iter__(self):
+        return iter(self.curseur)
+
+    @property
+    def description(self):
+        return self.curseur.description
+
+    @property
+    def rowcount(self):
+        return self.curseur.rowcount
+
+class ConnexionPostgreSQL:
+    """Connexion empruntée au pool, rendue à la fermeture (transaction non validée annulée)"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = pool.emprunter()
+
+    def cursor(self):
+        return CurseurPostgreSQL(self.conn.cursor())
+
+    def execute(self, requete, parametres=()):
+        return self.cursor().execute(requete, parametres)
+
+    def executemany(self, requete, sequence_parametres):
+        return self.cursor().executemany(requete, sequence_parametres)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        if self.conn is not None:
+            if not self.conn.closed:
+                self.conn.rollback()
+            self.pool.rendre(self.conn)
+            self.conn = None
+
+    def __del__(self):
+        # Méthode interrompue par une exception avant close() : la connexion revient quand même au pool
+        self.close()
+
+class DatabaseManagerPostgreSQL(DatabaseManager):
+    """Stockage des mesures sur un serveur PostgreSQL, pour plusieurs postes qui enregistrent en même temps"""
+
+    PERIODES = {'jour': "date_test", 'semaine': "to_char(date_trunc('week', date_test::date), 'YYYY-MM-DD')"}
+    SQL_INTERVALLE = "LEAST(FLOOR((date_test::date - ?::date) * ?::float8 / ((?::date - ?::date) + 1))::integer, ?)"
+    # Document plein texte comme celui de FTS5 (unicode61, sans accents) : accents retirés, ponctuation en espaces, minuscules.
+    # Accents retirés en premier : avec une base en locale C, lower() et [:alnum:] ne connaissent que l'ASCII
+    DOCUMENT_RECHERCHE = (
+        "to_tsvector('simple', lower(regexp_replace(translate("
+        + " || ' ' || ".join(f"coalesce({c}, '')" for c in DatabaseManager.COLONNES_TEXTE_RECHERCHE)
+        + ", 'ÀÁÂÃÄÅÇÈÉÊËÌÍÎÏÑÒÓÔÕÖÙÚÛÜÝàáâãäåçèéêëìíîïñòóôõöùúûüýÿ', 'AAAAAACEEEEIIIINOOOOOUUUUYaaaaaaceeeeiiiinooooouuuuyy'),"
+        + " '[^[:alnum:]]+', ' ', 'g')))"
+    )
+    SQL_PLEIN_TEXTE = f"{DOCUMENT_RECHERCHE} @@ to_tsquery('simple', ?)"
+    requete_texte = staticmethod(requete_plein_texte_postgresql)
+    # Transaction ouverte par psycopg2 dès la première requête
+    SQL_DEBUT_TRANSACTION = None
+    SQL_TABLE_EXISTE = "SELECT to_regclass(?) IS NOT NULL"
+    # Une écriture de l'application sur une ligne en cours de recopie attend la fin du lot : son trigger la reporte ensuite
+    SQL_VERROU_LOT = " FOR SHARE"
+    SQL_SANS_ROWID = ""
+    TYPE_REEL = "DOUBLE PRECISION"
+    SAUVEGARDE_LOCALE = False
+
+    def __init__(self, url, taille_pool=10, migrer_schema=True):
+        self.url = url
+        self.db_file = None
+        self.pool = obtenir_pool_postgresql(url, taille_pool)
+        if migrer_schema and not self.pool.schema_pret:
+            self.init_database()
+            self.pool.schema_pret = True
+
+    def connecter(self):
+        return ConnexionPostgreSQL(self.pool)
+
+    def verrou_ecriture(self):
+        # Les écritures concurrentes sont arbitrées par le serveur (verrous de ligne, ON CONFLICT)
+        return nullcontext()
+
+    @staticmethod
+    def est_conflit(erreur):
+        """Interblocage ou échec de sérialisation : la transaction peut être rejouée"""
+        return getattr(erreur, 'pgcode', None) in ('40001', '40P01')
+
+    @chronometre.instrumenter("DatabaseManagerPostgreSQL.init_database")
+    def init_database(self):
+        self.migrer()
+
+    @contextmanager
+    def verrou_migration(self, conn):
+        # Plusieurs processus démarrent en même temps : migrations un processus à la fois. Verrou de session,
+        # conservé d'une transaction à l'autre ; la connexion revient au pool, il est donc libéré explicitement
+        conn.execute("SELECT pg_advisory_lock(hashtext('jar_test_schema'))")
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.rollback()
+            conn.execute("SELECT pg_advisory_unlock(hashtext('jar_test_schema'))")
+            conn.commit()
+
+    def _installer_recopie(self, cursor, table, provisoire, colonnes, cle):
+        condition = " AND ".join(f"{c} = OLD.{c}" for c in cle)
+        cursor.execute(f'''
+            CREATE FUNCTION {provisoire}_recopie() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP <> 'INSERT' THEN
+                    DELETE FROM {provisoire} WHERE {condition};
+                END IF;
+                IF TG_OP <> 'DELETE' THEN
+                    INSERT INTO {provisoire} ({", ".join(colonnes)}) VALUES ({", ".join(f"NEW.{c}" for c in colonnes)});
+                END IF;
+                RETURN NULL;
+            END
+            $$
+        ''')
+        cursor.execute(f"CREATE TRIGGER {provisoire}_recopie AFTER INSERT OR UPDATE OR DELETE ON {table} FOR EACH ROW EXECUTE FUNCTION {provisoire}_recopie()")
+
+    def _retirer_recopie(self, cursor, table, provisoire):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {provisoire}_recopie ON {table}")
+        cursor.execute(f"DROP FUNCTION IF EXISTS {provisoire}_recopie()")
+
+    def _remplacer_table(self, cursor, table, provisoire):
+        # Plus aucune écriture sur l'ancienne table jusqu'au remplacement : aucune n'échappe à la recopie
+        cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        super()._remplacer_table(cursor, table, provisoire)
+        cursor.execute(f"ALTER INDEX IF EXISTS {provisoire}_pkey RENAME TO {table}_pkey")
+
+    def _migration_schema_initial(self, transaction, taille_lot, progression):
+        cursor = transaction.cursor
+
+        # Types de SQLite conservés (dates en texte ISO) : mêmes valeurs renvoyées par les deux stockages
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS mesures_jar_test (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                date_test TEXT,
+                operateur TEXT,
+                site_prelevement TEXT,
+                type_eau TEXT,
+                volume_echantillon DOUBLE PRECISION,
+                temps_coagulation INTEGER,
+                vitesse_coagulation INTEGER,
+                temps_floculation INTEGER,
+                vitesse_floculation INTEGER,
+                combinaison TEXT,
+                essai INTEGER,
+                coagulant_ml DOUBLE PRECISION,
+                floculant_ml DOUBLE PRECISION,
+                dco_entree DOUBLE PRECISION,
+                ph_entree DOUBLE PRECISION,
+                dco_sortie DOUBLE PRECISION,
+                ph_sortie DOUBLE PRECISION,
+                v_boue DOUBLE PRECISION,
+                turbidite TEXT,
+                abattement DOUBLE PRECISION,
+                turbidite_entree DOUBLE PRECISION,
+                turbidite_sortie DOUBLE PRECISION,
+                couleur_entree DOUBLE PRECISION,
+                couleur_sortie DOUBLE PRECISION,
+                mes_entree DOUBLE PRECISION,
+                mes_sortie DOUBLE PRECISION,
+                uv254_entree DOUBLE PRECISION,
+                uv254_sortie DOUBLE PRECISION,
+                aluminium_residuel DOUBLE PRECISION,
+                fer_residuel DOUBLE PRECISION,
+                conductivite_entree DOUBLE PRECISION,
+                conductivite_sortie DOUBLE PRECISION,
+                created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')
+            )
+        ''')
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_mesures_cle_naturelle ON mesures_jar_test ({", ".join(self.CLE_NATURELLE)})')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_mesures_site_date ON mesures_jar_test (site_prelevement, date_test)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_mesures_facettes ON mesures_jar_test ({", ".join(self.FACETTES_RECHERCHE)})')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_mesures_recherche ON mesures_jar_test USING GIN ({self.DOCUMENT_RECHERCHE})')
+
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS eau_brute_sessions (
+                date_test TEXT,
+                operateur TEXT,
+                site_prelevement TEXT,
+                {", ".join(f"{p} DOUBLE PRECISION" for p in self.PARAMETRES_EAU_BRUTE)},
+                PRIMARY KEY (date_test, operateur, site_prelevement)
+            )
+        ''')
         cursor.execute('''
-            INSERT INTO mesures_jar_test (
-                date_test, operateur, site_prelevement, type_eau, volume_echantillon,
-                temps_coagulation, vitesse_coagulation, temps_floculation, vitesse_floculation,
-                combinaison, essai, coagulant_ml, floculant_ml, dco_entree, ph_entree,
-                dco_sortie, ph_sortie, v_boue, turbidite, abattement, turbidite_entree,
-                turbidite_sortie, couleur_entree, couleur_sortie, mes_entree, mes_sortie,
-                uv254_entree, uv254_sortie, aluminium_residuel, fer_residuel,
-                conductivite_entree, conductivite_sortie
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            data['date_test'], data['operateur'], data['site_prelevement'], data['type_eau'],
-            data['volume_echantillon'], data['temps_coagulation'], data['vitesse_coagulation'],
-            data['temps_floculation'], data['vitesse_floculation'], data['combinaison'],
-            data['essai'], data['coagulant_ml'], data['floculant_ml'], data['dco_entree'],
-            data['ph_entree'], data['dco_sortie'], data['ph_sortie'], data['v_boue'],
-            data['turbidite'], data['abattement'], data['turbidite_entree'],
-            data['turbidite_sortie'], data['couleur_entree'], data['couleur_sortie'],
-            data['mes_entree'], data['mes_sortie'], data['uv254_entree'], data['uv254_sortie'],
-            data['aluminium_residuel'], data['fer_residuel'], data['conductivite_entree'],
-            data['conductivite_sortie']
-        ))
-        
-        conn.commit()
-        conn.close()
-    
-    def get_all_mesures(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM mesures_jar_test ORDER BY created_at DESC')
-        results = cursor.fetchall()
-        
-        columns = [description[0] for description in cursor.description]
+            CREATE TABLE IF NOT EXISTS eau_brute_agregats (
+                site_prelevement TEXT,
+                parametre TEXT,
+                periode TEXT,
+                debut TEXT,
+                nombre INTEGER,
+                somme DOUBLE PRECISION,
+                somme_carres DOUBLE PRECISION,
+                minimum DOUBLE PRECISION,
+                maximum DOUBLE PRECISION,
+                PRIMARY KEY (site_prelevement, parametre, periode, debut)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_eau_brute_sessions_site ON eau_brute_sessions (site_prelevement, date_test)')
+        if cursor.execute('SELECT NOT EXISTS (SELECT 1 FROM eau_brute_sessions) AND EXISTS (SELECT 1 FROM mesures_jar_test)').fetchone()[0]:
+            self._reconstruire_series_eau_brute(cursor)
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS comparaison_agregats (
+                site_prelevement TEXT,
+                type_eau TEXT,
+                combinaison TEXT,
+                mois TEXT,
+                nombre_sessions INTEGER,
+                nombre_essais INTEGER,
+                meilleur_abattement DOUBLE PRECISION,
+                abattement_median DOUBLE PRECISION,
+                dose_coagulant_mediane DOUBLE PRECISION,
+                dose_floculant_mediane DOUBLE PRECISION,
+                PRIMARY KEY (site_prelevement, type_eau, combinaison, mois)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_comparaison_mois ON comparaison_agregats (mois, combinaison)')
+        if cursor.execute('SELECT NOT EXISTS (SELECT 1 FROM comparaison_agregats) AND EXISTS (SELECT 1 FROM mesures_jar_test)').fetchone()[0]:
+            self._reconstruire_comparaison(cursor)
+
+    def _retirer_triggers_comptage(self, cursor):
+        for evenement in ('insert', 'update', 'delete'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS compteurs_mesures_{evenement} ON mesures_jar_test")
+        cursor.execute("DROP FUNCTION IF EXISTS compter_ecritures_mesures()")
+
+    def _rafraichir_series_eau_brute(self, cursor, sessions):
+        # Deux postes qui enregistrent sur le même site recalculeraient les mêmes agrégats en parallèle : un site à la fois,
+        # verrous pris dans le même ordre par tous (libérés à la fin de la transaction, comparaison comprise)
+        for site in sorted({site for _, _, site in sessions}):
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(?))", (f"jar_test_site:{site}",))
+        super()._rafraichir_series_eau_brute(cursor, sessions)
+
+    def fichiers_archives(self, annees=None):
+        return {}
+
+    def compter_mesures_archivees(self):
+        return 0
+
+    @chronometre.instrumenter("DatabaseManagerPostgreSQL.get_all_mesures")
+    def get_all_mesures(self, archives=False, taille_page=10000):
+        """Toutes les mesures, lues par pages depuis un curseur côté serveur"""
+        conn = self.connecter()
+        # Curseur nommé : le serveur ne transmet que `taille_page` lignes à la fois
+        curseur = conn.conn.cursor(name="jar_test_mesures")
+        curseur.itersize = taille_page
+        curseur.execute('SELECT * FROM mesures_jar_test ORDER BY created_at DESC')
+        results = list(curseur)
+        columns = [description[0] for description in curseur.description]
+        curseur.close()
         conn.close()
-        
         return pd.DataFrame(results, columns=columns)
 
+def ouvrir_base(adresse=None, migrer_schema=True):
+    """Stockage désigné par `adresse` ou par la variable d'environnement JAR_TEST_BASE : fichier SQLite (par défaut) ou URL postgresql://"""
+    adresse = adresse or os.environ.get("JAR_TEST_BASE", "jar_test_database.db")
+    if adresse.startswith(("postgresql://", "postgres://")):
+        return DatabaseManagerPostgreSQL(adresse, migrer_schema=migrer_schema)
+    return DatabaseManager(adresse, migrer_schema=migrer_schema)
+
+class ConflitConfiguration(Exception):
+    """Fichier de configuration modifié par un autre processus entre sa lecture et son enregistrement"""
+
+class CacheConfiguration:
+    """Catalogues JSON lus une fois par processus, relus dès qu'un autre processus les a remplacés"""
+
+    def __init__(self):
+        self.verrou = threading.Lock()
+        self.fichiers = {}
+
+    def lire(self, chemin):
+        """Copie du contenu du fichier et signature de la version lue"""
+        cle = os.path.abspath(chemin)
+        signature = signature_fichier(os.stat(cle))
+        with self.verrou:
+            entree = self.fichiers.get(cle)
+        if entree is None or entree[0] != signature:
+            with open(cle, 'r') as f:
+                # Signature du fichier effectivement ouvert : il a pu être remplacé depuis os.stat
+                entree = (signature_fichier(os.fstat(f.fileno())), json.load(f))
+            with self.verrou:
+                self.fichiers[cle] = entree
+        return copy.deepcopy(entree[1]), entree[0]
+
+@st.cache_resource
+def obtenir_cache_configuration():
+    """Cache des catalogues partagé entre reruns et sessions d'un même processus"""
+    return CacheConfiguration()
+
 class ConfigManager:
     def __init__(self):
         self.coagulants_file = "coagulants_config.json"
         self.floculants_file = "floculants_config.json"
         self.parametres_file = "parametres_config.json"
+        self.versions = {}
+    
+    def _lire(self, fichier):
+        donnees, self.versions[fichier] = obtenir_cache_configuration().lire(fichier)
+        return donnees
     
+    def _ecrire(self, fichier, donnees):
+        """Enregistrement atomique sous verrou, refusé si le fichier a changé depuis sa lecture"""
+        with verrou_fichier(fichier):
+            lue = self.versions.get(fichier)
+            if lue is not None and os.path.exists(fichier) and signature_fichier(os.stat(fichier)) != lue:
+                raise ConflitConfiguration(fichier)
+            ecrire_json_atomique(fichier, donnees)
+            self.versions[fichier] = signature_fichier(os.stat(fichier))
+    
+    @chronometre.instrumenter("ConfigManager.load_coagulants")
     def load_coagulants(self):
         try:
-            with open(self.coagulants_file, 'r') as f:
-                coagulants = json.load(f)
+            coagulants = self._lire(self.coagulants_file)
             if coagulants and coagulants[0]["nom"] != "Aucun":
                 for i, coag in enumerate(coagulants):
                     if coag["nom"] == "Aucun":
@@ -224,14 +2237,14 @@ class ConfigManager:
                 }
             ]
     
+    @chronometre.instrumenter("ConfigManager.save_coagulants")
     def save_coagulants(self, data):
-        with open(self.coagulants_file, 'w') as f:
-            json.dump(data, f, indent=4)
+        self._ecrire(self.coagulants_file, data)
     
+    @chronometre.instrumenter("ConfigManager.load_floculants")
     def load_floculants(self):
         try:
-            with open(self.floculants_file, 'r') as f:
-                floculants = json.load(f)
+            floculants = self._lire(self.floculants_file)
             if floculants and floculants[0]["nom"] != "Aucun":
                 for i, floc in enumerate(floculants):
                     if floc["nom"] == "Aucun":
@@ -299,23 +2312,149 @@ class ConfigManager:
                 }
             ]
     
+    @chronometre.instrumenter("ConfigManager.save_floculants")
     def save_floculants(self, data):
-        with open(self.floculants_file, 'w') as f:
-            json.dump(data, f, indent=4)
+        self._ecrire(self.floculants_file, data)
     
+    @chronometre.instrumenter("ConfigManager.load_parametres")
     def load_parametres(self):
         try:
-            with open(self.parametres_file, 'r') as f:
-                return json.load(f)
+            return self._lire(self.parametres_file)
         except:
             return {
                 "parametres_mesures": ["Turbidité", "Couleur", "pH", "Conductivité", "MES", "UV254", "Aluminium résiduel", "Fer résiduel", "DCO"],
                 "parametres_selectionnes": ["Turbidité", "pH", "DCO"]
             }
     
+    @chronometre.instrumenter("ConfigManager.save_parametres")
     def save_parametres(self, data):
-        with open(self.parametres_file, 'w') as f:
-            json.dump(data, f, indent=4)
+        self._ecrire(self.parametres_file, data)
+
+class IndexEauBrute:
+    """Index de similarité des sessions passées sur les caractéristiques de l'eau brute"""
+
+    PARAMETRES = ['turbidite_entree', 'couleur_entree', 'ph_entree', 'conductivite_entree', 'mes_entree', 'uv254_entree', 'dco_entree']
+    CLE_SESSION = ['date_test', 'operateur', 'site_prelevement']
+    COLONNES_RESULTAT = ['type_eau', 'volume_echantillon', 'combinaison', 'essai', 'coagulant_ml', 'floculant_ml', 'abattement']
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        # Index partagé par les sessions Streamlit : une mise à jour à la fois, et jamais pendant une recherche
+        self.verrou = threading.Lock()
+        self.vider()
+
+    def vider(self):
+        self.dernier_id = 0
+        self.compteurs = None
+        self.sessions = pd.DataFrame(columns=self.CLE_SESSION + self.PARAMETRES + self.COLONNES_RESULTAT)
+        self.vecteurs = np.empty((0, len(self.PARAMETRES)))
+        self.moyennes = np.zeros(len(self.PARAMETRES))
+        self.ecarts = np.ones(len(self.PARAMETRES))
+
+    def mettre_a_jour(self):
+        """Intègre les mesures ajoutées depuis la dernière mise à jour ; reconstruit l'index après une modification ou une
+        suppression (réenregistrement, dédoublonnage, archivage), ou si des lignes ont échappé à la lecture par id"""
+        with self.verrou:
+            compteurs = self.db_manager.get_compteurs_mesures()
+            if compteurs == self.compteurs:
+                return 0
+            insertions, modifications, dernier_id = compteurs
+            if self.compteurs is None or modifications != self.compteurs[1]:
+                self.vider()
+            colonnes = self.CLE_SESSION + self.PARAMETRES + self.COLONNES_RESULTAT
+            nouvelles = self.db_manager.get_mesures_depuis(self.dernier_id, colonnes, dernier_id)
+            # Id attribué avant une ligne déjà lue mais validé après elle (PostgreSQL), ou écriture non comptée
+            if self.compteurs is not None and len(nouvelles) != insertions - self.compteurs[0]:
+                self.vider()
+                nouvelles = self.db_manager.get_mesures_depuis(0, colonnes, dernier_id)
+            self.compteurs = compteurs
+            if nouvelles.empty:
+                return 0
+            self.dernier_id = int(nouvelles['id'].max())
+            self._integrer(nouvelles.drop(columns=['id']))
+            return len(nouvelles)
+
+    def _integrer(self, nouvelles):
+        # Une ligne par session : l'essai gagnant (meilleur abattement), anciennes et nouvelles mesures confondues
+        sessions = pd.concat([self.sessions, nouvelles], ignore_index=True)
+        sessions['abattement'] = pd.to_numeric(sessions['abattement'], errors='coerce')
+        sessions = sessions.sort_values('abattement', kind='stable', na_position='first').drop_duplicates(self.CLE_SESSION, keep='last')
+        self.sessions = sessions.reset_index(drop=True)
+
+        # Une valeur nulle correspond à un paramètre non mesuré
+        vecteurs = self.sessions[self.PARAMETRES].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float, copy=True)
+        vecteurs[vecteurs == 0] = np.nan
+        mesures = ~np.isnan(vecteurs)
+        effectifs = np.maximum(mesures.sum(axis=0), 1)
+        self.moyennes = np.where(mesures, vecteurs, 0.0).sum(axis=0) / effectifs
+        ecarts = np.sqrt(np.square(np.where(mesures, vecteurs - self.moyennes, 0.0)).sum(axis=0) / effectifs)
+        self.ecarts = np.where(ecarts > 1e-9, ecarts, 1.0)
+        self.vecteurs = (vecteurs - self.moyennes) / self.ecarts
+
+    def rechercher(self, caracteristiques, k=5):
+        """Retourne les k sessions passées les plus proches des caractéristiques données"""
+        with self.verrou:
+            sessions, vecteurs, moyennes, ecarts = self.sessions, self.vecteurs, self.moyennes, self.ecarts
+        if len(vecteurs) == 0:
+            return pd.DataFrame()
+
+        requete = np.array([caracteristiques.get(p, np.nan) or np.nan for p in self.PARAMETRES], dtype=float)
+        requete = (requete - moyennes) / ecarts
+
+        # Distance euclidienne normalisée sur les paramètres renseignés des deux côtés
+        differences = vecteurs - requete
+        communs = ~np.isnan(differences)
+        nombre_communs = communs.sum(axis=1)
+        distances = np.sqrt(np.square(np.where(communs, differences, 0.0)).sum(axis=1) / np.maximum(nombre_communs, 1))
+        distances[nombre_communs == 0] = np.inf
+
+        k = min(k, int(np.isfinite(distances).sum()))
+        if k == 0:
+            return pd.DataFrame()
+        voisins = np.argpartition(distances, k - 1)[:k]
+        voisins = voisins[np.argsort(distances[voisins])]
+
+        resultats = sessions.iloc[voisins].copy()
+        resultats.insert(0, 'distance', distances[voisins])
+        return resultats.reset_index(drop=True)
+
+@st.cache_resource
+def charger_index_eau_brute():
+    """Index partagé entre les sessions Streamlit, mis à jour de façon incrémentale"""
+    return IndexEauBrute(ouvrir_base())
+
+def afficher_essais_similaires(caracteristiques):
+    """Affiche les essais historiques dont l'eau brute ressemble le plus à l'eau courante"""
+    with st.expander("🔎 Essais historiques similaires", expanded=False):
+        k = st.number_input("Nombre de sessions à afficher", min_value=1, max_value=20, value=5, key="similaires_k")
+
+        debut = datetime.now()
+        index = charger_index_eau_brute()
+        index.mettre_a_jour()
+        similaires = index.rechercher(caracteristiques, k)
+        duree_ms = (datetime.now() - debut).total_seconds() * 1000
+
+        if similaires.empty:
+            st.info("Aucun essai historique comparable dans la base de données.")
+            return
+
+        st.caption(f"{len(index.sessions)} sessions indexées — recherche en {duree_ms:.1f} ms")
+        volume = pd.to_numeric(similaires['volume_echantillon'], errors='coerce').replace(0, np.nan)
+        affichage = pd.DataFrame({
+            'Distance': similaires['distance'].round(3),
+            'Date': similaires['date_test'],
+            'Site': similaires['site_prelevement'],
+            "Type d'eau": similaires['type_eau'],
+            'Combinaison gagnante': similaires['combinaison'],
+            'Essai': similaires['essai'],
+            'Coagulant (mL/L)': (similaires['coagulant_ml'] / volume).round(3),
+            'Floculant (mL/L)': (similaires['floculant_ml'] / volume).round(3),
+            'Abattement (%)': similaires['abattement'].round(2)
+        })
+        for parametre in IndexEauBrute.PARAMETRES:
+            if parametre in caracteristiques:
+                affichage[parametre.replace('_entree', '').upper()] = similaires[parametre]
+        st.dataframe(affichage, use_container_width=True)
 
 def calculer_volume_ppm(dilution, densite, matiere_active):
     """Calcule le volume de solution commerciale pure pour 1 ppm (mL/kg)"""
@@ -324,24 +2463,1039 @@ def calculer_volume_ppm(dilution, densite, matiere_active):
     volume_ppm = 1 / (densite * (matiere_active/100) * dilution)
     return volume_ppm
 
-def calculer_ppm_from_ml(volume_ml, volume_ppm, volume_eau_l=1.0):
-    """Calcule les ppm à partir du volume en mL"""
-    if volume_ppm == 0:
-        return 0
-    return (volume_ml / volume_eau_l) * (1 / volume_ppm)
+def calculer_ppm_from_ml(volume_ml, volume_ppm, volume_eau_l=1.0):
+    """Calcule les ppm à partir du volume en mL"""
+    if volume_ppm == 0:
+        return 0
+    return (volume_ml / volume_eau_l) * (1 / volume_ppm)
+
+def calculer_ppm_actif(ppm_commercial, matiere_active):
+    """Calcule les ppm actifs à partir des ppm commerciaux"""
+    return ppm_commercial * (matiere_active / 100)
+
+def calculer_volume_solution_commerciale(ppm_commercial, volume_ppm, volume_eau_l=1.0):
+    """Calcule le volume de solution commerciale pure"""
+    return ppm_commercial * volume_ppm * volume_eau_l
+
+def extraire_reactifs_combinaison(combinaison):
+    """Retourne les noms (coagulant, floculant) d'une combinaison"""
+    coagulant_nom = "Aucun"
+    floculant_nom = "Aucun"
+    if "Coagulant seul:" in combinaison:
+        coagulant_nom = combinaison.replace("Coagulant seul: ", "")
+    elif "Floculant seul:" in combinaison:
+        floculant_nom = combinaison.replace("Floculant seul: ", "")
+    elif " + " in combinaison:
+        parts = combinaison.split(" + ")
+        coagulant_nom = parts[0]
+        floculant_nom = parts[1]
+    return coagulant_nom, floculant_nom
+
+# Objectifs de traitement disponibles pour l'optimisation : colonne de tableau_essais,
+# colonne de contrôle (0 = non mesuré) et sens de l'objectif
+OBJECTIFS_OPTIMISATION = {
+    "Abattement DCO minimal (%)": {"colonne": "Abattement", "controle": "DCO_sortie", "maximiser": True},
+    "Turbidité résiduelle maximale (NTU)": {"colonne": "Turbidite_sortie", "controle": "Turbidite_sortie", "maximiser": False}
+}
+
+def interpoler_dose_objectif(couts_m3, doses_coag, doses_floc, reponses, cible, maximiser=True):
+    """Interpole la dose la moins coûteuse atteignant la cible sur la courbe dose-réponse"""
+    if len(reponses) == 0:
+        return None
+
+    ordre = np.argsort(couts_m3, kind="stable")
+    couts_m3 = np.asarray(couts_m3, dtype=float)[ordre]
+    doses_coag = np.asarray(doses_coag, dtype=float)[ordre]
+    doses_floc = np.asarray(doses_floc, dtype=float)[ordre]
+    # On se ramène toujours à une maximisation
+    score = np.asarray(reponses, dtype=float)[ordre] * (1 if maximiser else -1)
+    seuil = cible * (1 if maximiser else -1)
+
+    atteint = score >= seuil
+    if not atteint.any():
+        return None
+
+    k = int(np.argmax(atteint))
+    if k == 0:
+        return doses_coag[0], doses_floc[0], couts_m3[0]
+
+    # Interpolation linéaire entre le dernier essai sous la cible et le premier qui l'atteint
+    fraction = (seuil - score[k - 1]) / (score[k] - score[k - 1])
+    return (
+        doses_coag[k - 1] + fraction * (doses_coag[k] - doses_coag[k - 1]),
+        doses_floc[k - 1] + fraction * (doses_floc[k] - doses_floc[k - 1]),
+        couts_m3[k - 1] + fraction * (couts_m3[k] - couts_m3[k - 1])
+    )
+
+def creer_tableau_essais(doses_coag, doses_floc, coagulant_info, floculant_info, volume_echantillon, caracteristiques):
+    """Construit le tableau de saisie d'une combinaison à partir des doses commerciales (ppm)"""
+    doses_coag = np.asarray(doses_coag, dtype=float)
+    doses_floc = np.asarray(doses_floc, dtype=float)
+    nombre_essais = len(doses_coag)
+    zeros = np.zeros(nombre_essais)
+
+    if coagulant_info and coagulant_info['nom'] != "Aucun":
+        volume_ppm_coag = calculer_volume_ppm(coagulant_info['dilution'], coagulant_info['densite'], coagulant_info['matiere_active'])
+        coag_ml = calculer_volume_solution_commerciale(doses_coag, volume_ppm_coag, volume_echantillon)
+    else:
+        doses_coag, coag_ml = zeros, zeros
+
+    if floculant_info and floculant_info['nom'] != "Aucun":
+        volume_ppm_floc = calculer_volume_ppm(floculant_info['dilution'], floculant_info['densite'], floculant_info['matiere_active'])
+        floc_ml = calculer_volume_solution_commerciale(doses_floc, volume_ppm_floc, volume_echantillon)
+    else:
+        doses_floc, floc_ml = zeros, zeros
+
+    # L'ordre des colonnes est celui attendu par la saisie (accès par position)
+    return pd.DataFrame({
+        'Essai': np.arange(1, nombre_essais + 1),
+        'Coagulant_ml': coag_ml,
+        'Floculant_ml': floc_ml,
+        'Coagulant_ppm_com': doses_coag,
+        'Floculant_ppm_com': doses_floc,
+        'DCO_entree': caracteristiques.get('dco_entree', 0.0),
+        'pH_entree': caracteristiques.get('ph_entree', 0.0),
+        'DCO_sortie': 0.0,
+        'pH_sortie': 0.0,
+        'V_boue': 0.0,
+        'Turbidite': '',
+        'Abattement': 0.0,
+        'Turbidite_entree': caracteristiques.get('turbidite_entree', 0.0),
+        'Turbidite_sortie': 0.0,
+        'Couleur_entree': caracteristiques.get('couleur_entree', 0.0),
+        'Couleur_sortie': 0.0,
+        'MES_entree': caracteristiques.get('mes_entree', 0.0),
+        'MES_sortie': 0.0,
+        'UV254_entree': caracteristiques.get('uv254_entree', 0.0),
+        'UV254_sortie': 0.0,
+        'Aluminium_residuel': 0.0,
+        'Fer_residuel': 0.0,
+        'Conductivite_entree': caracteristiques.get('conductivite_entree', 0.0),
+        'Conductivite_sortie': 0.0
+    })
+
+def tableau_essais_depuis_mesures(mesures, coagulants_config, floculants_config):
+    """Tableaux de saisie (un par combinaison) reconstruits à partir des essais enregistrés d'une session"""
+    tableau_essais = {}
+    for combinaison, essais in mesures.sort_values('essai').groupby('combinaison', sort=False):
+        coagulant_nom, floculant_nom = extraire_reactifs_combinaison(combinaison)
+        volume_eau = essais['volume_echantillon'].astype(float).where(lambda v: v > 0, 1.0).to_numpy()
+        doses = []
+        # Doses commerciales (ppm) retrouvées à partir des mL dosés, comme dans le classement multicritère
+        for nom, catalogue, colonne in ((coagulant_nom, coagulants_config, 'coagulant_ml'), (floculant_nom, floculants_config, 'floculant_ml')):
+            reactif = next((r for r in catalogue if r["nom"] == nom), None)
+            volume_ppm = calculer_volume_ppm(reactif['dilution'], reactif['densite'], reactif['matiere_active']) if reactif and nom != "Aucun" else 0
+            doses.append(np.zeros(len(essais)) + calculer_ppm_from_ml(essais[colonne].astype(float).to_numpy(), volume_ppm, volume_eau))
+        tableau_essais[combinaison] = pd.DataFrame({
+            'Essai': essais['essai'].astype(int).to_numpy(),
+            'Coagulant_ml': essais['coagulant_ml'].to_numpy(dtype=float),
+            'Floculant_ml': essais['floculant_ml'].to_numpy(dtype=float),
+            'Coagulant_ppm_com': doses[0],
+            'Floculant_ppm_com': doses[1],
+            'DCO_entree': essais['dco_entree'].to_numpy(dtype=float),
+            'pH_entree': essais['ph_entree'].to_numpy(dtype=float),
+            'DCO_sortie': essais['dco_sortie'].to_numpy(dtype=float),
+            'pH_sortie': essais['ph_sortie'].to_numpy(dtype=float),
+            'V_boue': essais['v_boue'].to_numpy(dtype=float),
+            'Turbidite': essais['turbidite'].fillna('').to_numpy(),
+            'Abattement': essais['abattement'].to_numpy(dtype=float),
+            'Turbidite_entree': essais['turbidite_entree'].to_numpy(dtype=float),
+            'Turbidite_sortie': essais['turbidite_sortie'].to_numpy(dtype=float),
+            'Couleur_entree': essais['couleur_entree'].to_numpy(dtype=float),
+            'Couleur_sortie': essais['couleur_sortie'].to_numpy(dtype=float),
+            'MES_entree': essais['mes_entree'].to_numpy(dtype=float),
+            'MES_sortie': essais['mes_sortie'].to_numpy(dtype=float),
+            'UV254_entree': essais['uv254_entree'].to_numpy(dtype=float),
+            'UV254_sortie': essais['uv254_sortie'].to_numpy(dtype=float),
+            'Aluminium_residuel': essais['aluminium_residuel'].to_numpy(dtype=float),
+            'Fer_residuel': essais['fer_residuel'].to_numpy(dtype=float),
+            'Conductivite_entree': essais['conductivite_entree'].to_numpy(dtype=float),
+            'Conductivite_sortie': essais['conductivite_sortie'].to_numpy(dtype=float)
+        })
+    return tableau_essais
+
+METHODES_PLAN = ["Linéaire", "Logarithmique", "Hypercube latin", "Factoriel"]
+
+def calculer_niveaux_doses(methode, minimum, maximum, nombre):
+    """Répartit `nombre` niveaux de dose entre minimum et maximum (linéaire ou logarithmique)"""
+    if methode == "Logarithmique" and maximum > 0:
+        # Une échelle log ne peut pas partir de 0 : on démarre à 1 % de la dose maximale
+        return np.geomspace(minimum if minimum > 0 else maximum / 100, maximum, nombre)
+    return np.linspace(minimum, maximum, nombre)
+
+def generer_plan_doses(methode, nombre_pots, plage_coag, plage_floc, avec_coag=True, avec_floc=True, temoin=False, graine=None):
+    """Propose des doses commerciales (ppm) coagulant x floculant pour une série de pots"""
+    nombre = nombre_pots - 1 if temoin else nombre_pots
+    deux_reactifs = avec_coag and avec_floc
+
+    if nombre <= 0:
+        doses_coag, doses_floc = np.zeros(0), np.zeros(0)
+    elif methode == "Hypercube latin":
+        rng = np.random.default_rng(graine)
+        # Une seule valeur par strate et par réactif, strates permutées indépendamment
+        strates = (np.argsort(rng.random((2, nombre)), axis=1) + rng.random((2, nombre))) / nombre
+        doses_coag = plage_coag[0] + strates[0] * (plage_coag[1] - plage_coag[0])
+        doses_floc = plage_floc[0] + strates[1] * (plage_floc[1] - plage_floc[0])
+    elif methode == "Factoriel" and deux_reactifs:
+        niveaux_floc = max(1, int(np.sqrt(nombre)))
+        niveaux_coag = nombre // niveaux_floc
+        grille_coag, grille_floc = np.meshgrid(
+            np.linspace(plage_coag[0], plage_coag[1], niveaux_coag),
+            np.linspace(plage_floc[0], plage_floc[1], niveaux_floc),
+            indexing='ij'
+        )
+        doses_coag, doses_floc = grille_coag.ravel(), grille_floc.ravel()
+        # Pots restants (nombre non multiple du nombre de niveaux) : points intercalés entre
+        # les deux premiers niveaux de floculant, répartis sur la plage de coagulant
+        reste = nombre - doses_coag.size
+        if reste:
+            floc_intercale = plage_floc[0] + (plage_floc[1] - plage_floc[0]) / (2 * max(1, niveaux_floc - 1))
+            doses_coag = np.concatenate((doses_coag, np.linspace(plage_coag[0], plage_coag[1], reste + 2)[1:-1]))
+            doses_floc = np.concatenate((doses_floc, np.full(reste, floc_intercale)))
+    else:
+        # Série à rapport coagulant/floculant constant (ou un seul réactif)
+        methode_niveaux = "Linéaire" if methode == "Factoriel" else methode
+        doses_coag = calculer_niveaux_doses(methode_niveaux, plage_coag[0], plage_coag[1], nombre)
+        doses_floc = calculer_niveaux_doses(methode_niveaux, plage_floc[0], plage_floc[1], nombre)
+
+    if not avec_coag:
+        doses_coag = np.zeros_like(doses_coag)
+    if not avec_floc:
+        doses_floc = np.zeros_like(doses_floc)
+
+    ordre = np.lexsort((doses_floc, doses_coag))
+    doses_coag, doses_floc = doses_coag[ordre], doses_floc[ordre]
+    if temoin:
+        doses_coag = np.concatenate(([0.0], doses_coag))
+        doses_floc = np.concatenate(([0.0], doses_floc))
+    return np.round(doses_coag, 2), np.round(doses_floc, 2)
+
+def reinitialiser_saisie_combinaison(combinaison, nombre_essais):
+    """Supprime l'état des champs de saisie d'une combinaison pour qu'ils relisent tableau_essais"""
+    prefixes = ["coag_ppm", "floc_ppm", "dco_e", "dco_s", "ph_e", "ph_s", "v_boue"]
+    for prefixe in prefixes:
+        for i in range(max(nombre_essais, 20)):
+            st.session_state.pop(f"{prefixe}_{combinaison}_{i}", None)
+    st.session_state.pop(f"nb_essais_{combinaison}", None)
+    st.session_state.pop(f"bo_proposition_{combinaison}", None)
+
+def afficher_plan_experiences(combinaisons, coagulants_config, floculants_config, volume_echantillon, caracteristiques):
+    """Propose un plan d'expériences et préremplit tableau_essais pour toutes les combinaisons"""
+    with st.expander("🧮 Plan d'expériences (doses initiales)", expanded=False):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            methode = st.selectbox("Méthode", METHODES_PLAN, key="plan_methode")
+            nombre_pots = st.number_input("Nombre de pots", min_value=1, max_value=20, value=6, key="plan_nombre_pots")
+            temoin = st.checkbox("Premier pot témoin (sans réactif)", value=True, key="plan_temoin")
+        with col2:
+            coag_min = st.number_input("Coagulant min (ppm com.)", min_value=0.0, value=0.0, format="%.2f", key="plan_coag_min")
+            coag_max = st.number_input("Coagulant max (ppm com.)", min_value=0.0, value=250.0, format="%.2f", key="plan_coag_max")
+        with col3:
+            floc_min = st.number_input("Floculant min (ppm com.)", min_value=0.0, value=0.5, format="%.2f", key="plan_floc_min")
+            floc_max = st.number_input("Floculant max (ppm com.)", min_value=0.0, value=2.0, format="%.2f", key="plan_floc_max")
+        graine = None
+        if methode == "Hypercube latin":
+            graine = st.number_input("Graine aléatoire", min_value=0, value=42, key="plan_graine")
+
+        plans = {}
+        for combinaison in combinaisons:
+            coag_nom, floc_nom = extraire_reactifs_combinaison(combinaison)
+            plans[combinaison] = generer_plan_doses(
+                methode, nombre_pots, (coag_min, max(coag_min, coag_max)), (floc_min, max(floc_min, floc_max)),
+                avec_coag=coag_nom != "Aucun", avec_floc=floc_nom != "Aucun", temoin=temoin, graine=graine
+            )
+
+        apercu = pd.concat({
+            combinaison: pd.DataFrame({'Coag (ppm com.)': coag, 'Floc (ppm com.)': floc}, index=pd.RangeIndex(1, len(coag) + 1, name='Essai'))
+            for combinaison, (coag, floc) in plans.items()
+        }, axis=1)
+        st.dataframe(apercu, use_container_width=True)
+
+        if st.button("📋 Préremplir les essais de toutes les combinaisons"):
+            for combinaison, (coag, floc) in plans.items():
+                coag_nom, floc_nom = extraire_reactifs_combinaison(combinaison)
+                coag_info = next((c for c in coagulants_config if c["nom"] == coag_nom), coagulants_config[0])
+                floc_info = next((f for f in floculants_config if f["nom"] == floc_nom), floculants_config[0])
+                st.session_state.tableau_essais[combinaison] = creer_tableau_essais(
+                    coag, floc, coag_info, floc_info, volume_echantillon, caracteristiques
+                )
+                st.session_state.nombre_essais_par_combinaison[combinaison] = len(coag)
+                reinitialiser_saisie_combinaison(combinaison, len(coag))
+            st.success("Doses préremplies pour toutes les combinaisons.")
+            st.rerun()
+
+def noyau_rbf(a, b, longueur):
+    """Noyau gaussien (RBF) entre deux ensembles de points normalisés"""
+    distances = ((a[:, np.newaxis, :] - b[np.newaxis, :, :]) ** 2).sum(axis=-1)
+    return np.exp(-0.5 * distances / longueur ** 2)
+
+def ajuster_processus_gaussien(X, y, longueur=0.25, bruit=1e-2):
+    """Ajuste un processus gaussien sur (X, y) et retourne la fonction de prédiction (moyenne, écart-type)"""
+    moyenne_y = y.mean()
+    echelle_y = y.std() if y.std() > 0 else 1.0
+    y_norm = (y - moyenne_y) / echelle_y
+
+    cholesky = np.linalg.cholesky(noyau_rbf(X, X, longueur) + bruit * np.eye(len(X)))
+    alpha = np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, y_norm))
+
+    def predire(X_candidats):
+        k_candidats = noyau_rbf(X_candidats, X, longueur)
+        v = np.linalg.solve(cholesky, k_candidats.T)
+        variance = np.clip(1.0 - (v ** 2).sum(axis=0), 1e-12, None)
+        return moyenne_y + echelle_y * (k_candidats @ alpha), echelle_y * np.sqrt(variance)
+
+    return predire
+
+_erf = np.vectorize(math.erf)
+
+def calculer_amelioration_esperee(moyenne, ecart_type, meilleur):
+    """Amélioration espérée (Expected Improvement) par rapport au meilleur abattement observé"""
+    z = (moyenne - meilleur) / ecart_type
+    cdf = 0.5 * (1 + _erf(z / math.sqrt(2)))
+    pdf = np.exp(-0.5 * z ** 2) / math.sqrt(2 * math.pi)
+    return (moyenne - meilleur) * cdf + ecart_type * pdf
+
+def collecter_observations(combinaison, df_session, mesures_historiques, coagulant_info, floculant_info):
+    """Rassemble les doses commerciales (ppm) et abattements mesurés en session et dans la base"""
+    session = df_session[df_session['DCO_sortie'] > 0]
+    doses_coag = [session['Coagulant_ppm_com'].to_numpy(dtype=float)]
+    doses_floc = [session['Floculant_ppm_com'].to_numpy(dtype=float)]
+    abattements = [session['Abattement'].to_numpy(dtype=float)]
+
+    if mesures_historiques is not None and not mesures_historiques.empty:
+        historique = mesures_historiques[mesures_historiques['dco_sortie'] > 0]
+        volume_eau = historique['volume_echantillon'].to_numpy(dtype=float)
+        # La base stocke des mL : conversion inverse vers les ppm commerciaux
+        for info, colonne, cible in ((coagulant_info, 'coagulant_ml', doses_coag), (floculant_info, 'floculant_ml', doses_floc)):
+            if info and info['nom'] != "Aucun":
+                volume_ppm = calculer_volume_ppm(info['dilution'], info['densite'], info['matiere_active'])
+                cible.append(calculer_ppm_from_ml(historique[colonne].to_numpy(dtype=float), volume_ppm, volume_eau))
+            else:
+                cible.append(np.zeros(len(historique)))
+        abattements.append(historique['abattement'].to_numpy(dtype=float))
+
+    return np.column_stack((np.concatenate(doses_coag), np.concatenate(doses_floc))), np.concatenate(abattements)
+
+def proposer_doses_suivantes(doses, abattements, bornes, cout_m3, nombre, avec_coag=True, avec_floc=True):
+    """Propose une série de doses maximisant l'amélioration espérée d'abattement par € de réactif"""
+    bas = np.array([bornes[0][0], bornes[1][0]], dtype=float)
+    etendue = np.array([bornes[0][1] - bornes[0][0], bornes[1][1] - bornes[1][0]], dtype=float)
+    etendue[etendue <= 0] = 1.0
+
+    # Grille de candidats dans l'espace normalisé [0, 1]²
+    axe_coag = np.linspace(0, 1, 30 if avec_floc else 200) if avec_coag else np.zeros(1)
+    axe_floc = np.linspace(0, 1, 30 if avec_coag else 200) if avec_floc else np.zeros(1)
+    grille_coag, grille_floc = np.meshgrid(axe_coag, axe_floc, indexing='ij')
+    candidats = np.column_stack((grille_coag.ravel(), grille_floc.ravel()))
+    doses_candidats = bas + candidats * etendue
+    couts = cout_m3(doses_candidats[:, 0], doses_candidats[:, 1])
+    marge_cout = max(float(couts.max()) * 0.01, 1e-6)
+
+    X = (doses - bas) / etendue
+    y = abattements.astype(float)
+    disponibles = np.ones(len(candidats), dtype=bool)
+    propositions = []
+
+    for _ in range(min(nombre, len(candidats))):
+        predire = ajuster_processus_gaussien(X, y)
+        moyenne, ecart_type = predire(candidats)
+        amelioration = calculer_amelioration_esperee(moyenne, ecart_type, y.max())
+        score = np.where(disponibles, amelioration / (couts + marge_cout), -np.inf)
+        meilleur = int(np.argmax(score))
+
+        propositions.append({
+            'Coag (ppm com.)': doses_candidats[meilleur, 0],
+            'Floc (ppm com.)': doses_candidats[meilleur, 1],
+            'Abattement prédit (%)': moyenne[meilleur],
+            'Incertitude (±%)': ecart_type[meilleur],
+            'Amélioration espérée (%)': amelioration[meilleur],
+            'Coût (€/m³)': couts[meilleur]
+        })
+
+        # « Kriging believer » : la prédiction sert d'observation fictive pour le point suivant
+        disponibles[meilleur] = False
+        X = np.vstack((X, candidats[meilleur]))
+        y = np.append(y, moyenne[meilleur])
+
+    return pd.DataFrame(propositions).round(4)
+
+# Essais de l'historique retenus pour l'optimisation bayésienne : les plus récents, l'ajustement du processus gaussien
+# croissant avec le cube du nombre d'observations
+HISTORIQUE_BAYESIEN = 300
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def calculer_proposition_bayesienne(_db_manager, adresse, combinaison, session, version_historique, df_session,
+                                    coagulant_info, floculant_info, nombre_pots):
+    """Série proposée et bornes du domaine exploré (None avec moins de 3 essais mesurés), recalculée seulement si les
+    essais saisis ou l'historique de la combinaison (`version_historique`) ont changé"""
+    mesures_historiques = None
+    if version_historique is not None:
+        mesures_historiques = _db_manager.get_observations_combinaison(combinaison, HISTORIQUE_BAYESIEN, session)
+    doses, abattements = collecter_observations(combinaison, df_session, mesures_historiques, coagulant_info, floculant_info)
+    if len(abattements) < 3:
+        return None
+
+    avec_coag = coagulant_info['nom'] != "Aucun"
+    avec_floc = floculant_info['nom'] != "Aucun"
+    bornes = ((0.0, max(float(doses[:, 0].max()) * 1.5, 10.0)), (0.0, max(float(doses[:, 1].max()) * 1.5, 0.5)))
+
+    def cout_m3(coag, floc):
+        return (calculer_consommation_annuelle(coag, *caracteristiques_reactif(coagulant_info), 1.0)[3]
+                + calculer_consommation_annuelle(floc, *caracteristiques_reactif(floculant_info), 1.0)[3])
+
+    return proposer_doses_suivantes(doses, abattements, bornes, cout_m3, nombre_pots, avec_coag, avec_floc), len(abattements), bornes
+
+def afficher_proposition_bayesienne(combinaison, coagulant_info, floculant_info, volume_echantillon, caracteristiques, db_manager, session):
+    """Propose la série de pots suivante à partir des essais de la session et de l'historique"""
+    with st.expander("🎯 Proposer la série suivante (optimisation bayésienne)", expanded=False):
+        col1, col2 = st.columns(2)
+        with col1:
+            nombre_pots = st.number_input("Nombre de pots à proposer", min_value=1, max_value=12, value=4, key=f"bo_nombre_{combinaison}")
+        with col2:
+            avec_historique = st.checkbox("Inclure l'historique de la base", value=True, key=f"bo_historique_{combinaison}")
+
+        # Le contenu d'un expander s'exécute à chaque rerun, même replié : calcul seulement à la demande
+        cle_resultat = f"bo_proposition_{combinaison}"
+        if st.button("Calculer la série", key=f"bo_calculer_{combinaison}"):
+            df_session = st.session_state.tableau_essais[combinaison][['Coagulant_ppm_com', 'Floculant_ppm_com', 'DCO_sortie', 'Abattement']]
+            version_historique = db_manager.get_version_observations(combinaison, session) if avec_historique else None
+            adresse = getattr(db_manager, 'url', None) or db_manager.db_file
+            st.session_state[cle_resultat] = calculer_proposition_bayesienne(
+                db_manager, adresse, combinaison, session, version_historique, df_session, coagulant_info, floculant_info, nombre_pots
+            ) or "insuffisant"
+        resultat = st.session_state.get(cle_resultat)
+        if resultat is None:
+            return
+        if resultat == "insuffisant":
+            st.info("Au moins 3 essais mesurés (DCO sortie renseignée) sont nécessaires pour proposer une série.")
+            return
+
+        propositions, nombre_essais, bornes = resultat
+        st.caption(f"{nombre_essais} essais utilisés — domaine exploré : coagulant 0–{bornes[0][1]:.1f} ppm, floculant 0–{bornes[1][1]:.2f} ppm")
+        st.dataframe(propositions, use_container_width=True)
+
+        if st.button("➕ Ajouter cette série aux essais", key=f"bo_ajouter_{combinaison}"):
+            tableau = st.session_state.tableau_essais[combinaison]
+            place = 20 - len(tableau)
+            if place <= 0:
+                st.warning("Le nombre maximal de 20 essais est déjà atteint pour cette combinaison.")
+                return
+            nouveaux = creer_tableau_essais(
+                propositions['Coag (ppm com.)'].to_numpy()[:place], propositions['Floc (ppm com.)'].to_numpy()[:place],
+                coagulant_info, floculant_info, volume_echantillon, caracteristiques
+            )
+            nouveaux['Essai'] += len(tableau)
+            st.session_state.tableau_essais[combinaison] = pd.concat([tableau, nouveaux], ignore_index=True)
+            st.session_state.nombre_essais_par_combinaison[combinaison] = len(st.session_state.tableau_essais[combinaison])
+            st.session_state.pop(f"nb_essais_{combinaison}", None)
+            st.session_state.pop(cle_resultat, None)
+            st.rerun()
+
+# Champs importables : (alias de colonnes reconnus, valeur minimale, valeur maximale)
+CHAMPS_IMPORT = {
+    'Coagulant_ppm_com': (["coagulant", "coag", "dose coagulant"], 0.0, 10000.0),
+    'Floculant_ppm_com': (["floculant", "floc", "dose floculant"], 0.0, 1000.0),
+    'DCO_entree': (["dco entree", "dco e", "cod in"], 0.0, 100000.0),
+    'DCO_sortie': (["dco sortie", "dco s", "dco", "cod", "cod out"], 0.0, 100000.0),
+    'pH_entree': (["ph entree", "ph e", "ph in"], 0.0, 14.0),
+    'pH_sortie': (["ph sortie", "ph s", "ph", "ph out"], 0.0, 14.0),
+    'V_boue': (["v boue", "volume boue", "boues", "sludge"], 0.0, 1000.0),
+    'Turbidite_entree': (["turbidite entree", "turbidity in", "ntu in"], 0.0, 10000.0),
+    'Turbidite_sortie': (["turbidite sortie", "turbidite", "turbidity", "ntu"], 0.0, 10000.0),
+    'Couleur_entree': (["couleur entree", "color in"], 0.0, 10000.0),
+    'Couleur_sortie': (["couleur sortie", "couleur", "color"], 0.0, 10000.0),
+    'MES_entree': (["mes entree", "tss in"], 0.0, 100000.0),
+    'MES_sortie': (["mes sortie", "mes", "tss"], 0.0, 100000.0),
+    'UV254_entree': (["uv254 entree", "uv254 in"], 0.0, 10.0),
+    'UV254_sortie': (["uv254 sortie", "uv254", "abs 254"], 0.0, 10.0),
+    'Aluminium_residuel': (["aluminium residuel", "aluminium", "al"], 0.0, 100.0),
+    'Fer_residuel': (["fer residuel", "fer", "fe"], 0.0, 100.0),
+    'Conductivite_entree': (["conductivite entree", "conductivity in"], 0.0, 100000.0),
+    'Conductivite_sortie': (["conductivite sortie", "conductivite", "conductivity"], 0.0, 100000.0),
+}
+ALIAS_CLES_IMPORT = {
+    'Combinaison': ["combinaison", "combination", "serie", "echantillon", "sample"],
+    'Essai': ["essai", "pot", "jar", "becher", "position"],
+}
+
+def normaliser_nom_colonne(nom):
+    """Minuscules, sans accents ni unités ni ponctuation : 'DCO sortie (mg/L)' -> 'dco sortie'"""
+    nom = unicodedata.normalize("NFKD", str(nom)).encode("ascii", "ignore").decode()
+    nom = re.sub(r"\(.*?\)|\[.*?\]", " ", nom.lower())
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", nom).split())
+
+def lire_fichier_instrument(fichier):
+    """Lit un export CSV (séparateur et virgule décimale détectés) ou Excel (.xlsx)"""
+    # Pas de .xls : son lecteur (xlrd) ne fait pas partie des dépendances, l'enregistrer en .xlsx
+    if fichier.name.lower().endswith(".xlsx"):
+        return pd.read_excel(fichier)
+    contenu = fichier.getvalue().decode("utf-8-sig", errors="replace")
+    separateur = ";" if contenu.split("\n", 1)[0].count(";") > contenu.split("\n", 1)[0].count(",") else ","
+    return pd.read_csv(io.StringIO(contenu), sep=separateur, dtype=str)
+
+def proposer_correspondance(colonnes):
+    """Associe automatiquement les colonnes du fichier aux champs de tableau_essais"""
+    normalisees = {normaliser_nom_colonne(c): c for c in colonnes}
+    correspondance = {}
+    utilisees = set()
+    for champ, alias in list(ALIAS_CLES_IMPORT.items()) + [(c, a[0]) for c, a in CHAMPS_IMPORT.items()]:
+        for nom in [normaliser_nom_colonne(champ)] + alias:
+            colonne = normalisees.get(nom)
+            if colonne is not None and colonne not in utilisees:
+                correspondance[champ] = colonne
+                utilisees.add(colonne)
+                break
+    return correspondance
+
+def convertir_numerique(serie):
+    """Conversion vectorisée acceptant la virgule décimale ; les cellules vides restent NaN"""
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(float)
+    texte = serie.astype(str).str.strip().str.replace("\u00a0", "", regex=False).str.replace(",", ".", regex=False)
+    return pd.to_numeric(texte.replace({"": np.nan, "nan": np.nan, "None": np.nan}), errors="coerce")
+
+def valider_import(brut, correspondance, combinaisons, combinaison_defaut=None):
+    """Valide l'import en une passe vectorisée ; renvoie (valeurs valides, anomalies)"""
+    anomalies = []
+    valeurs = pd.DataFrame(index=brut.index)
+
+    if 'Combinaison' in correspondance:
+        noms = brut[correspondance['Combinaison']].astype(str).str.strip()
+        reference = {c.lower(): c for c in combinaisons}
+        valeurs['Combinaison'] = noms.str.lower().map(reference)
+        inconnues = valeurs['Combinaison'].isna()
+        anomalies.append(pd.DataFrame({'Ligne': brut.index[inconnues] + 2, 'Champ': 'Combinaison',
+                                       'Valeur': noms[inconnues], 'Problème': "Combinaison absente de la session"}))
+    else:
+        valeurs['Combinaison'] = combinaison_defaut
+
+    essais = convertir_numerique(brut[correspondance['Essai']])
+    essai_invalide = essais.isna() | (essais < 1) | (essais > 20) | (essais % 1 != 0)
+    anomalies.append(pd.DataFrame({'Ligne': brut.index[essai_invalide] + 2, 'Champ': 'Essai',
+                                   'Valeur': brut[correspondance['Essai']][essai_invalide].astype(str),
+                                   'Problème': "Numéro d'essai attendu entre 1 et 20"}))
+    valeurs['Essai'] = essais
+
+    for champ, (_, minimum, maximum) in CHAMPS_IMPORT.items():
+        if champ not in correspondance:
+            continue
+        source = brut[correspondance[champ]]
+        nombres = convertir_numerique(source)
+        non_numerique = nombres.isna() & source.notna() & (source.astype(str).str.strip() != "")
+        hors_plage = nombres.notna() & ((nombres < minimum) | (nombres > maximum))
+        for masque, probleme in ((non_numerique, "Valeur non numérique"), (hors_plage, f"Hors plage [{minimum:g} ; {maximum:g}]")):
+            anomalies.append(pd.DataFrame({'Ligne': brut.index[masque] + 2, 'Champ': champ,
+                                           'Valeur': source[masque].astype(str), 'Problème': probleme}))
+        valeurs[champ] = nombres.where(~hors_plage)
+
+    lignes_valides = valeurs['Combinaison'].notna() & ~essai_invalide
+    valeurs = valeurs[lignes_valides].copy()
+    valeurs['Essai'] = valeurs['Essai'].astype(int)
+    doublons = valeurs.duplicated(['Combinaison', 'Essai'], keep='last')
+    if doublons.any():
+        anomalies.append(pd.DataFrame({'Ligne': valeurs.index[doublons] + 2, 'Champ': 'Essai',
+                                       'Valeur': valeurs['Essai'][doublons].astype(str),
+                                       'Problème': "Doublon : la dernière ligne est conservée"}))
+        valeurs = valeurs[~doublons]
+
+    anomalies = pd.concat(anomalies, ignore_index=True).sort_values('Ligne', kind='stable').reset_index(drop=True)
+    return valeurs, anomalies
+
+def appliquer_import(valeurs, coagulants_config, floculants_config, volume_echantillon, caracteristiques):
+    """Reporte les valeurs importées dans tableau_essais et recalcule volumes et abattement"""
+    for combinaison, groupe in valeurs.groupby('Combinaison'):
+        coagulant_nom, floculant_nom = extraire_reactifs_combinaison(combinaison)
+        coagulant_info = next((c for c in coagulants_config if c["nom"] == coagulant_nom), coagulants_config[0])
+        floculant_info = next((f for f in floculants_config if f["nom"] == floculant_nom), floculants_config[0])
+
+        tableau = st.session_state.tableau_essais.get(combinaison)
+        if tableau is None:
+            tableau = creer_tableau_essais(np.zeros(0), np.zeros(0), coagulant_info, floculant_info, volume_echantillon, caracteristiques)
+        nombre_essais = max(len(tableau), int(groupe['Essai'].max()))
+        if nombre_essais > len(tableau):
+            ajout = creer_tableau_essais(np.zeros(nombre_essais - len(tableau)), np.zeros(nombre_essais - len(tableau)),
+                                         coagulant_info, floculant_info, volume_echantillon, caracteristiques)
+            ajout['Essai'] += len(tableau)
+            tableau = pd.concat([tableau, ajout], ignore_index=True)
+
+        # Seules les cellules renseignées dans le fichier remplacent les valeurs existantes
+        lignes = groupe['Essai'].to_numpy() - 1
+        for champ in CHAMPS_IMPORT:
+            if champ in groupe:
+                renseignees = groupe[champ].notna().to_numpy()
+                tableau.loc[lignes[renseignees], champ] = groupe[champ].to_numpy()[renseignees]
+
+        for champ_ppm, champ_ml, reactif in (('Coagulant_ppm_com', 'Coagulant_ml', coagulant_info),
+                                            ('Floculant_ppm_com', 'Floculant_ml', floculant_info)):
+            if reactif['nom'] == "Aucun":
+                tableau[champ_ppm] = 0.0
+                tableau[champ_ml] = 0.0
+            else:
+                volume_ppm = calculer_volume_ppm(reactif['dilution'], reactif['densite'], reactif['matiere_active'])
+                tableau[champ_ml] = calculer_volume_solution_commerciale(tableau[champ_ppm].to_numpy(), volume_ppm, volume_echantillon)
+
+        dco_e = tableau['DCO_entree'].to_numpy(dtype=float)
+        dco_s = tableau['DCO_sortie'].to_numpy(dtype=float)
+        mesure = (dco_e > 0) & (dco_s > 0)
+        tableau['Abattement'] = np.where(mesure, (dco_e - dco_s) / np.where(mesure, dco_e, 1.0) * 100, tableau['Abattement'])
+
+        st.session_state.tableau_essais[combinaison] = tableau
+        st.session_state.nombre_essais_par_combinaison[combinaison] = len(tableau)
+        reinitialiser_saisie_combinaison(combinaison, len(tableau))
+
+def afficher_import_instruments(combinaisons, coagulants_config, floculants_config, volume_echantillon, caracteristiques):
+    """Import des résultats d'instruments (CSV/Excel) dans tableau_essais pour toutes les combinaisons"""
+    with st.expander("📥 Importer les résultats des instruments (CSV / Excel)", expanded=False):
+        fichier = st.file_uploader("Export de l'instrument", type=["csv", "txt", "xlsx"], key="import_fichier")
+        if fichier is None:
+            st.caption("Une ligne par pot : colonnes Combinaison (facultative), Essai, puis les mesures (DCO sortie, pH sortie, Turbidité…).")
+            return
+        try:
+            brut = lire_fichier_instrument(fichier)
+        except ImportError:
+            st.error("La lecture des fichiers Excel nécessite le paquet openpyxl (pip install openpyxl).")
+            return
+        except Exception as e:
+            st.error(f"Fichier illisible : {e}")
+            return
+        if brut.empty:
+            st.warning("Le fichier ne contient aucune ligne.")
+            return
+
+        st.dataframe(brut.head(10), use_container_width=True)
+        proposition = proposer_correspondance(brut.columns)
+        options = ["—"] + list(brut.columns)
+        correspondance = {}
+        champs = list(ALIAS_CLES_IMPORT) + list(CHAMPS_IMPORT)
+        cols = st.columns(4)
+        for index, champ in enumerate(champs):
+            with cols[index % 4]:
+                colonne = st.selectbox(champ, options, index=options.index(proposition.get(champ, "—")), key=f"import_map_{champ}")
+            if colonne != "—":
+                correspondance[champ] = colonne
+
+        combinaison_defaut = None
+        if 'Combinaison' not in correspondance:
+            combinaison_defaut = st.selectbox("Combinaison des lignes importées", combinaisons, key="import_combinaison")
+        if 'Essai' not in correspondance:
+            st.warning("Associez une colonne au numéro d'essai.")
+            return
+
+        valeurs, anomalies = valider_import(brut, correspondance, combinaisons, combinaison_defaut)
+        st.write(f"**{len(valeurs)} pots valides** sur {len(brut)} lignes, {valeurs['Combinaison'].nunique()} combinaison(s)")
+        if not anomalies.empty:
+            st.warning(f"{len(anomalies)} anomalie(s) : les valeurs concernées sont ignorées")
+            st.dataframe(anomalies, use_container_width=True)
+
+        if st.button("📥 Importer dans le tableau de saisie", key="import_appliquer", disabled=valeurs.empty):
+            appliquer_import(valeurs, coagulants_config, floculants_config, volume_echantillon, caracteristiques)
+            st.success(f"{len(valeurs)} pots importés.")
+            st.rerun()
+
+# Réponses attendues régulières en fonction de la dose : (tolérance absolue, tolérance relative) d'un écart normal
+CHAMPS_TENDANCE = {
+    'DCO_sortie': (10.0, 0.15),
+    'pH_sortie': (0.3, 0.0),
+    'V_boue': (5.0, 0.15),
+    'Turbidite_sortie': (1.0, 0.15),
+    'Couleur_sortie': (5.0, 0.15),
+    'MES_sortie': (5.0, 0.15),
+    'UV254_sortie': (0.02, 0.15),
+}
+CHAMPS_EAU_BRUTE = {
+    'DCO_entree': 'dco_entree',
+    'pH_entree': 'ph_entree',
+    'Turbidite_entree': 'turbidite_entree',
+    'Couleur_entree': 'couleur_entree',
+    'MES_entree': 'mes_entree',
+    'UV254_entree': 'uv254_entree',
+    'Conductivite_entree': 'conductivite_entree',
+}
+SEUIL_ANOMALIE = 4.0
+
+def scores_tendance(x, y, tolerance_absolue, tolerance_relative):
+    """Écart de chaque point à l'interpolation linéaire de ses voisins de dose (extrapolation aux extrémités)"""
+    gauche = np.clip(np.arange(len(x)) - 1, 0, None)
+    droite = np.clip(np.arange(len(x)) + 1, None, len(x) - 1)
+    gauche[0], droite[0] = 1, 2
+    gauche[-1], droite[-1] = len(x) - 3, len(x) - 2
+    poids = (x - x[gauche]) / np.where(x[droite] != x[gauche], x[droite] - x[gauche], np.inf)
+    prediction = y[gauche] + poids * (y[droite] - y[gauche])
+    # Une extrapolation est moins sûre qu'une interpolation : l'écart est rapporté à l'erreur de prédiction
+    erreur_prediction = np.sqrt(1 + (1 - poids) ** 2 + poids ** 2)
+    tolerance = np.maximum(tolerance_absolue, tolerance_relative * np.abs(prediction))
+    return np.abs(y - prediction) / (tolerance * erreur_prediction), prediction
+
+def ecarts_tendance(x, y, tolerance_absolue, tolerance_relative):
+    """Scores des points aberrants de la tendance dose-réponse, retirés un à un tant qu'il en reste"""
+    scores = np.zeros(len(y))
+    predictions = np.full(len(y), np.nan)
+    actifs = np.ones(len(y), dtype=bool)
+    while actifs.sum() >= 4:
+        indices = np.flatnonzero(actifs)
+        score, prediction = scores_tendance(x[indices], y[indices], tolerance_absolue, tolerance_relative)
+        if score.max() <= SEUIL_ANOMALIE:
+            break
+        # Une faute de frappe fausse aussi la prédiction de ses voisins : on retire le point dont
+        # l'absence rend le reste de la série le plus régulier, plutôt que le score le plus élevé
+        residuel = [
+            scores_tendance(np.delete(x[indices], k), np.delete(y[indices], k), tolerance_absolue, tolerance_relative)[0].sum()
+            for k in range(len(indices))
+        ]
+        aberrant = int(np.argmin(np.where(score > SEUIL_ANOMALIE, residuel, np.inf)))
+        scores[indices[aberrant]] = score[aberrant]
+        predictions[indices[aberrant]] = prediction[aberrant]
+        actifs[indices[aberrant]] = False
+    return scores, predictions
+
+def detecter_anomalies(tableau, statistiques_site=None):
+    """Valeurs suspectes d'une combinaison : écarts à la tendance dose-réponse, à l'historique du site et incohérences"""
+    anomalies = []
+    essais = tableau['Essai'].to_numpy()
+
+    # Axe de dose : la dose qui varie ; si les deux varient, le rang des couples (coagulant, floculant)
+    coag = tableau['Coagulant_ppm_com'].to_numpy(dtype=float)
+    floc = tableau['Floculant_ppm_com'].to_numpy(dtype=float)
+    if np.ptp(coag) > 0 and np.ptp(floc) > 0:
+        dose = np.argsort(np.lexsort((floc, coag))).astype(float)
+    else:
+        dose = coag if np.ptp(coag) > 0 else floc
+
+    for champ, tolerances in CHAMPS_TENDANCE.items():
+        valeurs = tableau[champ].to_numpy(dtype=float)
+        saisis = np.flatnonzero(valeurs > 0)
+        if len(saisis) < 4 or np.ptp(dose[saisis]) == 0:
+            continue
+        ordre = saisis[np.argsort(dose[saisis], kind='stable')]
+        x = dose[ordre]
+        if len(np.unique(x)) < len(x):
+            x = np.arange(len(x), dtype=float)
+        scores, predictions = ecarts_tendance(x, valeurs[ordre], *tolerances)
+        for k in np.flatnonzero(scores > 0):
+            anomalies.append({'Essai': essais[ordre[k]], 'Champ': champ, 'Valeur': valeurs[ordre[k]],
+                              'Attendu': predictions[k], 'Score': scores[k], 'Motif': "Écart à la tendance dose-réponse"})
+
+    if statistiques_site is not None and not statistiques_site.empty:
+        colonnes = [c for c, p in CHAMPS_EAU_BRUTE.items() if p in statistiques_site.index]
+        stats = statistiques_site.loc[[CHAMPS_EAU_BRUTE[c] for c in colonnes]]
+        valeurs = tableau[colonnes].to_numpy(dtype=float)
+        moyennes = stats['moyenne'].to_numpy()
+        echelles = np.maximum(stats['ecart_type'].to_numpy(), 0.05 * np.abs(moyennes))
+        z = np.abs(valeurs - moyennes) / np.where(echelles > 0, echelles, np.inf)
+        suspects = (valeurs > 0) & (z > SEUIL_ANOMALIE) & (stats['nombre'].to_numpy() >= 5)
+        # Les caractéristiques de l'eau brute sont communes aux essais : une valeur répétée n'est signalée qu'une fois
+        suspects &= ~pd.DataFrame(valeurs).duplicated().to_numpy()[:, None] | (np.arange(len(valeurs)) == 0)[:, None]
+        for i, j in zip(*np.nonzero(suspects)):
+            anomalies.append({'Essai': essais[i], 'Champ': colonnes[j], 'Valeur': valeurs[i, j], 'Attendu': moyennes[j],
+                              'Score': z[i, j], 'Motif': f"Inhabituel pour le site ({int(stats['nombre'].iloc[j])} mesures sur 90 jours)"})
+
+    dco_e = tableau['DCO_entree'].to_numpy(dtype=float)
+    dco_s = tableau['DCO_sortie'].to_numpy(dtype=float)
+    for i in np.flatnonzero((dco_e > 0) & (dco_s > 1.5 * dco_e)):
+        anomalies.append({'Essai': essais[i], 'Champ': 'DCO_sortie', 'Valeur': dco_s[i], 'Attendu': dco_e[i],
+                          'Score': dco_s[i] / dco_e[i], 'Motif': "DCO sortie supérieure à 1,5 × DCO entrée"})
+    for champ in ('pH_entree', 'pH_sortie'):
+        valeurs = tableau[champ].to_numpy(dtype=float)
+        for i in np.flatnonzero(valeurs > 14):
+            anomalies.append({'Essai': essais[i], 'Champ': champ, 'Valeur': valeurs[i], 'Attendu': np.nan,
+                              'Score': np.nan, 'Motif': "pH hors de l'échelle 0–14"})
+
+    if not anomalies:
+        return pd.DataFrame()
+    anomalies = pd.DataFrame(anomalies).drop_duplicates(['Essai', 'Champ'])
+    return anomalies.sort_values(['Essai', 'Champ']).round(3).reset_index(drop=True)
+
+def calculer_consommation_annuelle(ppm_commercial, densite, matiere_active, prix_kg, debit_annuel):
+    """Calcule le volume (L/an), les masses commerciale et active (kg/an) et le coût (€/an) d'un réactif"""
+    # 1 ppm = 1 g de produit commercial par m³ : g/an -> kg/an. La matière active et la dilution n'interviennent
+    # pas ici : elles servent seulement à convertir les mL dosés en ppm (calculer_volume_ppm)
+    masse_commerciale = ppm_commercial * debit_annuel / 1000
+    masse_active = masse_commerciale * matiere_active / 100
+    volume_l = masse_commerciale / np.where(np.asarray(densite, dtype=float) > 0, densite, np.nan)
+    cout = masse_commerciale * prix_kg
+    return volume_l, masse_commerciale, masse_active, cout
+
+def caracteristiques_reactif(reactif):
+    """Retourne (densite, matiere_active, prix_kg) d'un réactif du catalogue"""
+    return reactif['densite'], reactif['matiere_active'], reactif['prix_kg']
+
+def optimiser_cout_reactifs(tableau_essais, coagulants_config, floculants_config, debit_annuel, objectif, cible):
+    """Calcule pour chaque combinaison le coût annuel minimal en réactifs atteignant l'objectif"""
+    parametres = OBJECTIFS_OPTIMISATION[objectif]
+    resultats = []
+
+    for combinaison, df in tableau_essais.items():
+        coag_nom, floc_nom = extraire_reactifs_combinaison(combinaison)
+        coag_info = next((c for c in coagulants_config if c["nom"] == coag_nom), coagulants_config[0])
+        floc_info = next((f for f in floculants_config if f["nom"] == floc_nom), floculants_config[0])
+
+        mesures = df[df[parametres["controle"]] > 0]
+        doses_coag = mesures['Coagulant_ppm_com'].to_numpy(dtype=float)
+        doses_floc = mesures['Floculant_ppm_com'].to_numpy(dtype=float)
+        # Coût par m³ traité de chaque essai
+        couts_m3 = (calculer_consommation_annuelle(doses_coag, *caracteristiques_reactif(coag_info), 1.0)[3]
+                    + calculer_consommation_annuelle(doses_floc, *caracteristiques_reactif(floc_info), 1.0)[3])
+
+        optimum = interpoler_dose_objectif(
+            couts_m3, doses_coag, doses_floc,
+            mesures[parametres["colonne"]].to_numpy(dtype=float), cible, parametres["maximiser"]
+        )
+        if optimum is None:
+            resultats.append({'Combinaison': combinaison, 'Objectif atteint': False})
+            continue
+
+        coag_ppm, floc_ppm, cout_m3 = optimum
+        _, _, coag_actif_an, _ = calculer_consommation_annuelle(coag_ppm, *caracteristiques_reactif(coag_info), debit_annuel)
+        _, _, floc_actif_an, _ = calculer_consommation_annuelle(floc_ppm, *caracteristiques_reactif(floc_info), debit_annuel)
+        resultats.append({
+            'Combinaison': combinaison,
+            'Objectif atteint': True,
+            'Coagulant': coag_info['nom'],
+            'Coag (ppm com.)': coag_ppm,
+            'Coag (ppm actif)': calculer_ppm_actif(coag_ppm, coag_info['matiere_active']),
+            'Coag actif (kg/an)': coag_actif_an,
+            'Floculant': floc_info['nom'],
+            'Floc (ppm com.)': floc_ppm,
+            'Floc (ppm actif)': calculer_ppm_actif(floc_ppm, floc_info['matiere_active']),
+            'Floc actif (kg/an)': floc_actif_an,
+            'Coût (€/m³)': cout_m3,
+            'Coût annuel (€/an)': cout_m3 * debit_annuel
+        })
+
+    resultats = pd.DataFrame(resultats)
+    if not resultats.empty and resultats['Objectif atteint'].any():
+        resultats = resultats.sort_values(['Objectif atteint', 'Coût annuel (€/an)'], ascending=[False, True], na_position='last')
+    return resultats.reset_index(drop=True)
+
+def classer_catalogue(masses_actives, catalogue):
+    """Classe tous les produits du catalogue par coût annuel pour des masses actives annuelles données"""
+    produits = [p for p in catalogue if p["nom"] != "Aucun" and p["matiere_active"] > 0]
+    if not produits or not masses_actives:
+        return pd.DataFrame()
+
+    references = list(masses_actives.keys())
+    masses = np.array([masses_actives[r] for r in references], dtype=float)[:, np.newaxis]
+    matiere_active = np.array([p["matiere_active"] for p in produits], dtype=float)[np.newaxis, :]
+    densite = np.array([p["densite"] for p in produits], dtype=float)[np.newaxis, :]
+    prix_kg = np.array([p["prix_kg"] for p in produits], dtype=float)[np.newaxis, :]
+
+    # Une seule passe vectorisée : (combinaisons x produits du catalogue)
+    masse_commerciale = masses / (matiere_active / 100)
+    volume_l = masse_commerciale / densite
+    cout_annuel = masse_commerciale * prix_kg
+
+    classement = pd.DataFrame({
+        'Combinaison': np.repeat(references, len(produits)),
+        'Produit': np.tile([p["nom"] for p in produits], len(references)),
+        'Masse active (kg/an)': np.repeat(masses[:, 0], len(produits)),
+        'Masse commerciale (kg/an)': masse_commerciale.ravel(),
+        'Volume commercial (L/an)': volume_l.ravel(),
+        'Coût annuel (€/an)': cout_annuel.ravel()
+    })
+    # Rang au centime près : deux produits au même prix du kg actif sont ex aequo malgré les arrondis flottants
+    classement['Rang'] = classement['Coût annuel (€/an)'].round(2).groupby(classement['Combinaison']).rank(method='min').astype(int)
+    return classement.sort_values(['Combinaison', 'Rang']).reset_index(drop=True)
+
+def afficher_optimisation_cout(tableau_essais, coagulants_config, floculants_config, debit_annuel):
+    """Affiche l'optimisation du coût des réactifs pour l'objectif choisi"""
+    st.subheader("💶 Optimisation du coût des réactifs")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        objectif = st.selectbox("Objectif de traitement", list(OBJECTIFS_OPTIMISATION.keys()))
+    with col2:
+        valeur_defaut = 80.0 if OBJECTIFS_OPTIMISATION[objectif]["maximiser"] else 1.0
+        cible = st.number_input("Valeur cible", min_value=0.0, value=valeur_defaut, format="%.2f", key=f"cible_{objectif}")
+
+    optimisation = optimiser_cout_reactifs(tableau_essais, coagulants_config, floculants_config, debit_annuel, objectif, cible)
+    if optimisation.empty or not optimisation['Objectif atteint'].any():
+        st.info("Aucune combinaison n'atteint l'objectif avec les essais saisis.")
+        return
+
+    atteintes = optimisation[optimisation['Objectif atteint']].drop(columns=['Objectif atteint'])
+    meilleure = atteintes.iloc[0]
+    st.success(f"Combinaison la plus économique : **{meilleure['Combinaison']}** — {meilleure['Coût annuel (€/an)']:,.2f} €/an ({meilleure['Coût (€/m³)']:.4f} €/m³)")
+    st.dataframe(atteintes.round(4), use_container_width=True)
+
+    non_atteintes = optimisation.loc[~optimisation['Objectif atteint'], 'Combinaison'].tolist()
+    if non_atteintes:
+        st.caption(f"Objectif non atteint pour : {', '.join(non_atteintes)}")
+
+    # Comparaison à matière active égale avec tous les produits du catalogue
+    with st.expander("📚 Équivalence catalogue à matière active égale"):
+        masses_coag = {r['Combinaison']: r['Coag actif (kg/an)'] for _, r in atteintes.iterrows() if r['Coagulant'] != "Aucun"}
+        masses_floc = {r['Combinaison']: r['Floc actif (kg/an)'] for _, r in atteintes.iterrows() if r['Floculant'] != "Aucun"}
+        classement_coag = classer_catalogue(masses_coag, coagulants_config)
+        classement_floc = classer_catalogue(masses_floc, floculants_config)
+        if not classement_coag.empty:
+            st.markdown("**Coagulants**")
+            st.dataframe(classement_coag.round(2), use_container_width=True)
+        if not classement_floc.empty:
+            st.markdown("**Floculants**")
+            st.dataframe(classement_floc.round(2), use_container_width=True)
+
+def projeter_consommation_annuelle(tableau_essais, coagulants_config, floculants_config, debit_annuel):
+    """Projette la consommation et le coût annuels des réactifs pour chaque essai de chaque combinaison"""
+    if not tableau_essais:
+        return pd.DataFrame()
+
+    # Caractéristiques des réactifs, une ligne par combinaison
+    reactifs = []
+    for combinaison in tableau_essais:
+        coag_nom, floc_nom = extraire_reactifs_combinaison(combinaison)
+        coag_info = next((c for c in coagulants_config if c["nom"] == coag_nom), coagulants_config[0])
+        floc_info = next((f for f in floculants_config if f["nom"] == floc_nom), floculants_config[0])
+        reactifs.append((combinaison,) + caracteristiques_reactif(coag_info) + caracteristiques_reactif(floc_info))
+    reactifs = pd.DataFrame(reactifs, columns=[
+        'Combinaison',
+        'coag_densite', 'coag_matiere_active', 'coag_prix_kg',
+        'floc_densite', 'floc_matiere_active', 'floc_prix_kg'
+    ])
+
+    # Table unique de tous les essais de la session, calcul vectorisé
+    essais = pd.concat(tableau_essais, names=['Combinaison', None]).reset_index(level=0)
+    essais = essais[['Combinaison', 'Essai', 'Coagulant_ppm_com', 'Floculant_ppm_com']].merge(reactifs, on='Combinaison', how='left')
+
+    projection = pd.DataFrame({'Combinaison': essais['Combinaison'], 'Essai': essais['Essai'].astype(int)})
+    for prefixe, colonne_ppm in (('Coag', 'Coagulant_ppm_com'), ('Floc', 'Floculant_ppm_com')):
+        cle = prefixe.lower()
+        volume_l, masse_commerciale, masse_active, cout = calculer_consommation_annuelle(
+            essais[colonne_ppm].to_numpy(dtype=float),
+            essais[f'{cle}_densite'].to_numpy(dtype=float),
+            essais[f'{cle}_matiere_active'].to_numpy(dtype=float),
+            essais[f'{cle}_prix_kg'].to_numpy(dtype=float),
+            debit_annuel
+        )
+        projection[f'{prefixe} (ppm com.)'] = essais[colonne_ppm].to_numpy(dtype=float)
+        projection[f'{prefixe} (L/an)'] = volume_l
+        projection[f'{prefixe} commercial (kg/an)'] = masse_commerciale
+        projection[f'{prefixe} actif (kg/an)'] = masse_active
+        projection[f'{prefixe} (€/an)'] = cout
+
+    projection['Total (€/an)'] = projection['Coag (€/an)'] + projection['Floc (€/an)']
+    projection['Coût (€/m³)'] = projection['Total (€/an)'] / debit_annuel if debit_annuel else 0.0
+    return projection
+
+# Critères de sélection du meilleur essai : (libellé, True si plus grand est meilleur, poids par défaut)
+CRITERES_SELECTION = {
+    'abattement': ("Abattement DCO (%)", True, 3.0),
+    'v_boue': ("Volume de boue (mL)", False, 1.0),
+    'aluminium_residuel': ("Aluminium résiduel (mg/L)", False, 1.0),
+    'fer_residuel': ("Fer résiduel (mg/L)", False, 1.0),
+    'ecart_ph': ("Écart au pH cible", False, 1.0),
+    'cout_m3': ("Coût réactifs (€/m³)", False, 1.0),
+}
+
+def proprietes_reactifs(combinaisons, catalogue, position):
+    """Tableaux (volume_ppm, densite, matiere_active, prix_kg) du coagulant (position 0) ou du floculant (1) de chaque combinaison, NaN hors catalogue"""
+    par_nom = {r['nom']: (calculer_volume_ppm(r['dilution'], r['densite'], r['matiere_active']),) + caracteristiques_reactif(r)
+               for r in catalogue}
+    noms = {c: extraire_reactifs_combinaison(c)[position] for c in set(combinaisons)}
+    return np.array([par_nom.get(noms[c], (np.nan,) * 4) for c in combinaisons], dtype=float).reshape(len(combinaisons), 4).T
+
+def calculer_criteres(mesures, coagulants_config, floculants_config, ph_cible=7.0):
+    """Valeurs des critères de sélection pour chaque essai enregistré (NaN si non mesuré)"""
+    criteres = pd.DataFrame(index=mesures.index)
+    for colonne in ('abattement', 'v_boue', 'aluminium_residuel', 'fer_residuel'):
+        valeurs = mesures[colonne].astype(float)
+        criteres[colonne] = valeurs.where(valeurs > 0)
+    ph_sortie = mesures['ph_sortie'].astype(float)
+    criteres['ecart_ph'] = (ph_sortie - ph_cible).abs().where(ph_sortie > 0)
+
+    # Coût au m³ : ppm commerciaux retrouvés à partir des mL dosés, puis coût des réactifs de la combinaison
+    cout = np.zeros(len(mesures))
+    volume_echantillon = mesures['volume_echantillon'].astype(float).where(lambda v: v > 0, 1.0).to_numpy()
+    for position, (colonne_ml, catalogue) in enumerate((('coagulant_ml', coagulants_config), ('floculant_ml', floculants_config))):
+        volume_ppm, densite, matiere_active, prix = proprietes_reactifs(list(mesures['combinaison']), catalogue, position)
+        ml = mesures[colonne_ml].astype(float).to_numpy()
+        ppm = np.where(volume_ppm > 0, ml / volume_echantillon / np.where(volume_ppm > 0, volume_ppm, 1.0), 0.0)
+        cout_reactif = calculer_consommation_annuelle(ppm, densite, matiere_active, prix, 1.0)[3]
+        cout += np.where(ml > 0, cout_reactif, 0.0)
+    criteres['cout_m3'] = cout
+    return criteres
+
+def front_pareto(valeurs):
+    """Masque des essais non dominés (valeurs orientées « plus grand est meilleur », NaN = pire)"""
+    pires = np.nanmin(valeurs, axis=0) - 1
+    valeurs = np.where(np.isnan(valeurs), pires, valeurs)
+    # Un essai ne peut être dominé que par un essai de somme supérieure, et s'il l'est, il l'est aussi par
+    # un essai du front : parcours par somme décroissante en ne comparant qu'au front déjà constitué
+    ordre = np.argsort(-valeurs.sum(axis=1), kind='stable')
+    non_domines = np.zeros(len(valeurs), dtype=bool)
+    front = np.empty((0, valeurs.shape[1]))
+    for index in ordre:
+        ligne = valeurs[index]
+        if not ((front >= ligne).all(axis=1) & (front > ligne).any(axis=1)).any():
+            non_domines[index] = True
+            front = np.vstack((front, ligne))
+    return non_domines
+
+def scorer_essais(mesures, coagulants_config, floculants_config, poids=None, ph_cible=7.0):
+    """Score pondéré (0-100) et appartenance au front de Pareto de chaque essai, du meilleur au moins bon"""
+    poids = poids or {critere: defaut for critere, (_, _, defaut) in CRITERES_SELECTION.items()}
+    criteres = calculer_criteres(mesures, coagulants_config, floculants_config, ph_cible)
+    # Seuls les critères mesurés sur au moins deux valeurs différentes départagent les essais
+    actifs = [c for c in CRITERES_SELECTION if poids.get(c, 0) > 0 and criteres[c].nunique() > 1]
+    resultat = mesures.copy()
+    resultat['ecart_ph'] = criteres['ecart_ph']
+    resultat['cout_m3'] = criteres['cout_m3']
+    if not actifs:
+        resultat['score'] = 100.0
+        resultat['pareto'] = True
+        return resultat.sort_values('abattement', ascending=False)
+
+    orientees = criteres[actifs].to_numpy(dtype=float) * np.array([1.0 if CRITERES_SELECTION[c][1] else -1.0 for c in actifs])
+    minimum, maximum = np.nanmin(orientees, axis=0), np.nanmax(orientees, axis=0)
+    utilites = (orientees - minimum) / np.where(maximum > minimum, maximum - minimum, 1.0)
+    # Critère non mesuré pour un essai : ni avantage ni pénalité (utilité moyenne des autres essais)
+    utilites = np.where(np.isnan(utilites), np.nanmean(utilites, axis=0), utilites)
+    ponderation = np.array([poids[c] for c in actifs], dtype=float)
+    resultat['score'] = utilites @ ponderation / ponderation.sum() * 100
+    resultat['pareto'] = front_pareto(orientees)
+    return resultat.sort_values(['score', 'abattement'], ascending=False)
+
+def poids_selection():
+    """Pondération choisie dans l'onglet Résultats (défauts sinon)"""
+    return {critere: st.session_state.get(f"poids_{critere}", defaut) for critere, (_, _, defaut) in CRITERES_SELECTION.items()}
+
+def tableau_selection(scores, nombre=None):
+    """Vue lisible des essais classés : combinaison, essai, score, front de Pareto et critères"""
+    vue = scores[['combinaison', 'essai', 'score', 'pareto'] + list(CRITERES_SELECTION)]
+    if nombre:
+        vue = vue.head(nombre)
+    vue = vue.rename(columns={c: libelle for c, (libelle, _, _) in CRITERES_SELECTION.items()})
+    return vue.rename(columns={'combinaison': "Combinaison", 'essai': "Essai", 'score': "Score", 'pareto': "Pareto"}).round(3)
 
-def calculer_ppm_actif(ppm_commercial, matiere_active):
-    """Calcule les ppm actifs à partir des ppm commerciaux"""
-    return ppm_commercial * (matiere_active / 100)
+def afficher_selection_multicritere(mesures_courantes, db_manager, coagulants_config, floculants_config, site_prelevement):
+    """Classement multicritère des essais de la session et comparaison avec l'historique du site"""
+    st.subheader("🏆 Sélection multicritère du meilleur essai")
+    with st.expander("⚖️ Pondération des critères", expanded=False):
+        cols = st.columns(3)
+        for index, (critere, (libelle, plus_grand, defaut)) in enumerate(CRITERES_SELECTION.items()):
+            with cols[index % 3]:
+                st.slider(f"{libelle} ({'max' if plus_grand else 'min'})", 0.0, 5.0, defaut, 0.5, key=f"poids_{critere}")
+        st.number_input("pH cible", min_value=0.0, max_value=14.0, value=7.0, step=0.1, key="ph_cible")
 
-def calculer_volume_solution_commerciale(ppm_commercial, volume_ppm, volume_eau_l=1.0):
-    """Calcule le volume de solution commerciale pure"""
-    return ppm_commercial * volume_ppm * volume_eau_l
+    poids = poids_selection()
+    ph_cible = st.session_state.get("ph_cible", 7.0)
+    scores = scorer_essais(mesures_courantes, coagulants_config, floculants_config, poids, ph_cible)
+    meilleur = scores.iloc[0]
+    st.success(f"Meilleur compromis : **{meilleur['combinaison']}**, essai {int(meilleur['essai'])} — score {meilleur['score']:.1f}/100, "
+               f"abattement {meilleur['abattement']:.1f} %")
+    st.caption(f"{int(scores['pareto'].sum())} essai(s) sur le front de Pareto (aucun autre essai n'est meilleur sur tous les critères à la fois)")
+    st.dataframe(tableau_selection(scores), use_container_width=True)
+
+    historique = db_manager.get_mesures_site(site_prelevement)
+    if historique[['date_test', 'operateur']].drop_duplicates().shape[0] > 1 and st.checkbox("Comparer aux sessions précédentes du site", key="selection_historique"):
+        scores_historique = scorer_essais(historique, coagulants_config, floculants_config, poids, ph_cible)
+        # Meilleur essai de chaque session, classé sur l'ensemble de l'historique du site
+        meilleurs = scores_historique.drop_duplicates(['date_test', 'operateur', 'site_prelevement'])
+        st.dataframe(tableau_selection(meilleurs, 10).assign(Date=meilleurs['date_test'].head(10).to_numpy()), use_container_width=True)
 
 def generer_rapport_html(date_test, operateur, site_prelevement, type_eau, volume_echantillon, 
                        temps_coagulation, vitesse_coagulation, temps_floculation, vitesse_floculation,
                        caracteristiques, debit_eau, debit_annuel, meilleur_abattement, coagulants_config, floculants_config,
-                       tableau_essais):
+                       tableau_essais, selection=None):
     """Génère un rapport HTML avec les informations actuelles et les tableaux des essais"""
     
     # Calcul du volume journalier
@@ -467,7 +3621,65 @@ def generer_rapport_html(date_test, operateur, site_prelevement, type_eau, volum
         </table>
     </div>
 """
+
+    if selection is not None and not selection.empty:
+        vue = tableau_selection(selection)
+        rapport_html += """
+    <div class="section">
+        <h2>⚖️ Classement multicritère des essais</h2>
+        <table>
+            <tr>""" + "".join(f"<th>{colonne}</th>" for colonne in vue.columns) + "</tr>\n"
+        for _, ligne in vue.iterrows():
+            cellules = []
+            for colonne, valeur in ligne.items():
+                if colonne == "Pareto":
+                    cellules.append("✓" if valeur else "")
+                elif isinstance(valeur, float):
+                    cellules.append("" if np.isnan(valeur) else f"{valeur:.2f}")
+                else:
+                    cellules.append(str(valeur))
+            rapport_html += "            <tr>" + "".join(f"<td>{c}</td>" for c in cellules) + "</tr>\n"
+        rapport_html += """        </table>
+        <p>Score pondéré sur 100 ; ✓ : essai du front de Pareto.</p>
+    </div>
+"""
     
+    projection = projeter_consommation_annuelle(tableau_essais, coagulants_config, floculants_config, debit_annuel)
+    if not projection.empty:
+        rapport_html += """
+    <div class="section">
+        <h2>💶 Projection annuelle des réactifs</h2>
+        <table>
+            <tr>
+                <th>Combinaison</th>
+                <th>Essai</th>
+                <th>Coag (kg/an)</th>
+                <th>Coag actif (kg/an)</th>
+                <th>Coag (€/an)</th>
+                <th>Floc (kg/an)</th>
+                <th>Floc actif (kg/an)</th>
+                <th>Floc (€/an)</th>
+                <th>Total (€/an)</th>
+                <th>€/m³</th>
+            </tr>
+"""
+        for _, ligne in projection.iterrows():
+            rapport_html += f"""
+            <tr>
+                <td>{ligne['Combinaison']}</td>
+                <td>{ligne['Essai']}</td>
+                <td>{ligne['Coag commercial (kg/an)']:,.1f}</td>
+                <td>{ligne['Coag actif (kg/an)']:,.1f}</td>
+                <td>{ligne['Coag (€/an)']:,.2f}</td>
+                <td>{ligne['Floc commercial (kg/an)']:,.1f}</td>
+                <td>{ligne['Floc actif (kg/an)']:,.1f}</td>
+                <td>{ligne['Floc (€/an)']:,.2f}</td>
+                <td>{ligne['Total (€/an)']:,.2f}</td>
+                <td>{ligne['Coût (€/m³)']:.4f}</td>
+            </tr>
+"""
+        rapport_html += "        </table>\n    </div>\n"
+
     if tableau_essais:
         rapport_html += """
     <div class="section">
@@ -566,6 +3778,9 @@ def afficher_tableaux_resultats(mesures_courantes):
 
 def configurer_reactifs():
     st.markdown('<h2 class="section-header">⚗️ Configuration des Réactifs</h2>', unsafe_allow_html=True)
+    if 'conflit_configuration' in st.session_state:
+        st.warning(f"{st.session_state.pop('conflit_configuration')} a été modifié depuis un autre poste pendant l'enregistrement : "
+                   "la configuration a été rechargée, refaites la modification.")
     
     config_manager = ConfigManager()
     
@@ -820,48 +4035,391 @@ def configurer_reactifs():
             config_manager.save_parametres(config_parametres)
             st.success("Configuration des paramètres enregistrée!")
 
-def afficher_base_donnees():
-    st.markdown('<h2 class="section-header">📊 Base de Données des Mesures</h2>', unsafe_allow_html=True)
-    
-    db_manager = DatabaseManager()
-    mesures = db_manager.get_all_mesures()
-    
-    if mesures.empty:
-        st.info("Aucune mesure enregistrée dans la base de données.")
-    else:
-        st.write(f"**Total des mesures :** {len(mesures)}")
-        
-        # Filtres
+LIBELLES_EAU_BRUTE = {
+    'turbidite_entree': "Turbidité (NTU)",
+    'couleur_entree': "Couleur",
+    'ph_entree': "pH",
+    'conductivite_entree': "Conductivité (µS/cm)",
+    'mes_entree': "MES (mg/L)",
+    'uv254_entree': "UV254",
+    'dco_entree': "DCO (mg/L)"
+}
+
+def reduire_serie(serie, max_points):
+    """Regroupe les périodes consécutives pour afficher au plus max_points (moyenne pondérée, extrêmes conservés)"""
+    if len(serie) <= max_points:
+        return serie
+    groupes = np.arange(len(serie)) // math.ceil(len(serie) / max_points)
+    reduite = serie.assign(somme=serie['moyenne'] * serie['nombre']).groupby(groupes).agg(
+        debut=('debut', 'first'), nombre=('nombre', 'sum'), somme=('somme', 'sum'),
+        minimum=('minimum', 'min'), maximum=('maximum', 'max')
+    )
+    reduite['moyenne'] = reduite['somme'] / reduite['nombre']
+    return reduite.drop(columns='somme').reset_index(drop=True)
+
+def afficher_series_eau_brute(db_manager, max_points=400):
+    """Évolution des caractéristiques de l'eau brute d'un site (agrégats journaliers ou hebdomadaires)"""
+    sites = db_manager.get_sites_eau_brute()
+    if not sites:
+        return
+    with st.expander("📈 Évolution de l'eau brute par site", expanded=False):
         col1, col2, col3 = st.columns(3)
         with col1:
-            dates_uniques = mesures['date_test'].unique()
-            date_filtre = st.selectbox("Filtrer par date", ["Toutes"] + list(dates_uniques))
+            site = st.selectbox("Site", sites, key="serie_site")
         with col2:
-            sites_uniques = mesures['site_prelevement'].unique()
-            site_filtre = st.selectbox("Filtrer par site", ["Tous"] + list(sites_uniques))
+            parametre = st.selectbox("Paramètre", list(LIBELLES_EAU_BRUTE), format_func=LIBELLES_EAU_BRUTE.get, key="serie_parametre")
         with col3:
-            combinaisons_uniques = mesures['combinaison'].unique()
-            combinaison_filtre = st.selectbox("Filtrer par combinaison", ["Toutes"] + list(combinaisons_uniques))
-        
-        # Application des filtres
-        if date_filtre != "Toutes":
-            mesures = mesures[mesures['date_test'] == date_filtre]
-        if site_filtre != "Tous":
-            mesures = mesures[mesures['site_prelevement'] == site_filtre]
-        if combinaison_filtre != "Toutes":
-            mesures = mesures[mesures['combinaison'] == combinaison_filtre]
-        
-        st.dataframe(mesures, use_container_width=True)
-        
-        # Export des données
-        csv = mesures.to_csv(index=False)
+            periode = st.radio("Période", ["jour", "semaine"], horizontal=True, key="serie_periode")
+
+        serie = db_manager.get_serie_eau_brute(site, parametre, periode)
+        if serie.empty:
+            st.info("Aucune valeur renseignée pour ce paramètre sur ce site.")
+            return
+        affichee = reduire_serie(serie, max_points)
+
+        fig = go.Figure([
+            go.Scatter(x=affichee['debut'], y=affichee['maximum'], mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'),
+            go.Scatter(x=affichee['debut'], y=affichee['minimum'], mode='lines', line=dict(width=0), fill='tonexty',
+                       fillcolor='rgba(31, 119, 180, 0.2)', name="Min – max"),
+            go.Scatter(x=affichee['debut'], y=affichee['moyenne'], mode='lines+markers' if len(affichee) < 60 else 'lines',
+                       line=dict(color='#1f77b4'), name="Moyenne")
+        ])
+        fig.update_layout(title=f"{LIBELLES_EAU_BRUTE[parametre]} — {site}", xaxis_title="Date",
+                          yaxis_title=LIBELLES_EAU_BRUTE[parametre], height=400, margin=dict(t=50, b=30))
+        st.plotly_chart(fig, use_container_width=True)
+        st.caption(f"{int(serie['nombre'].sum())} sessions sur {len(serie)} {periode}s"
+                   + (f", regroupées en {len(affichee)} points" if len(affichee) < len(serie) else ""))
+
+LIBELLES_HISTORIQUE = {
+    'abattement': "Abattement DCO (%)",
+    'dco_sortie': "DCO sortie (mg/L)",
+    'v_boue': "Volume de boue (mL)",
+    'ph_sortie': "pH sortie",
+    'turbidite_sortie': "Turbidité sortie (NTU)",
+    'couleur_sortie': "Couleur sortie",
+    'mes_sortie': "MES sortie (mg/L)",
+    'uv254_sortie': "UV254 sortie",
+    'aluminium_residuel': "Aluminium résiduel (mg/L)",
+    'fer_residuel': "Fer résiduel (mg/L)",
+    'conductivite_sortie': "Conductivité sortie (µS/cm)"
+}
+# Au-delà, le tracé passe en WebGL (Scattergl) plutôt qu'en SVG
+SEUIL_WEBGL = 1000
+
+def afficher_historique_essais(db_manager, max_points=2000):
+    """Historique des essais d'un site, réduit côté serveur et affiné sur la plage de dates sélectionnée"""
+    sites = db_manager.get_sites_eau_brute()
+    if not sites:
+        return
+    with st.expander("📉 Historique des essais par site", expanded=False):
+        col1, col2 = st.columns(2)
+        with col1:
+            site = st.selectbox("Site", sites, key="historique_site")
+        with col2:
+            colonne = st.selectbox("Mesure", list(LIBELLES_HISTORIQUE), format_func=LIBELLES_HISTORIQUE.get, key="historique_colonne")
+
+        # Plage affichée en détail, propre au site ; le compteur renouvelle la clé du graphique (et donc sa sélection)
+        plage = st.session_state.get('historique_plage')
+        if plage is not None and plage['site'] != site:
+            plage = None
+        numero = st.session_state.setdefault('historique_numero', 0)
+
+        historique, nombre = db_manager.get_historique_essais(
+            site, colonne, plage['debut'] if plage else None, plage['fin'] if plage else None, max_points
+        )
+        if historique.empty:
+            st.info("Aucune valeur renseignée pour cette mesure sur ce site.")
+        else:
+            reduit = len(historique) < nombre
+            trace = go.Scattergl if len(historique) > SEUIL_WEBGL else go.Scatter
+            fig = go.Figure(trace(
+                x=historique['date_test'], y=historique['valeur'], mode='lines' if reduit else 'markers',
+                line=dict(color='#1f77b4', width=1), marker=dict(color='#1f77b4', size=5), name=LIBELLES_HISTORIQUE[colonne]
+            ))
+            fig.update_layout(title=f"{LIBELLES_HISTORIQUE[colonne]} — {site}", xaxis_title="Date", yaxis_title=LIBELLES_HISTORIQUE[colonne],
+                              height=400, margin=dict(t=50, b=30), dragmode='select', selectdirection='h')
+            evenement = st.plotly_chart(fig, use_container_width=True, on_select="rerun", selection_mode="box",
+                                        key=f"historique_graphique_{numero}")
+
+            boites = evenement.selection.box if evenement else []
+            if boites:
+                debut, fin = sorted(pd.to_datetime(x).date() for x in boites[0]['x'])
+                st.session_state.historique_plage = {'site': site, 'debut': debut.isoformat(), 'fin': fin.isoformat()}
+                st.session_state.historique_numero = numero + 1
+                st.rerun()
+
+            st.caption(f"{nombre} essais"
+                       + (f" du {plage['debut']} au {plage['fin']}" if plage else "")
+                       + (f", réduits à {len(historique)} points (minimum et maximum par intervalle)" if reduit else "")
+                       + (" — tracé WebGL" if trace is go.Scattergl else "")
+                       + ". Sélectionnez une plage de dates sur le graphique pour l'afficher en détail.")
+        if plage and st.button("↩️ Historique complet", key="historique_complet"):
+            st.session_state.historique_plage = None
+            st.session_state.historique_numero = numero + 1
+            st.rerun()
+
+INDICATEURS_COMPARAISON = {
+    'meilleur_abattement': "Meilleur abattement (%)",
+    'abattement_median': "Abattement médian des optimums (%)",
+    'dose_coagulant': "Dose efficace coagulant (ppm com.)",
+    'dose_floculant': "Dose efficace floculant (ppm com.)",
+    'cout_m3': "Coût (€/m³)",
+    'nombre_sessions': "Jar tests",
+    'nombre_essais': "Essais"
+}
+REGROUPEMENTS_COMPARAISON = {'site_prelevement': "Site", 'type_eau': "Type d'eau"}
+
+def mediane_ponderee(valeurs, poids):
+    """Médiane de valeurs pondérées (NaN ignorés)"""
+    valeurs = np.asarray(valeurs, dtype=float)
+    poids = np.asarray(poids, dtype=float)
+    masque = ~np.isnan(valeurs)
+    if not masque.any():
+        return np.nan
+    ordre = np.argsort(valeurs[masque])
+    cumul = np.cumsum(poids[masque][ordre])
+    return valeurs[masque][ordre][np.searchsorted(cumul, cumul[-1] / 2)]
+
+def synthese_comparaison(agregats, regroupement, coagulants_config, floculants_config):
+    """Indicateurs par site (ou type d'eau) et combinaison sur la période des agrégats mensuels"""
+    groupes = agregats.groupby([regroupement, 'combinaison'], sort=True)
+    synthese = groupes.agg(
+        nombre_sessions=('nombre_sessions', 'sum'), nombre_essais=('nombre_essais', 'sum'),
+        meilleur_abattement=('meilleur_abattement', 'max')
+    )
+    # Les médianes ne se cumulent pas : médiane des médianes mensuelles, pondérées par leur nombre de jar tests
+    for colonne, mediane in (('abattement_median', 'abattement_median'), ('dose_coagulant', 'dose_coagulant_mediane'), ('dose_floculant', 'dose_floculant_mediane')):
+        synthese[colonne] = groupes.apply(lambda g: mediane_ponderee(g[mediane], g['nombre_sessions']), include_groups=False)
+    synthese = synthese.reset_index()
+
+    # Doses en mL par litre d'échantillon -> ppm commerciaux, puis coût au m³ aux prix actuels du catalogue
+    synthese['cout_m3'] = 0.0
+    for position, (colonne, catalogue) in enumerate((('dose_coagulant', coagulants_config), ('dose_floculant', floculants_config))):
+        volume_ppm, densite, matiere_active, prix = proprietes_reactifs(list(synthese['combinaison']), catalogue, position)
+        dose = synthese[colonne].to_numpy(dtype=float)
+        ppm = np.where(volume_ppm > 0, dose / np.where(volume_ppm > 0, volume_ppm, 1.0), np.nan)
+        # Sans réactif dosé, dose et coût sont nuls ; sans volume d'échantillon, ils restent inconnus (NaN)
+        synthese[colonne] = np.where(dose > 0, ppm, dose)
+        synthese['cout_m3'] += np.where(dose == 0, 0.0, calculer_consommation_annuelle(ppm, densite, matiere_active, prix, 1.0)[3])
+    return synthese[[regroupement, 'combinaison'] + list(INDICATEURS_COMPARAISON)]
+
+def afficher_comparaison_sites(db_manager):
+    """Comparaison des combinaisons entre sites ou types d'eau, à partir des agrégats mensuels"""
+    mois, combinaisons = db_manager.get_dimensions_comparaison()
+    if not mois:
+        return
+    with st.expander("🏭 Comparaison multi-sites", expanded=False):
+        col1, col2 = st.columns(2)
+        with col1:
+            selection = st.multiselect("Combinaisons (toutes si vide)", combinaisons, key="comparaison_combinaisons")
+        with col2:
+            regroupement = st.radio("Comparer par", list(REGROUPEMENTS_COMPARAISON), format_func=REGROUPEMENTS_COMPARAISON.get,
+                                    horizontal=True, key="comparaison_regroupement")
+        if len(mois) > 1:
+            debut, fin = st.select_slider("Période", options=mois, value=(mois[0], mois[-1]), key="comparaison_periode")
+        else:
+            debut = fin = mois[0]
+
+        agregats = db_manager.get_comparaison(selection, debut, fin)
+        if agregats.empty:
+            st.info("Aucun essai enregistré pour ces combinaisons sur la période.")
+            return
+        config_manager = ConfigManager()
+        synthese = synthese_comparaison(agregats, regroupement, config_manager.load_coagulants(), config_manager.load_floculants())
+        libelles = {regroupement: REGROUPEMENTS_COMPARAISON[regroupement], 'combinaison': "Combinaison", **INDICATEURS_COMPARAISON}
+
+        fig = go.Figure([
+            go.Bar(x=donnees[regroupement], y=donnees['meilleur_abattement'], name=combinaison)
+            for combinaison, donnees in synthese.groupby('combinaison', sort=False)
+        ])
+        fig.update_layout(barmode='group', title="Meilleur abattement DCO", yaxis_title="Abattement (%)",
+                          height=400, margin=dict(t=50, b=30))
+        st.plotly_chart(fig, use_container_width=True)
+        st.dataframe(synthese.rename(columns=libelles), use_container_width=True, hide_index=True)
+
+        # Tableau croisé et export ne sont construits qu'à la demande
+        if st.toggle("Tableau croisé", key="comparaison_pivot"):
+            indicateur = st.selectbox("Indicateur", list(INDICATEURS_COMPARAISON), format_func=INDICATEURS_COMPARAISON.get, key="comparaison_indicateur")
+            croise = synthese.pivot(index=regroupement, columns='combinaison', values=indicateur)
+            st.dataframe(croise.rename_axis(index=REGROUPEMENTS_COMPARAISON[regroupement], columns=None), use_container_width=True)
         st.download_button(
-            label="📥 Exporter la base de données (CSV)",
-            data=csv,
-            file_name=f"base_donnees_jar_test_{datetime.now().strftime('%Y%m%d')}.csv",
-            mime="text/csv"
+            label="📥 Exporter la comparaison (CSV)",
+            data=lambda: synthese.rename(columns=libelles).to_csv(index=False),
+            file_name=f"comparaison_sites_{debut}_{fin}.csv",
+            mime="text/csv",
+            key="comparaison_export"
         )
 
+LIBELLES_FACETTES = {'site_prelevement': "Site", 'combinaison': "Combinaison", 'operateur': "Opérateur", 'type_eau': "Type d'eau"}
+
+def afficher_recherche_mesures(db_manager, limite=1000):
+    """Recherche à facettes : texte libre, période, plages numériques et facettes comptées en SQL"""
+    texte = st.text_input("🔎 Recherche libre (opérateur, site, réactifs, type d'eau)", key="recherche_texte")
+    annees_archivees = list(db_manager.fichiers_archives())
+    archives = bool(annees_archivees) and st.checkbox(
+        f"Inclure les archives ({annees_archivees[0]}–{annees_archivees[-1]})", key="recherche_archives"
+    )
+    col1, col2 = st.columns(2)
+    with col1:
+        # Bornes de toutes les données, archives comprises : la base courante peut être entièrement archivée
+        premier, dernier = (datetime.strptime(d[:10], "%Y-%m-%d").date() for d in db_manager.get_bornes('date_test', bool(annees_archivees)))
+        periode = st.date_input("Période", value=(premier, dernier), key="recherche_periode")
+    with col2:
+        colonnes = st.multiselect("Filtres numériques", DatabaseManager.COLONNES_NUMERIQUES, key="recherche_colonnes")
+
+    plages = {}
+    for colonne in colonnes:
+        minimum, maximum = db_manager.get_bornes(colonne, archives)
+        col1, col2 = st.columns(2)
+        with col1:
+            bas = st.number_input(f"{colonne} min", value=float(minimum or 0), key=f"recherche_min_{colonne}")
+        with col2:
+            haut = st.number_input(f"{colonne} max", value=float(maximum or 0), key=f"recherche_max_{colonne}")
+        plages[colonne] = (bas, haut)
+
+    # Pendant la saisie d'une plage, date_input ne renvoie que la date de début. Une borne égale à celle de la base
+    # n'est pas transmise : sans filtre de date, SQLite compte les facettes sur leur index couvrant
+    criteres = {
+        'texte': texte,
+        'date_debut': periode[0] if len(periode) > 0 and periode[0] > premier else None,
+        'date_fin': periode[1] if len(periode) > 1 and periode[1] < dernier else None,
+        'plages': plages,
+        'facettes': {facette: st.session_state.get(f"recherche_facette_{facette}", []) for facette in DatabaseManager.FACETTES_RECHERCHE}
+    }
+    facettes = db_manager.compter_facettes(criteres, archives)
+    for col, facette in zip(st.columns(len(facettes)), facettes):
+        comptes = facettes[facette]
+        # Une valeur sélectionnée reste proposée même si les autres critères ne lui laissent aucune mesure
+        options = list(comptes) + [v for v in criteres['facettes'][facette] if v not in comptes]
+        with col:
+            st.multiselect(LIBELLES_FACETTES[facette], options, format_func=lambda v, comptes=comptes: f"{v} ({comptes.get(v, 0)})",
+                           key=f"recherche_facette_{facette}")
+
+    # Pagination côté base : seules les `limite` lignes de la page choisie sont lues
+    page = st.session_state.get("recherche_page", 1)
+    mesures, nombre = db_manager.rechercher_mesures(criteres, limite, archives, (page - 1) * limite)
+    pages = max(math.ceil(nombre / limite), 1)
+    if page > pages:
+        # Critères resserrés depuis le choix de la page : retour à la dernière page existante
+        st.session_state.recherche_page = page = pages
+        mesures, nombre = db_manager.rechercher_mesures(criteres, limite, archives, (page - 1) * limite)
+    st.write(f"**{nombre} mesures trouvées**" + (f" (mesures {(page - 1) * limite + 1} à {min(page * limite, nombre)})" if nombre > limite else ""))
+    if pages > 1:
+        st.number_input(f"Page (sur {pages})", min_value=1, max_value=pages, step=1, key="recherche_page")
+    st.dataframe(mesures, use_container_width=True)
+    
+    # Export des données : toutes les mesures trouvées, lues au clic seulement
+    st.download_button(
+        label="📥 Exporter les mesures trouvées (CSV)",
+        data=lambda: db_manager.rechercher_mesures(criteres, archives=archives)[0].to_csv(index=False),
+        file_name=f"base_donnees_jar_test_{datetime.now().strftime('%Y%m%d')}.csv",
+        mime="text/csv"
+    )
+
+class TacheSauvegarde:
+    """Sauvegarde exécutée dans un thread : la copie par étapes ne bloque pas les reruns"""
+
+    def __init__(self):
+        self.verrou = threading.Lock()
+        self.thread = None
+        self.avancement = 0.0
+        self.resultat = None
+        self.erreur = None
+
+    def en_cours(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def demarrer(self, sauvegarder):
+        with self.verrou:
+            if self.en_cours():
+                return False
+            self.avancement, self.resultat, self.erreur = 0.0, None, None
+            self.thread = threading.Thread(target=self._executer, args=(sauvegarder,), daemon=True)
+            self.thread.start()
+            return True
+
+    def _executer(self, sauvegarder):
+        try:
+            self.resultat = sauvegarder(progression=self._progresser)
+        except Exception as e:
+            self.erreur = str(e)
+
+    def _progresser(self, copiees, total):
+        self.avancement = copiees / total if total else 1.0
+
+@st.cache_resource
+def obtenir_tache_sauvegarde(db_file):
+    """Une seule sauvegarde à la fois par base, partagée entre les sessions"""
+    return TacheSauvegarde()
+
+def afficher_sauvegardes(db_manager):
+    """Instantanés de la base : sauvegarde à chaud en arrière-plan et restauration"""
+    tache = obtenir_tache_sauvegarde(os.path.abspath(db_manager.db_file))
+    with st.expander("🗄️ Sauvegardes", expanded=False):
+        if st.button("💾 Sauvegarder maintenant", disabled=tache.en_cours(), key="sauvegarde_demarrer"):
+            tache.demarrer(db_manager.sauvegarder)
+
+        suivi = tache.en_cours()
+
+        @st.fragment(run_every=1 if suivi else None)
+        def avancement():
+            if tache.en_cours():
+                st.progress(tache.avancement, text=f"Sauvegarde en cours… {tache.avancement:.0%}")
+            elif suivi:
+                # Tâche terminée : rerun complet, qui arrête le rafraîchissement et réactive les boutons
+                st.rerun()
+            elif tache.erreur:
+                st.error(f"Échec de la sauvegarde : {tache.erreur}")
+            elif tache.resultat:
+                st.success(f"Sauvegarde créée : {os.path.basename(tache.resultat)}")
+
+        avancement()
+
+        sauvegardes = db_manager.lister_sauvegardes()
+        if not sauvegardes:
+            st.info("Aucune sauvegarde.")
+            return
+        st.dataframe(pd.DataFrame([{
+            "Date": sauvegarde['date'].strftime("%d/%m/%Y %H:%M:%S"),
+            "Étiquette": sauvegarde['etiquette'],
+            "Taille (Mo)": round(sauvegarde['taille_mo'], 1),
+            "Fichier": os.path.basename(sauvegarde['chemin'])
+        } for sauvegarde in sauvegardes]), use_container_width=True, hide_index=True)
+
+        choix = st.selectbox("Instantané à restaurer", range(len(sauvegardes)), key="sauvegarde_choix",
+                             format_func=lambda i: os.path.basename(sauvegardes[i]['chemin']))
+        confirmation = st.checkbox("Je confirme remplacer la base par cet instantané (l'état actuel est sauvegardé avant)",
+                                   key="sauvegarde_confirmation")
+        if st.button("⏪ Restaurer", disabled=not confirmation or tache.en_cours(), key="sauvegarde_restaurer"):
+            try:
+                securite = db_manager.restaurer(sauvegardes[choix]['chemin'])
+            except sqlite3.Error as e:
+                st.error(f"Échec de la restauration : {e}")
+            else:
+                # L'index des essais similaires est incrémental par id : il est reconstruit sur la base restaurée
+                charger_index_eau_brute.clear()
+                st.success(f"Base restaurée ; état précédent conservé dans {os.path.basename(securite)}")
+
+def afficher_base_donnees():
+    st.markdown('<h2 class="section-header">📊 Base de Données des Mesures</h2>', unsafe_allow_html=True)
+    
+    db_manager = ouvrir_base()
+    total = db_manager.compter_mesures()
+    archivees = db_manager.compter_mesures_archivees()
+    
+    if total == 0 and archivees == 0:
+        st.info("Aucune mesure enregistrée dans la base de données.")
+    else:
+        st.write(f"**Total des mesures :** {total}" + (f" (+ {archivees} archivées)" if archivees else ""))
+
+        afficher_series_eau_brute(db_manager)
+        afficher_historique_essais(db_manager)
+        afficher_comparaison_sites(db_manager)
+        afficher_recherche_mesures(db_manager)
+
+    if db_manager.SAUVEGARDE_LOCALE:
+        afficher_sauvegardes(db_manager)
+
 def main():
     st.markdown('<h1 class="main-header">📊 Générateur de Rapports Jar Test dévellopé par Viveleau</h1>', unsafe_allow_html=True)
     
@@ -878,6 +4436,12 @@ def main():
         st.session_state.tableau_essais = {}
     if 'nombre_essais_par_combinaison' not in st.session_state:
         st.session_state.nombre_essais_par_combinaison = {}
+
+    # Essais enregistrés par jar_test1.py à jar_test3.py, qui ne tiennent pas les tables dérivées à jour
+    db_manager = ouvrir_base()
+    if db_manager.agregats_en_retard():
+        with st.spinner("Mise à jour des séries de l'eau brute et des agrégats de comparaison…"):
+            db_manager.rattraper_agregats()
     
     # Boutons d'accueil
     col1, col2, col3 = st.columns(3)
@@ -903,19 +4467,25 @@ def main():
         return
     
     if st.session_state.show_config:
-        configurer_reactifs()
+        try:
+            configurer_reactifs()
+        except ConflitConfiguration as e:
+            # Catalogue enregistré entre-temps par un autre processus : la page est rechargée avec sa version
+            st.session_state.conflit_configuration = str(e)
+            st.rerun()
         if st.button("← Retour à l'accueil"):
             st.session_state.show_config = False
             st.rerun()
         return
     
     # Configuration des paramètres
-    config_manager = ConfigManager()
-    config_parametres = config_manager.load_parametres()
+    with chronometre.section("chargement configuration"):
+        config_manager = ConfigManager()
+        config_parametres = config_manager.load_parametres()
     parametres_selectionnes = config_parametres.get("parametres_selectionnes", ["Turbidité", "pH", "DCO"])
     
     # Sidebar pour les informations générales
-    with st.sidebar:
+    with st.sidebar, chronometre.section("barre latérale"):
         st.header("📋 Informations Générales")
         date_test = st.date_input("Date du test", datetime.now())
         operateur = st.text_input("Opérateur", "")
@@ -963,13 +4533,14 @@ def main():
         st.metric("Débit annuel traité", f"{debit_annuel:,.2f} m³/an")
     
     # Chargement des configurations
-    coagulants_config = config_manager.load_coagulants()
-    floculants_config = config_manager.load_floculants()
+    with chronometre.section("chargement configuration"):
+        coagulants_config = config_manager.load_coagulants()
+        floculants_config = config_manager.load_floculants()
     
     # Onglets principaux
     tab1, tab2, tab3, tab4 = st.tabs(["🔄 Combinaisons", "📊 Saisie Essais", "📈 Résultats", "📄 Rapport Complet"])
     
-    with tab1:
+    with tab1, chronometre.section("onglet combinaisons"):
         st.markdown('<h2 class="section-header">Configuration des Combinaisons</h2>', unsafe_allow_html=True)
         
         if not coagulants_config:
@@ -979,6 +4550,8 @@ def main():
                 st.rerun()
             return
         
+        afficher_essais_similaires(caracteristiques)
+
         # Sélection des combinaisons coagulant/floculant
         col1, col2 = st.columns(2)
         
@@ -1056,8 +4629,10 @@ def main():
                     if st.button("❌", key=f"del_{i}"):
                         st.session_state.combinaisons.pop(i)
                         st.rerun()
+
+            afficher_plan_experiences(st.session_state.combinaisons, coagulants_config, floculants_config, volume_echantillon, caracteristiques)
     
-    with tab2:
+    with tab2, chronometre.section("grille de saisie"):
         st.markdown('<h2 class="section-header">Saisie des Essais</h2>', unsafe_allow_html=True)
         
         if not st.session_state.combinaisons:
@@ -1065,7 +4640,10 @@ def main():
             return
         
         # Initialisation de la base de données
-        db_manager = DatabaseManager()
+        db_manager = ouvrir_base()
+
+        afficher_import_instruments(st.session_state.combinaisons, coagulants_config, floculants_config, volume_echantillon, caracteristiques)
+        statistiques_site = db_manager.get_statistiques_eau_brute(site_prelevement, date_test)
         
         # Tableau de saisie pour chaque combinaison
         for combinaison in st.session_state.combinaisons:
@@ -1102,56 +4680,18 @@ def main():
             coagulant_info = next((c for c in coagulants_config if c["nom"] == coagulant_nom), coagulants_config[0])
             floculant_info = next((f for f in floculants_config if f["nom"] == floculant_nom), floculants_config[0])
             
-            # Initialiser le tableau pour cette combinaison
-            if combinaison not in st.session_state.tableau_essais:
-                donnees_initiales = []
-                for i in range(nombre_essais):
-                    # Calcul des dosages par défaut
-                    coag_ml = 0.0
-                    floc_ml = 0.0
-                    coag_ppm_com = 0.0
-                    floc_ppm_com = 0.0
-                    
-                    if coagulant_info and coagulant_info['nom'] != "Aucun":
-                        volume_ppm_coag = calculer_volume_ppm(coagulant_info['dilution'], coagulant_info['densite'], coagulant_info['matiere_active'])
-                        # Incrémentation de 50 ppm pour chaque essai à partir du 2ème
-                        coag_ppm_com = i * 50 if i > 0 else 0.0
-                        coag_ml = coag_ppm_com * volume_ppm_coag * volume_echantillon
-                    
-                    if floculant_info and floculant_info['nom'] != "Aucun":
-                        # 1 ppm commercial pour tous les essais sauf le premier
-                        floc_ppm_com = 1.0 if i > 0 else 0.0
-                        volume_ppm_floc = calculer_volume_ppm(floculant_info['dilution'], floculant_info['densite'], floculant_info['matiere_active'])
-                        floc_ml = floc_ppm_com * volume_ppm_floc * volume_echantillon
-                    
-                    donnees_initiales.append({
-                        'Essai': i + 1,
-                        'Coagulant_ml': coag_ml,
-                        'Floculant_ml': floc_ml,
-                        'Coagulant_ppm_com': coag_ppm_com,
-                        'Floculant_ppm_com': floc_ppm_com,
-                        'DCO_entree': caracteristiques.get('dco_entree', 0.0),
-                        'pH_entree': caracteristiques.get('ph_entree', 0.0),
-                        'DCO_sortie': 0.0,
-                        'pH_sortie': 0.0,
-                        'V_boue': 0.0,
-                        'Turbidite': '',
-                        'Abattement': 0.0,
-                        'Turbidite_entree': caracteristiques.get('turbidite_entree', 0.0),
-                        'Turbidite_sortie': 0.0,
-                        'Couleur_entree': caracteristiques.get('couleur_entree', 0.0),
-                        'Couleur_sortie': 0.0,
-                        'MES_entree': caracteristiques.get('mes_entree', 0.0),
-                        'MES_sortie': 0.0,
-                        'UV254_entree': caracteristiques.get('uv254_entree', 0.0),
-                        'UV254_sortie': 0.0,
-                        'Aluminium_residuel': 0.0,
-                        'Fer_residuel': 0.0,
-                        'Conductivite_entree': caracteristiques.get('conductivite_entree', 0.0),
-                        'Conductivite_sortie': 0.0
-                    })
-                
-                st.session_state.tableau_essais[combinaison] = pd.DataFrame(donnees_initiales)
+            # Initialiser le tableau pour cette combinaison, ou le compléter si le nombre d'essais augmente
+            tableau = st.session_state.tableau_essais.get(combinaison)
+            deja_saisis = 0 if tableau is None else len(tableau)
+            if deja_saisis < nombre_essais:
+                essais = np.arange(deja_saisis, nombre_essais)
+                nouveaux = creer_tableau_essais(
+                    essais * 50.0,                    # Incrémentation de 50 ppm pour chaque essai à partir du 2ème
+                    np.where(essais > 0, 1.0, 0.0),   # 1 ppm commercial pour tous les essais sauf le premier
+                    coagulant_info, floculant_info, volume_echantillon, caracteristiques
+                )
+                nouveaux['Essai'] += deja_saisis
+                st.session_state.tableau_essais[combinaison] = nouveaux if tableau is None else pd.concat([tableau, nouveaux], ignore_index=True)
             
             # Interface de saisie
             st.write("**Tableau de saisie:**")
@@ -1275,10 +4815,22 @@ def main():
                     else:
                         st.write("")
             
+            afficher_proposition_bayesienne(combinaison, coagulant_info, floculant_info, volume_echantillon, caracteristiques, db_manager,
+                                            (str(date_test), operateur, site_prelevement))
+
+            # Contrôle des valeurs saisies avant enregistrement
+            anomalies = detecter_anomalies(st.session_state.tableau_essais[combinaison].iloc[:nombre_essais], statistiques_site)
+            forcer = True
+            if not anomalies.empty:
+                st.warning(f"⚠️ {len(anomalies)} valeur(s) suspecte(s) : vérifiez la saisie avant d'enregistrer")
+                st.dataframe(anomalies, use_container_width=True)
+                forcer = st.checkbox("Enregistrer malgré les valeurs suspectes", key=f"forcer_{combinaison}")
+
             # Bouton d'enregistrement dans la base de données
-            if st.button(f"💾 Enregistrer {combinaison} dans la base de données"):
+            if st.button(f"💾 Enregistrer {combinaison} dans la base de données", disabled=not forcer):
+                lignes = []
                 for i in range(nombre_essais):
-                    data = {
+                    lignes.append({
                         'date_test': str(date_test),
                         'operateur': operateur,
                         'site_prelevement': site_prelevement,
@@ -1311,161 +4863,163 @@ def main():
                         'fer_residuel': st.session_state.tableau_essais[combinaison].iloc[i]['Fer_residuel'],
                         'conductivite_entree': st.session_state.tableau_essais[combinaison].iloc[i]['Conductivite_entree'],
                         'conductivite_sortie': st.session_state.tableau_essais[combinaison].iloc[i]['Conductivite_sortie']
-                    }
-                    db_manager.save_mesure(data)
+                    })
+                db_manager.save_mesures(lignes)
                 st.success(f"Combinaison {combinaison} enregistrée dans la base de données!")
             
             st.markdown("---")
     
-    with tab3:
+    with tab3, chronometre.section("onglet résultats"):
         st.markdown('<h2 class="section-header">Résultats des Essais</h2>', unsafe_allow_html=True)
         
         # Récupérer les données de la base
-        db_manager = DatabaseManager()
-        mesures_db = db_manager.get_all_mesures()
-        
-        if not mesures_db.empty:
-            # Filtrer les mesures de la session courante
-            mesures_courantes = mesures_db[
-                (mesures_db['date_test'] == str(date_test)) & 
-                (mesures_db['operateur'] == operateur) &
-                (mesures_db['site_prelevement'] == site_prelevement)
-            ]
-            
-            if not mesures_courantes.empty:
-                afficher_tableaux_resultats(mesures_courantes)
-            else:
-                st.info("Aucune donnée disponible pour la session courante. Veuillez enregistrer des essais dans l'onglet 'Saisie Essais'.")
+        db_manager = ouvrir_base()
+        # Seuls les essais de la session courante sont lus, pas toute la base
+        mesures_courantes = db_manager.get_mesures_session(date_test, operateur, site_prelevement)
+        
+        if not mesures_courantes.empty:
+            afficher_tableaux_resultats(mesures_courantes)
+            st.markdown("---")
+            afficher_selection_multicritere(mesures_courantes, db_manager, coagulants_config, floculants_config, site_prelevement)
         else:
-            st.info("Aucune donnée dans la base de données. Veuillez enregistrer des essais dans l'onglet 'Saisie Essais'.")
-    
-    with tab4:
+            st.info("Aucune donnée disponible pour la session courante. Veuillez enregistrer des essais dans l'onglet 'Saisie Essais'.")
+
+        if st.session_state.tableau_essais:
+            st.markdown("---")
+            afficher_optimisation_cout(st.session_state.tableau_essais, coagulants_config, floculants_config, debit_annuel)
+
+    with tab4, chronometre.section("construction du rapport"):
         st.markdown('<h2 class="section-header">Rapport Complet</h2>', unsafe_allow_html=True)
         
         # Génération du rapport basé sur la base de données
-        db_manager = DatabaseManager()
-        mesures_db = db_manager.get_all_mesures()
-        
-        if not mesures_db.empty:
-            mesures_courantes = mesures_db[
-                (mesures_db['date_test'] == str(date_test)) & 
-                (mesures_db['operateur'] == operateur) &
-                (mesures_db['site_prelevement'] == site_prelevement)
-            ]
+        db_manager = ouvrir_base()
+        mesures_courantes = db_manager.get_mesures_session(date_test, operateur, site_prelevement)
+        
+        if not mesures_courantes.empty:
+            # Meilleur résultat selon la pondération multicritère de l'onglet Résultats
+            selection = scorer_essais(mesures_courantes, coagulants_config, floculants_config,
+                                      poids_selection(), st.session_state.get("ph_cible", 7.0))
+            meilleur_abattement = selection.iloc[0]
             
-            if not mesures_courantes.empty:
-                # Trouver les meilleurs résultats
-                meilleur_abattement = mesures_courantes.loc[mesures_courantes['abattement'].idxmax()]
-                
-                # Afficher le rapport dans Streamlit
-                st.markdown("### 📋 Rapport Jar Test offert par https://viveleau-services.com/ - Traitement des Eaux")
-                
-                with st.container():
-                    st.markdown('<div class="rapport-section">', unsafe_allow_html=True)
-                    st.subheader("📋 Informations Générales")
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.write(f"**Date du test:** {date_test}")
-                        st.write(f"**Opérateur:** {operateur}")
-                    with col2:
-                        st.write(f"**Site de prélèvement:** {site_prelevement}")
-                        st.write(f"**Type d'eau:** {type_eau}")
-                    st.markdown('</div>', unsafe_allow_html=True)
-                
-                with st.container():
-                    st.markdown('<div class="rapport-section">', unsafe_allow_html=True)
-                    st.subheader("⚙️ Paramètres du Test")
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.write(f"**Volume d'échantillon:** {volume_echantillon:.2f} L")
-                        st.write(f"**Temps de coagulation:** {temps_coagulation} min à {vitesse_coagulation} rpm")
-                    with col2:
-                        st.write(f"**Temps de floculation:** {temps_floculation} min à {vitesse_floculation} rpm")
-                    st.markdown('</div>', unsafe_allow_html=True)
-                
-                with st.container():
-                    st.markdown('<div class="rapport-section">', unsafe_allow_html=True)
-                    st.subheader("🔬 Caractéristiques de l'eau brute")
-                    for param in parametres_selectionnes:
-                        if param in ["Turbidité", "Couleur", "pH", "Conductivité", "MES", "UV254", "DCO"]:
-                            valeur = caracteristiques.get(f"{param.lower().replace(' ', '_').replace('é', 'e')}_entree", "N/A")
-                            st.write(f"**{param}:** {valeur:.2f}")
-                    st.markdown('</div>', unsafe_allow_html=True)
-                
-                with st.container():
-                    st.markdown('<div class="rapport-section">', unsafe_allow_html=True)
-                    st.subheader("🏆 Meilleur Résultat")
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.write(f"**Combinaison:** {meilleur_abattement['combinaison']}")
-                        st.write(f"**Essai:** {int(meilleur_abattement['essai'])}")
-                    with col2:
-                        st.write(f"**Abattement DCO:** {meilleur_abattement['abattement']:.2f}%")
-                        st.write(f"**Volume de boue:** {meilleur_abattement['v_boue']:.2f} mL")
-                    st.markdown('</div>', unsafe_allow_html=True)
+            # Afficher le rapport dans Streamlit
+            st.markdown("### 📋 Rapport Jar Test offert par https://viveleau-services.com/ - Traitement des Eaux")
+            
+            with st.container():
+                st.markdown('<div class="rapport-section">', unsafe_allow_html=True)
+                st.subheader("📋 Informations Générales")
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.write(f"**Date du test:** {date_test}")
+                    st.write(f"**Opérateur:** {operateur}")
+                with col2:
+                    st.write(f"**Site de prélèvement:** {site_prelevement}")
+                    st.write(f"**Type d'eau:** {type_eau}")
+                st.markdown('</div>', unsafe_allow_html=True)
+            
+            with st.container():
+                st.markdown('<div class="rapport-section">', unsafe_allow_html=True)
+                st.subheader("⚙️ Paramètres du Test")
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.write(f"**Volume d'échantillon:** {volume_echantillon:.2f} L")
+                    st.write(f"**Temps de coagulation:** {temps_coagulation} min à {vitesse_coagulation} rpm")
+                with col2:
+                    st.write(f"**Temps de floculation:** {temps_floculation} min à {vitesse_floculation} rpm")
+                st.markdown('</div>', unsafe_allow_html=True)
+            
+            with st.container():
+                st.markdown('<div class="rapport-section">', unsafe_allow_html=True)
+                st.subheader("🔬 Caractéristiques de l'eau brute")
+                for param in parametres_selectionnes:
+                    if param in ["Turbidité", "Couleur", "pH", "Conductivité", "MES", "UV254", "DCO"]:
+                        valeur = caracteristiques.get(f"{param.lower().replace(' ', '_').replace('é', 'e')}_entree", "N/A")
+                        st.write(f"**{param}:** {valeur:.2f}")
+                st.markdown('</div>', unsafe_allow_html=True)
+            
+            with st.container():
+                st.markdown('<div class="rapport-section">', unsafe_allow_html=True)
+                st.subheader("🏆 Meilleur Résultat")
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.write(f"**Combinaison:** {meilleur_abattement['combinaison']}")
+                    st.write(f"**Essai:** {int(meilleur_abattement['essai'])}")
+                with col2:
+                    st.write(f"**Abattement DCO:** {meilleur_abattement['abattement']:.2f}%")
+                    st.write(f"**Volume de boue:** {meilleur_abattement['v_boue']:.2f} mL")
+                st.write(f"**Score multicritère:** {meilleur_abattement['score']:.1f}/100")
+                st.markdown('</div>', unsafe_allow_html=True)
+            
+            # Afficher les tableaux des essais
+            with st.container():
+                st.markdown('<div class="rapport-section">', unsafe_allow_html=True)
+                st.subheader("📊 Tableaux des Essais")
                 
-                # Afficher les tableaux des essais
-                with st.container():
-                    st.markdown('<div class="rapport-section">', unsafe_allow_html=True)
-                    st.subheader("📊 Tableaux des Essais")
+                for combinaison, df in st.session_state.tableau_essais.items():
+                    st.markdown(f"**{combinaison}**")
                     
-                    for combinaison, df in st.session_state.tableau_essais.items():
-                        st.markdown(f"**{combinaison}**")
+                    # Créer un tableau formaté
+                    tableau_data = []
+                    for i, row in df.iterrows():
+                        # Trouver les infos des réactifs pour cette combinaison
+                        coag_nom = "Aucun"
+                        floc_nom = "Aucun"
+                        if "Coagulant seul:" in combinaison:
+                            coag_nom = combinaison.replace("Coagulant seul: ", "")
+                        elif "Floculant seul:" in combinaison:
+                            floc_nom = combinaison.replace("Floculant seul: ", "")
+                        elif " + " in combinaison:
+                            parts = combinaison.split(" + ")
+                            coag_nom = parts[0]
+                            floc_nom = parts[1]
+                        
+                        coag_info = next((c for c in coagulants_config if c["nom"] == coag_nom), None)
+                        floc_info = next((f for f in floculants_config if f["nom"] == floc_nom), None)
                         
-                        # Créer un tableau formaté
-                        tableau_data = []
-                        for i, row in df.iterrows():
-                            # Trouver les infos des réactifs pour cette combinaison
-                            coag_nom = "Aucun"
-                            floc_nom = "Aucun"
-                            if "Coagulant seul:" in combinaison:
-                                coag_nom = combinaison.replace("Coagulant seul: ", "")
-                            elif "Floculant seul:" in combinaison:
-                                floc_nom = combinaison.replace("Floculant seul: ", "")
-                            elif " + " in combinaison:
-                                parts = combinaison.split(" + ")
-                                coag_nom = parts[0]
-                                floc_nom = parts[1]
-                            
-                            coag_info = next((c for c in coagulants_config if c["nom"] == coag_nom), None)
-                            floc_info = next((f for f in floculants_config if f["nom"] == floc_nom), None)
-                            
-                            coag_actif = calculer_ppm_actif(row['Coagulant_ppm_com'], coag_info['matiere_active']) if coag_info and coag_info['nom'] != "Aucun" else 0
-                            floc_actif = calculer_ppm_actif(row['Floculant_ppm_com'], floc_info['matiere_active']) if floc_info and floc_info['nom'] != "Aucun" else 0
-                            
-                            tableau_data.append({
-                                'Essai': int(row['Essai']),
-                                'Coag (ppm)': f"{row['Coagulant_ppm_com']:.1f}",
-                                'Coag (actif)': f"{coag_actif:.1f}",
-                                'Floc (ppm)': f"{row['Floculant_ppm_com']:.1f}",
-                                'Floc (actif)': f"{floc_actif:.1f}",
-                                'DCO e': f"{row['DCO_entree']:.0f}",
-                                'DCO s': f"{row['DCO_sortie']:.0f}",
-                                'Abatt%': f"{row['Abattement']:.1f}%",
-                                'V boue': f"{row['V_boue']:.1f}"
-                            })
+                        coag_actif = calculer_ppm_actif(row['Coagulant_ppm_com'], coag_info['matiere_active']) if coag_info and coag_info['nom'] != "Aucun" else 0
+                        floc_actif = calculer_ppm_actif(row['Floculant_ppm_com'], floc_info['matiere_active']) if floc_info and floc_info['nom'] != "Aucun" else 0
                         
-                        st.dataframe(pd.DataFrame(tableau_data), use_container_width=True)
+                        tableau_data.append({
+                            'Essai': int(row['Essai']),
+                            'Coag (ppm)': f"{row['Coagulant_ppm_com']:.1f}",
+                            'Coag (actif)': f"{coag_actif:.1f}",
+                            'Floc (ppm)': f"{row['Floculant_ppm_com']:.1f}",
+                            'Floc (actif)': f"{floc_actif:.1f}",
+                            'DCO e': f"{row['DCO_entree']:.0f}",
+                            'DCO s': f"{row['DCO_sortie']:.0f}",
+                            'Abatt%': f"{row['Abattement']:.1f}%",
+                            'V boue': f"{row['V_boue']:.1f}"
+                        })
                     
-                    st.markdown('</div>', unsafe_allow_html=True)
-                
-                # Générer et télécharger le rapport HTML
-                rapport_html = generer_rapport_html(
-                    date_test, operateur, site_prelevement, type_eau, volume_echantillon,
-                    temps_coagulation, vitesse_coagulation, temps_floculation, vitesse_floculation,
-                    caracteristiques, debit_eau, debit_annuel, meilleur_abattement, coagulants_config, floculants_config,
-                    st.session_state.tableau_essais
-                )
-                
-                st.download_button(
-                    label="📥 Télécharger le rapport complet (HTML)",
-                    data=rapport_html,
-                    file_name=f"rapport_jar_test_{date_test}.html",
-                    mime="text/html"
-                )
+                    st.dataframe(pd.DataFrame(tableau_data), use_container_width=True)
                 
-                # Téléchargement du rapport en TXT
-                rapport_txt = f"""
+                st.markdown('</div>', unsafe_allow_html=True)
+
+            # Projection annuelle de la consommation en réactifs
+            projection = projeter_consommation_annuelle(st.session_state.tableau_essais, coagulants_config, floculants_config, debit_annuel)
+            if not projection.empty:
+                with st.container():
+                    st.markdown('<div class="rapport-section">', unsafe_allow_html=True)
+                    st.subheader("💶 Projection annuelle des réactifs")
+                    st.dataframe(projection.round(2), use_container_width=True)
+                    st.markdown('</div>', unsafe_allow_html=True)
+
+            # Générer et télécharger le rapport HTML
+            rapport_html = generer_rapport_html(
+                date_test, operateur, site_prelevement, type_eau, volume_echantillon,
+                temps_coagulation, vitesse_coagulation, temps_floculation, vitesse_floculation,
+                caracteristiques, debit_eau, debit_annuel, meilleur_abattement, coagulants_config, floculants_config,
+                st.session_state.tableau_essais, selection
+            )
+            
+            st.download_button(
+                label="📥 Télécharger le rapport complet (HTML)",
+                data=rapport_html,
+                file_name=f"rapport_jar_test_{date_test}.html",
+                mime="text/html"
+            )
+            
+            # Téléchargement du rapport en TXT
+            rapport_txt = f"""
 RAPPORT JAR TEST - TRAITEMENT DES EAUX
 
 INFORMATIONS GÉNÉRALES
@@ -1481,64 +5035,82 @@ Temps de floculation: {temps_floculation} min à {vitesse_floculation} rpm
 
 CARACTÉRISTIQUES DE L'EAU BRUTE
 """
-                for param in parametres_selectionnes:
-                    if param in ["Turbidité", "Couleur", "pH", "Conductivité", "MES", "UV254", "DCO"]:
-                        valeur = caracteristiques.get(f"{param.lower().replace(' ', '_').replace('é', 'e')}_entree", "N/A")
-                        rapport_txt += f"{param}: {valeur:.2f}\n"
-                
-                rapport_txt += f"""
+            for param in parametres_selectionnes:
+                if param in ["Turbidité", "Couleur", "pH", "Conductivité", "MES", "UV254", "DCO"]:
+                    valeur = caracteristiques.get(f"{param.lower().replace(' ', '_').replace('é', 'e')}_entree", "N/A")
+                    rapport_txt += f"{param}: {valeur:.2f}\n"
+            
+            rapport_txt += f"""
 MEILLEUR RÉSULTAT
 Combinaison: {meilleur_abattement['combinaison']}
 Essai: {int(meilleur_abattement['essai'])}
 Abattement DCO: {meilleur_abattement['abattement']:.2f}%
 Volume de boue: {meilleur_abattement['v_boue']:.2f} mL
-
-TABLEAUX DES ESSAIS
+Score multicritère: {meilleur_abattement['score']:.1f}/100
 """
+
+            rapport_txt += "\nCLASSEMENT MULTICRITÈRE (✓ : front de Pareto)\n"
+            vue = tableau_selection(selection)
+            rapport_txt += " | ".join(vue.columns) + "\n"
+            for _, ligne in vue.iterrows():
+                rapport_txt += " | ".join(
+                    ("✓" if valeur else "") if colonne == "Pareto" else
+                    ("" if isinstance(valeur, float) and np.isnan(valeur) else f"{valeur:.2f}" if isinstance(valeur, float) else str(valeur))
+                    for colonne, valeur in ligne.items()
+                ) + "\n"
+
+            if not projection.empty:
+                rapport_txt += "\nPROJECTION ANNUELLE DES RÉACTIFS\n"
+                rapport_txt += "Combinaison | Essai | Coag (kg/an) | Coag (€/an) | Floc (kg/an) | Floc (€/an) | Total (€/an) | €/m³\n"
+                for _, ligne in projection.iterrows():
+                    rapport_txt += f"{ligne['Combinaison']} | {ligne['Essai']} | {ligne['Coag commercial (kg/an)']:,.1f} | {ligne['Coag (€/an)']:,.2f} | {ligne['Floc commercial (kg/an)']:,.1f} | {ligne['Floc (€/an)']:,.2f} | {ligne['Total (€/an)']:,.2f} | {ligne['Coût (€/m³)']:.4f}\n"
+
+            rapport_txt += "\nTABLEAUX DES ESSAIS\n"
+
+            for combinaison, df in st.session_state.tableau_essais.items():
+                rapport_txt += f"\n{combinaison}\n"
+                rapport_txt += "Essai | Coag (ppm) | Coag (actif) | Floc (ppm) | Floc (actif) | DCO e | DCO s | Abatt% | V boue\n"
+                rapport_txt += "------|------------|--------------|------------|--------------|-------|-------|--------|--------\n"
                 
-                for combinaison, df in st.session_state.tableau_essais.items():
-                    rapport_txt += f"\n{combinaison}\n"
-                    rapport_txt += "Essai | Coag (ppm) | Coag (actif) | Floc (ppm) | Floc (actif) | DCO e | DCO s | Abatt% | V boue\n"
-                    rapport_txt += "------|------------|--------------|------------|--------------|-------|-------|--------|--------\n"
+                for i, row in df.iterrows():
+                    coag_nom = "Aucun"
+                    floc_nom = "Aucun"
+                    if "Coagulant seul:" in combinaison:
+                        coag_nom = combinaison.replace("Coagulant seul: ", "")
+                    elif "Floculant seul:" in combinaison:
+                        floc_nom = combinaison.replace("Floculant seul: ", "")
+                    elif " + " in combinaison:
+                        parts = combinaison.split(" + ")
+                        coag_nom = parts[0]
+                        floc_nom = parts[1]
                     
-                    for i, row in df.iterrows():
-                        coag_nom = "Aucun"
-                        floc_nom = "Aucun"
-                        if "Coagulant seul:" in combinaison:
-                            coag_nom = combinaison.replace("Coagulant seul: ", "")
-                        elif "Floculant seul:" in combinaison:
-                            floc_nom = combinaison.replace("Floculant seul: ", "")
-                        elif " + " in combinaison:
-                            parts = combinaison.split(" + ")
-                            coag_nom = parts[0]
-                            floc_nom = parts[1]
-                        
-                        coag_info = next((c for c in coagulants_config if c["nom"] == coag_nom), None)
-                        floc_info = next((f for f in floculants_config if f["nom"] == floc_nom), None)
-                        
-                        coag_actif = calculer_ppm_actif(row['Coagulant_ppm_com'], coag_info['matiere_active']) if coag_info and coag_info['nom'] != "Aucun" else 0
-                        floc_actif = calculer_ppm_actif(row['Floculant_ppm_com'], floc_info['matiere_active']) if floc_info and floc_info['nom'] != "Aucun" else 0
-                        
-                        rapport_txt += f"{int(row['Essai'])} | {row['Coagulant_ppm_com']:.1f} | {coag_actif:.1f} | {row['Floculant_ppm_com']:.1f} | {floc_actif:.1f} | {row['DCO_entree']:.0f} | {row['DCO_sortie']:.0f} | {row['Abattement']:.1f}% | {row['V_boue']:.1f}\n"
-                
-                date_gen = datetime.now().strftime("%d/%m/%Y à %H:%M")
-                rapport_txt += f"\n---\nRapport généré automatiquement par Viveleau_Jar_Test le {date_gen} - visitez notre site : https://viveleau-services.com/"
-                
-                st.download_button(
-                    label="📥 Télécharger le rapport complet (TXT)",
-                    data=rapport_txt,
-                    file_name=f"rapport_jar_test_{date_test}.txt",
-                    mime="text/plain"
-                )
-                
-            else:
-                st.info("Aucune donnée disponible pour la session courante. Veuillez enregistrer des essais dans l'onglet 'Saisie Essais'.")
+                    coag_info = next((c for c in coagulants_config if c["nom"] == coag_nom), None)
+                    floc_info = next((f for f in floculants_config if f["nom"] == floc_nom), None)
+                    
+                    coag_actif = calculer_ppm_actif(row['Coagulant_ppm_com'], coag_info['matiere_active']) if coag_info and coag_info['nom'] != "Aucun" else 0
+                    floc_actif = calculer_ppm_actif(row['Floculant_ppm_com'], floc_info['matiere_active']) if floc_info and floc_info['nom'] != "Aucun" else 0
+                    
+                    rapport_txt += f"{int(row['Essai'])} | {row['Coagulant_ppm_com']:.1f} | {coag_actif:.1f} | {row['Floculant_ppm_com']:.1f} | {floc_actif:.1f} | {row['DCO_entree']:.0f} | {row['DCO_sortie']:.0f} | {row['Abattement']:.1f}% | {row['V_boue']:.1f}\n"
+            
+            date_gen = datetime.now().strftime("%d/%m/%Y à %H:%M")
+            rapport_txt += f"\n---\nRapport généré automatiquement par Viveleau_Jar_Test le {date_gen} - visitez notre site : https://viveleau-services.com/"
+            
+            st.download_button(
+                label="📥 Télécharger le rapport complet (TXT)",
+                data=rapport_txt,
+                file_name=f"rapport_jar_test_{date_test}.txt",
+                mime="text/plain"
+            )
+            
         else:
-            st.info("Aucune donnée dans la base de données. Veuillez enregistrer des essais dans l'onglet 'Saisie Essais'.")
+            st.info("Aucune donnée disponible pour la session courante. Veuillez enregistrer des essais dans l'onglet 'Saisie Essais'.")
 
 if __name__ == "__main__":
 
-    main()
+    with chronometre.section("rerun complet"):
+        main()
+    afficher_diagnostic()
+    afficher_trace_sql()
 
 
 
@@ -0,0 +1,63 @@
+"""Migrations du schéma de la base Jar Test (fichier SQLite ou serveur PostgreSQL).
+
+Chaque base enregistre dans schema_migrations les versions de schéma qu'elle a reçues ; l'application
+applique les migrations en attente à son démarrage (DatabaseManager.MIGRATIONS). Ce script permet de le
+faire à l'avance, par exemple avant la mise à jour d'une grosse base, en suivant l'avancement des tables
+reconstruites par lots, d'afficher l'état d'une base ou de s'arrêter à une version donnée. Une base créée
+par jar_test1.py à jar_test3.py (même table mesures_jar_test) se met à jour de la même façon.
+
+Les migrations ne se défont pas : pour revenir en arrière, restaurer une sauvegarde (sauvegarde.py).
+
+Exemple :
+    python migration.py --etat
+    python migration.py --base jar_test_database.db --taille-lot 20000
+    python migration.py --base postgresql://jar_test@serveur/jar_test --cible 1
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrations du schéma de la base Jar Test")
+    parser.add_argument("--base", default=None, help="Fichier SQLite ou URL postgresql:// (par défaut JAR_TEST_BASE, sinon jar_test_database.db)")
+    parser.add_argument("--etat", action="store_true", help="Affiche les migrations appliquées et en attente sans rien modifier")
+    parser.add_argument("--cible", type=int, default=None, help="Dernière version à appliquer (par défaut toutes)")
+    parser.add_argument("--taille-lot", type=int, default=None, help="Lignes recopiées par transaction lors d'une reconstruction de table")
+    args = parser.parse_args()
+
+    # Migrations définies par l'application, importée sans navigateur
+    logging.disable(logging.WARNING)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from jar_test4 import ouvrir_base
+    adresse = args.base or os.environ.get("JAR_TEST_BASE", "jar_test_database.db")
+    if not adresse.startswith(("postgresql://", "postgres://")) and not os.path.exists(adresse):
+        sys.exit(f"Base introuvable : {adresse}")
+    db_manager = ouvrir_base(adresse, migrer_schema=False)
+
+    etat = db_manager.etat_migrations()
+    if args.etat:
+        for version, description, appliquee_le in etat:
+            print(f"{version:4d}  {appliquee_le or 'en attente':<19}  {description}")
+        return
+
+    en_attente = [(version, description) for version, description, appliquee_le in etat
+                  if appliquee_le is None and (args.cible is None or version <= args.cible)]
+    if not en_attente:
+        print("Schéma à jour")
+        return
+    for version, description in en_attente:
+        print(f"À appliquer : {version} - {description}")
+
+    def progression(copiees, total):
+        print(f"\r  {copiees} / {total} lignes recopiées", end="\n" if copiees == total else "", flush=True)
+
+    debut = time.perf_counter()
+    appliquees = db_manager.migrer(args.cible, args.taille_lot, progression)
+    print(f"{len(appliquees)} migration(s) appliquée(s) en {time.perf_counter() - debut:.1f} s {sorted(appliquees)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Sauvegarde à chaud et restauration de jar_test_database.db.
+
+La base est copiée par l'API de sauvegarde en ligne de SQLite, par étapes de
+`--pages-par-etape` pages séparées de `--pause` secondes : l'application peut continuer
+d'enregistrer pendant la copie. Chaque instantané (sauvegardes/<base>_<AAAAMMJJ_HHMMSS>.db)
+est vérifié avant d'être publié ; seuls les `--conserver` plus récents sont gardés.
+La restauration sauvegarde d'abord l'état courant (étiquette avant_restauration).
+
+Les bases d'archive (archives/) ne changent qu'à l'archivage et ne sont pas copiées : un
+instantané antérieur à un archivage est restauré sans les essais archivés depuis.
+
+Exemple (planificateur de tâches, toutes les heures pendant les essais) :
+    python sauvegarde.py --base jar_test_database.db --conserver 48
+    python sauvegarde.py --lister
+    python sauvegarde.py --restaurer sauvegardes/jar_test_database_20260301_140000.db
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sauvegarde et restauration de la base Jar Test")
+    parser.add_argument("--base", default="jar_test_database.db")
+    parser.add_argument("--conserver", type=int, default=14, help="Nombre d'instantanés conservés")
+    parser.add_argument("--pages-par-etape", type=int, default=256, help="Pages copiées par étape")
+    parser.add_argument("--pause", type=float, default=0.05, help="Pause entre deux étapes (s)")
+    parser.add_argument("--lister", action="store_true", help="Affiche les instantanés existants")
+    parser.add_argument("--restaurer", metavar="INSTANTANE", help="Remplace la base par cet instantané")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from jar_test4 import DatabaseManager
+    db_manager = DatabaseManager(args.base)
+
+    if args.lister:
+        for sauvegarde in db_manager.lister_sauvegardes():
+            print(f"{sauvegarde['date']:%d/%m/%Y %H:%M:%S}  {sauvegarde['taille_mo']:8.1f} Mo  {sauvegarde['chemin']}")
+        return
+
+    debut = time.perf_counter()
+    if args.restaurer:
+        securite = db_manager.restaurer(args.restaurer)
+        print(f"Base restaurée depuis {args.restaurer} en {time.perf_counter() - debut:.1f} s "
+              f"(état précédent : {securite})")
+        return
+
+    chemin = db_manager.sauvegarder(args.pages_par_etape, args.pause, args.conserver)
+    print(f"Instantané {chemin} ({os.path.getsize(chemin) / 1024 ** 2:.1f} Mo) en {time.perf_counter() - debut:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
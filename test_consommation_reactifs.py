@@ -0,0 +1,66 @@
+"""Consommation et coût annuels des réactifs de jar_test4.py (python -m pytest test_consommation_reactifs.py)"""
+import logging
+
+import pandas as pd
+import pytest
+
+logging.disable(logging.WARNING)
+from jar_test4 import (calculer_consommation_annuelle, caracteristiques_reactif, classer_catalogue,
+                       optimiser_cout_reactifs, projeter_consommation_annuelle)
+
+# FeCl3 à 40 % de matière active, livré pur : 50 ppm commerciaux sur 1 000 000 m³/an
+# -> 50 000 kg commerciaux, 20 000 kg actifs, 50 000 / 1,45 L et 50 000 x 0,30 €
+FECL3 = {"nom": "FeCl3", "dilution": 1.0, "densite": 1.45, "matiere_active": 40.0, "prix_kg": 0.30}
+FLOCULANT_SOLIDE = {"nom": "EM_540", "dilution": 0.1, "densite": 1.0, "matiere_active": 100.0, "prix_kg": 4.0}
+
+
+def test_consommation_calculee_a_la_main():
+    volume_l, masse_commerciale, masse_active, cout = calculer_consommation_annuelle(
+        50.0, *caracteristiques_reactif(FECL3), 1_000_000)
+    assert masse_commerciale == pytest.approx(50_000)
+    assert masse_active == pytest.approx(20_000)
+    assert volume_l == pytest.approx(50_000 / 1.45)
+    assert cout == pytest.approx(15_000)
+
+
+def test_dilution_sans_effet_sur_les_masses():
+    # La dilution ne sert qu'à convertir les mL dosés en ppm : 1 ppm de floculant reste 1 g/m³
+    _, masse_commerciale, masse_active, cout = calculer_consommation_annuelle(
+        1.0, *caracteristiques_reactif(FLOCULANT_SOLIDE), 1_000_000)
+    assert (masse_commerciale, masse_active, cout) == pytest.approx((1_000, 1_000, 4_000))
+
+
+def test_projection_coherente_avec_les_ppm_actifs():
+    tableau = {"FeCl3 + EM_540": pd.DataFrame({
+        'Essai': [1, 2], 'Coagulant_ppm_com': [50.0, 100.0], 'Floculant_ppm_com': [0.5, 1.0]})}
+    projection = projeter_consommation_annuelle(tableau, [FECL3], [FLOCULANT_SOLIDE], 1_000_000)
+    # kg actifs/an = ppm actifs x débit / 1000
+    assert projection['Coag actif (kg/an)'].tolist() == pytest.approx([20_000, 40_000])
+    assert projection['Floc commercial (kg/an)'].tolist() == pytest.approx([500, 1_000])
+    assert projection['Coût (€/m³)'].tolist() == pytest.approx([0.017, 0.034])
+
+
+# Même prix du kg de matière active (0,27 / 0,45 = 0,09 / 0,15 = 0,60 €) : à dose active égale, même coût
+PRODUIT_CONCENTRE = {"nom": "A", "dilution": 1.0, "densite": 1.4, "matiere_active": 45.0, "prix_kg": 0.27}
+PRODUIT_DILUE = {"nom": "B", "dilution": 0.5, "densite": 1.1, "matiere_active": 15.0, "prix_kg": 0.09}
+FLOCULANT = {"nom": "F", "dilution": 1.0, "densite": 1.0, "matiere_active": 100.0, "prix_kg": 3.0}
+
+
+def test_catalogue_ex_aequo_a_prix_actif_egal():
+    classement = classer_catalogue({"A + F": 20_000.0}, [PRODUIT_CONCENTRE, PRODUIT_DILUE])
+    assert classement['Coût annuel (€/an)'].tolist() == pytest.approx([12_000, 12_000])
+    assert classement['Rang'].tolist() == [1, 1]
+
+
+def test_optimisation_egale_a_dose_active_egale():
+    # B dosé trois fois plus en ppm commerciaux que A pour le même abattement : mêmes ppm actifs
+    def essais(doses_coag):
+        return pd.DataFrame({'Coagulant_ppm_com': doses_coag, 'Floculant_ppm_com': [1.0, 1.0, 1.0],
+                             'DCO_sortie': [90.0, 60.0, 30.0], 'Abattement': [40.0, 60.0, 80.0]})
+    tableau = {"A + F": essais([25.0, 50.0, 75.0]), "B + F": essais([75.0, 150.0, 225.0])}
+    resultats = optimiser_cout_reactifs(tableau, [PRODUIT_CONCENTRE, PRODUIT_DILUE], [FLOCULANT],
+                                        1_000_000, "Abattement DCO minimal (%)", 70.0)
+    assert resultats['Objectif atteint'].all()
+    assert resultats['Coag actif (kg/an)'].tolist() == pytest.approx([28_125, 28_125])
+    # 62,5 kg de A ou 187,5 kg de B par 1000 m³, plus 1 kg de floculant : 0,016875 + 0,003 €/m³
+    assert resultats['Coût (€/m³)'].tolist() == pytest.approx([0.019875, 0.019875])
@@ -0,0 +1,28 @@
+"""Lecture des dates par import_historique.py (python -m pytest test_import_historique.py)"""
+import pandas as pd
+
+from import_historique import convertir_dates, preparer_bloc, proposer_correspondance
+
+
+def test_dates_iso_et_jour_en_premier():
+    dates = convertir_dates(pd.Series(["2020-05-01", "2020-05-13", "01/05/2020", "13/05/2020", "2020-05-01 10:30:00", "", None]))
+    attendues = ["2020-05-01", "2020-05-13", "2020-05-01", "2020-05-13", "2020-05-01", None, None]
+    assert [None if pd.isna(d) else d.strftime("%Y-%m-%d") for d in dates] == attendues
+
+
+def test_format_impose():
+    dates = convertir_dates(pd.Series(["05/13/2020", "13/05/2020"]), "%m/%d/%Y")
+    assert dates.iloc[0] == pd.Timestamp("2020-05-13")
+    assert pd.isna(dates.iloc[1])
+
+
+def test_bloc_iso_sans_rejet_ni_inversion():
+    # Bloc ISO commençant par une date ambiguë : aucune ligne rejetée, jour et mois conservés
+    bloc = pd.DataFrame({
+        'Date': ["2020-05-01", "2020-05-13", "2020-12-31", "14/07/2021"],
+        'Combinaison': ["PAC_18 + EM_540"] * 4,
+        'Pot': [1, 2, 3, 4],
+    })
+    mesures, rejetees = preparer_bloc(bloc, proposer_correspondance(bloc.columns), {})
+    assert rejetees == 0
+    assert mesures['date_test'].tolist() == ["2020-05-01", "2020-05-13", "2020-12-31", "2021-07-14"]